@@ -0,0 +1,226 @@
+"""
+admission.py
+
+生成任务的准入控制与限流：按实时队列深度与实测生成耗时估算等待时间，超出容量时降级或拒绝，
+而不是让所有任务一起变慢。
+
+- ServiceTimeEstimator：按档位（full / draft）记录生成耗时的指数滑动平均，启动时用音频库中最近
+  片段的实测耗时作为初值（没有时使用默认值）；
+- AdmissionController：跟踪排队中与运行中的任务及其预计耗时，`decide()` 给出新任务的 ETA 与决定：
+    accept   排队深度与预计等待都在上限内，按请求的档位生成；
+    degrade  完整档会超出等待上限，但只生成草稿档（更少的 token）可以在上限内完成；
+    reject   队列已满或连草稿档都来不及，返回 Retry-After（预计队列腾出空间所需的秒数）；
+  调用方在 degrade / reject 时可以先尝试片段库中已有的片段（不增加任何负载）；
+- RateLimiter：按客户端的令牌桶，防止单个浏览器反复提交把队列塞满。
+
+本模块只依赖标准库，Web 层可以直接导入。
+
+用法示例：
+    admission = AdmissionController(workers=1, max_queue_depth=8, max_wait_seconds=600)
+    decision = admission.decide(('draft', 'full'))
+    if decision.action != 'reject':
+        admission.enqueue(job_id, decision.tiers)
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# 没有实测数据时的默认生成耗时（秒）
+DEFAULT_SERVICE_SECONDS = {'full': 120.0, 'draft': 20.0}
+EWMA_ALPHA = 0.3
+
+
+class ServiceTimeEstimator:
+    """按档位的生成耗时估计（指数滑动平均）。线程安全。"""
+
+    def __init__(self, initial=None, alpha=EWMA_ALPHA):
+        self.alpha = alpha
+        self._seconds = dict(DEFAULT_SERVICE_SECONDS)
+        self._samples = {tier: 0 for tier in self._seconds}
+        self._lock = threading.Lock()
+        for tier, seconds in (initial or {}).items():
+            if seconds:
+                self._seconds[tier] = float(seconds)
+
+    def record(self, tier, seconds):
+        with self._lock:
+            if self._samples.get(tier):
+                self._seconds[tier] += self.alpha * (seconds - self._seconds[tier])
+            else:
+                # 第一个实测值直接替换初值
+                self._seconds[tier] = float(seconds)
+            self._samples[tier] = self._samples.get(tier, 0) + 1
+
+    def estimate(self, tiers):
+        """依次生成 tiers 中各档位的预计总耗时"""
+        with self._lock:
+            return sum(self._seconds.get(tier, DEFAULT_SERVICE_SECONDS['full']) for tier in tiers)
+
+    def snapshot(self):
+        with self._lock:
+            return {tier: {'seconds': round(seconds, 1), 'samples': self._samples.get(tier, 0)}
+                    for tier, seconds in self._seconds.items()}
+
+
+class Admission:
+    """准入决定。tiers 为实际要生成的档位（degrade 时只有草稿档），eta_seconds 为预计完成时间"""
+
+    __slots__ = ('action', 'tiers', 'eta_seconds', 'wait_seconds', 'retry_after', 'reason')
+
+    def __init__(self, action, tiers=(), eta_seconds=None, wait_seconds=None, retry_after=None, reason=None):
+        self.action = action
+        self.tiers = tuple(tiers)
+        self.eta_seconds = eta_seconds
+        self.wait_seconds = wait_seconds
+        self.retry_after = retry_after
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            'action': self.action,
+            'tiers': list(self.tiers),
+            'eta_seconds': _round(self.eta_seconds),
+            'wait_seconds': _round(self.wait_seconds),
+            'retry_after': self.retry_after,
+            'reason': self.reason,
+        }
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 1)
+
+
+class AdmissionController:
+    """跟踪生成队列并做准入决定。所有方法都是线程安全的。
+
+    workers 为同时执行生成的线程数；排队中的任务按先来先服务，预计等待时间 =
+    (运行中任务的剩余耗时 + 排在前面的任务的预计耗时) / workers。
+    """
+
+    def __init__(self, workers=1, max_queue_depth=8, max_wait_seconds=600.0, estimator=None):
+        self.workers = max(1, int(workers))
+        self.max_queue_depth = max_queue_depth
+        self.max_wait_seconds = max_wait_seconds
+        self.estimator = estimator or ServiceTimeEstimator()
+        self._lock = threading.Lock()
+        self._queued = OrderedDict()  # job_id -> tiers
+        self._running = {}  # job_id -> (tiers, started_at)
+        self.stats = {'accepted': 0, 'degraded': 0, 'rejected': 0}
+
+    # ------------------------------------------------------------------ 队列
+
+    def enqueue(self, job_id, tiers):
+        with self._lock:
+            self._queued[job_id] = tuple(tiers)
+
+    def start(self, job_id):
+        with self._lock:
+            tiers = self._queued.pop(job_id, ('full',))
+            self._running[job_id] = (tiers, time.monotonic())
+
+    def finish(self, job_id):
+        with self._lock:
+            self._queued.pop(job_id, None)
+            self._running.pop(job_id, None)
+
+    def depth(self):
+        with self._lock:
+            return len(self._queued) + len(self._running)
+
+    def _remaining(self, now):
+        """运行中各任务的预计剩余耗时（超时的任务按 0 计）"""
+        return [max(0.0, self.estimator.estimate(tiers) - (now - started))
+                for tiers, started in self._running.values()]
+
+    def _wait_for(self, ahead):
+        """排在 ahead 个排队任务之后的新任务开始执行前的预计等待时间"""
+        now = time.monotonic()
+        work = sum(self._remaining(now)) + sum(self.estimator.estimate(tiers) for tiers in ahead)
+        return work / self.workers
+
+    def position(self, job_id):
+        """排队中任务的 (前面还有几个任务, 预计开始前的等待秒数)；不在队列中时返回 (None, None)"""
+        with self._lock:
+            ahead = []
+            for queued_id, tiers in self._queued.items():
+                if queued_id == job_id:
+                    return len(ahead), _round(self._wait_for(ahead))
+                ahead.append(tiers)
+        return None, None
+
+    # ------------------------------------------------------------------ 准入
+
+    def decide(self, tiers):
+        """为一个请求 tiers 档位（例如 ('draft', 'full')）的新任务做准入决定（不入队）"""
+        tiers = tuple(tiers)
+        with self._lock:
+            depth = len(self._queued) + len(self._running)
+            wait = self._wait_for(list(self._queued.values()))
+            full_eta = wait + self.estimator.estimate(tiers)
+            draft_eta = wait + self.estimator.estimate(('draft',))
+            if depth < self.max_queue_depth and full_eta <= self.max_wait_seconds:
+                self.stats['accepted'] += 1
+                return Admission('accept', tiers, full_eta, wait)
+            if depth < self.max_queue_depth and draft_eta <= self.max_wait_seconds:
+                self.stats['degraded'] += 1
+                return Admission('degrade', ('draft',), draft_eta, wait, reason='wait')
+            self.stats['rejected'] += 1
+            if depth >= self.max_queue_depth:
+                # 等到最先完成的运行中任务结束、队列腾出一个位置
+                remaining = self._remaining(time.monotonic())
+                retry = min(remaining) if remaining else self.estimator.estimate(('full',))
+                reason = 'queue_full'
+            else:
+                # 等到队列的预计等待降到能容纳一个草稿档任务
+                retry = draft_eta - self.max_wait_seconds
+                reason = 'wait'
+            return Admission('reject', (), None, wait, retry_after=max(1, math.ceil(retry)), reason=reason)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queued': len(self._queued),
+                'running': len(self._running),
+                'max_queue_depth': self.max_queue_depth,
+                'max_wait_seconds': self.max_wait_seconds,
+                'wait_seconds': _round(self._wait_for(list(self._queued.values()))),
+                'service_seconds': self.estimator.snapshot(),
+                'stats': dict(self.stats),
+            }
+
+
+class RateLimiter:
+    """按客户端的令牌桶：每个客户端最多连续提交 burst 次，之后每分钟恢复 per_minute 次。
+
+    只保留最近活跃的 max_clients 个客户端（LRU），长期不活跃的客户端的桶在被挤出后重新从满桶开始。
+    """
+
+    def __init__(self, per_minute=6.0, burst=3, max_clients=10000):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    def acquire(self, key):
+        """消耗一个令牌，返回 (是否允许, 被限流时建议的重试秒数)"""
+        if self.rate <= 0:
+            return True, None
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            self.stats['allowed' if allowed else 'limited'] += 1
+        if allowed:
+            return True, None
+        return False, max(1, math.ceil((1.0 - tokens) / self.rate))
@@ -1,25 +1,33 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, g
 import os
+import functools
 import uuid
-from datetime import datetime, timedelta
 import threading
 import time
-import shutil
+import random
 
 # 导入我们现有的模块
-from stress import get_stress_music_prompt, STRESS_MUSIC_MAP
-import json
-import re
-import scipy
-import torch
-import numpy as np
-import scipy.signal
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
+import stress
+from stress import get_stress_music_prompt, get_user_stress_level, STRESS_MUSIC_MAP
+from audio_library import AudioLibrary, BackgroundEvictor
+from admission import AdmissionController, RateLimiter, ServiceTimeEstimator
+from job_queue import JobQueue, JobWorker
+from user_profiles import UserProfileStore, USER_COOKIE, USER_HEADER, valid_user_id
+from profiler import profile_block, new_profile_id, normalize_profile_mode, find_profile
+from wav_io import follow_wav, content_hash
+from http_cache import send_immutable_file
 import subprocess
 import sys
 
 app = Flask(__name__)
 
+# 生产部署：设置 INFERENCE_URL 后，本进程只作为轻量的 Web 层（可多 worker），
+# 不加载模型；生成任务、模型状态、偏好与 HRV 测量等有状态接口转发到专用推理进程（inference_service.py）
+INFERENCE_URL = os.environ.get('INFERENCE_URL')
+
+# 推理进程在收到退出信号后停止接受新任务，等待进行中的任务完成（见 drain_jobs）
+accepting_jobs = True
+
 # 全局变量存储模型（避免重复加载）
 model = None
 processor = None
@@ -39,65 +47,18 @@ def load_model():
     """在后台加载模型"""
     global model, processor, model_loaded
     try:
-        print("🎵 开始加载音乐生成模型...")
-        
-        # 检查模型路径是否存在
-        model_path = "/Users/xibei/MusicGPT/model"
-        if not os.path.exists(model_path):
-            print(f"❌ 模型路径不存在: {model_path}")
-            print("💡 请确保模型文件已正确下载并放置到指定路径")
-            model_loaded = False
-            return
-        
-        # 检查必要的模型文件
-        required_files = ["config.json", "pytorch_model.bin", "preprocessor_config.json"]
-        missing_files = []
-        for file in required_files:
-            file_path = os.path.join(model_path, file)
-            if not os.path.exists(file_path):
-                missing_files.append(file)
-                print(f"❌ 缺少模型文件: {file}")
-        
-        if missing_files:
-            print(f"💡 缺少以下模型文件: {', '.join(missing_files)}")
-            print("💡 请下载完整的模型文件")
-            model_loaded = False
-            return
-        
-        print("📦 正在加载处理器和模型...")
-        # 强制使用 CPU 以修复 MPS 产生的"大风吹"噪声问题
-        # 虽然 MPS 理论上更快，但在当前 PyTorch/MusicGen 组合下输出可能是纯噪声
-        device = "cpu"
-        print(f"🖥️  强制使用设备: {device} (为了保证音质绝对稳定，放弃 GPU 加速)")
-        
-        # 这里的旧代码已注释，因为 MPS 确实不可用
-        # if torch.cuda.is_available(): ...
-            
-        processor = AutoProcessor.from_pretrained(model_path)
-        model = MusicgenForConditionalGeneration.from_pretrained(model_path).to(device)
-        
-        # 验证模型加载是否成功
-        if processor is None or model is None:
-            raise Exception("模型或处理器加载失败")
-        
-        model_loaded = True
-        print("✅ 模型加载完成！")
-        print(f"📊 模型信息: {model.config}")
-        
-    except FileNotFoundError as e:
-        print(f"❌ 模型文件错误: {e}")
-        model_loaded = False
+        # 重依赖（torch / transformers / scipy）只在推理路径中加载，Web 层与工具脚本不受影响
+        import generation
     except ImportError as e:
         print(f"❌ 依赖库错误: {e}")
         print("💡 请确保已安装 transformers 和 torch 库")
         model_loaded = False
-    except Exception as e:
-        print(f"❌ 模型加载失败: {e}")
-        print("💡 可能的原因：模型文件损坏、内存不足、CUDA错误等")
-        model_loaded = False
-
-# 在应用启动时开始加载模型
-threading.Thread(target=load_model, daemon=True).start()
+        return
+    model_loaded = generation.load_model()
+    model, processor = generation.model, generation.processor
+    if model_loaded:
+        # 模型就绪后才开始领取任务（包括上次运行遗留的排队中 / 被中断的任务）
+        start_generation_workers()
 
 # 创建音频文件存储目录
 AUDIO_DIR = "generated_audio"
@@ -105,63 +66,43 @@ if not os.path.exists(AUDIO_DIR):
     os.makedirs(AUDIO_DIR)
 
 # 文件管理配置
-MAX_AUDIO_FILES = 50  # 最大音频文件数量
-CLEANUP_INTERVAL = 3600  # 清理间隔（秒）
-AUDIO_RETENTION_HOURS = 24  # 音频文件保留时间（小时）
+MAX_AUDIO_BYTES = int(os.environ.get('MAX_AUDIO_BYTES', 1024 * 1024 * 1024))  # 音频目录字节预算（默认 1 GB）
+MAX_AUDIO_FILES = int(os.environ.get('MAX_AUDIO_FILES', 500))  # 文件数量兜底上限
+CLEANUP_IDLE_INTERVAL = 300  # 无新文件写入时后台淘汰的自检间隔（秒）
+# 片段库中已有相同 prompt 的片段（例如 tools/prerender.py 离线预生成的）时直接复用，不再推理
+REUSE_RENDERED_AUDIO = os.environ.get('REUSE_RENDERED_AUDIO', '1') != '0'
+
+# 音频索引库：在写入/读取时维护，存储统计 O(1)，按 GDSF 优先级（访问、命中数、生成代价、体积）淘汰。
+# Web 层同样需要它（/api/audio 的 ETag 与访问记录、存储统计），但与目录对账和淘汰只在负责写入的进程
+# （推理进程或单进程开发模式）中进行：Web worker 每次启动都对账会与推理进程发布新文件竞争，把刚入库的片段删掉
+library = AudioLibrary(os.path.join(AUDIO_DIR, 'library.db'), AUDIO_DIR)
+evictor = None
+if not INFERENCE_URL:
+    library.reconcile()
+    evictor = BackgroundEvictor(library, MAX_AUDIO_BYTES, MAX_AUDIO_FILES, idle_interval=CLEANUP_IDLE_INTERVAL)
+
+# 按用户的音乐偏好档案（见 user_profiles.py）；首次启动时把旧版本的全局偏好迁移为默认档案。
+# 只有推理进程使用（Web 层把偏好相关接口整体转发）
+profiles = None if INFERENCE_URL else UserProfileStore(os.path.join(AUDIO_DIR, 'profiles.db'),
+                                                       default_preference=stress.load_user_music_preference())
+USER_COOKIE_MAX_AGE = 365 * 24 * 3600
 
 def cleanup_old_files():
-    """清理旧的音频文件"""
+    """立即把音频目录淘汰到字节预算内，返回被淘汰的 file_id 列表"""
     try:
-        if not os.path.exists(AUDIO_DIR):
-            return
-        
-        current_time = datetime.now()
-        files = os.listdir(AUDIO_DIR)
-        
-        # 按修改时间排序，删除最旧的文件
-        audio_files = []
-        for file in files:
-            if file.endswith('.wav'):
-                file_path = os.path.join(AUDIO_DIR, file)
-                mtime = datetime.fromtimestamp(os.path.getmtime(file_path))
-                audio_files.append((file_path, mtime))
-        
-        # 按修改时间排序
-        audio_files.sort(key=lambda x: x[1])
-        
-        # 删除超过保留时间的文件
-        for file_path, mtime in audio_files:
-            if current_time - mtime > timedelta(hours=AUDIO_RETENTION_HOURS):
-                try:
-                    os.remove(file_path)
-                    print(f"已删除过期文件: {file_path}")
-                except Exception as e:
-                    print(f"删除文件失败 {file_path}: {e}")
-        
-        # 如果文件数量仍然超过限制，删除最旧的文件
-        remaining_files = [f for f in os.listdir(AUDIO_DIR) if f.endswith('.wav')]
-        if len(remaining_files) > MAX_AUDIO_FILES:
-            excess_count = len(remaining_files) - MAX_AUDIO_FILES
-            for i in range(excess_count):
-                try:
-                    os.remove(os.path.join(AUDIO_DIR, remaining_files[i]))
-                    print(f"已删除超量文件: {remaining_files[i]}")
-                except Exception as e:
-                    print(f"删除文件失败 {remaining_files[i]}: {e}")
-                    
+        evicted = library.evict_to_budget(MAX_AUDIO_BYTES, MAX_AUDIO_FILES)
+        for file_id in evicted:
+            print(f"已淘汰音频文件: {file_id}.wav")
+        return evicted
     except Exception as e:
         print(f"清理文件时出错: {e}")
+        return []
 
 def start_cleanup_scheduler():
-    """启动定期清理任务"""
-    def cleanup_loop():
-        while True:
-            time.sleep(CLEANUP_INTERVAL)
-            cleanup_old_files()
-    
-    cleanup_thread = threading.Thread(target=cleanup_loop, daemon=True)
-    cleanup_thread.start()
-    print("文件清理任务已启动")
+    """启动后台增量淘汰任务（有新文件写入时被唤醒）"""
+    evictor.start()
+    evictor.notify()
+    print("文件淘汰任务已启动")
 
 
 def _run_measurement_in_thread(cmd, state_dict):
@@ -213,49 +154,33 @@ def _run_measurement_in_thread(cmd, state_dict):
         measurement_proc = None
 
 
-def _persist_stress_map(stress_map):
-    """将给定的 STRESS_MUSIC_MAP 写回到 stress.py（备份原文件）。"""
-    stress_path = os.path.join(os.path.dirname(__file__), 'stress.py')
-    try:
-        # 读取原文件内容
-        with open(stress_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        # 构建新的 STRESS_MUSIC_MAP 文本（保持可读的 Python 字面量格式）
-        entries = []
-        for key, lst in stress_map.items():
-            vals = ', '.join([f'"{s}"' for s in lst])
-            entries.append(f'    "{key}": [{vals}]')
-        new_map_text = 'STRESS_MUSIC_MAP = {\n' + ',\n'.join(entries) + '\n}\n'
-
-        # 使用正则替换原 MAP 块（非贪婪），若不存在则在文件顶部插入
-        pattern = r"(?m)^STRESS_MUSIC_MAP\s*=\s*\{[\s\S]*?\}"
-        new_content, n = re.subn(pattern, new_map_text.rstrip('\n'), content, count=1)
-        if n == 0:
-            # 未找到现有定义，将新定义插入文件开头并保留原注释/导入
-            new_content = new_map_text + '\n' + content
-
-        # 备份并以原子方式写入新文件：先写到临时文件，再重命名替换
-        backup_path = stress_path + '.bak'
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-
-        tmp_path = stress_path + '.tmp'
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        # 原子替换
-        os.replace(tmp_path, stress_path)
-        return True, None
-    except Exception as e:
-        return False, str(e)
+def current_user_id():
+    """当前请求的用户：请求头 X-User-Id 或 cookie；都没有时分配新的 user_id，并在响应中写入 cookie"""
+    user_id = request.headers.get(USER_HEADER) or request.cookies.get(USER_COOKIE)
+    if valid_user_id(user_id):
+        return user_id
+    if 'new_user_id' not in g:
+        g.new_user_id = uuid.uuid4().hex
+    return g.new_user_id
+
+
+def current_profile():
+    """当前请求用户的偏好档案（只读快照）"""
+    return profiles.get(current_user_id())
+
+
+@app.after_request
+def _assign_user_cookie(response):
+    new_user_id = g.get('new_user_id')
+    if new_user_id is not None:
+        response.set_cookie(USER_COOKIE, new_user_id, max_age=USER_COOKIE_MAX_AGE, httponly=True, samesite='Lax')
+    return response
 
 
-def update_and_persist_preference(pref):
-    """将偏好（中文或英文）映射为关键词，更新 USER_MUSIC_PREFERENCE 变量并持久化到JSON文件（不修改stress.py）。
+def update_and_persist_preference(pref, user_id):
+    """将偏好（中文或英文）映射为关键词，写入该用户的偏好档案（内存中立即生效，后台批量持久化）。
     返回 (success, message_or_pref_word)
     """
-    from stress import set_user_music_preference
-    
     mapping = {
         '流行': 'pop', '摇滚': 'rock', '古典': 'classical',
         'pop': 'pop', 'rock': 'rock', 'classical': 'classical',
@@ -266,15 +191,98 @@ def update_and_persist_preference(pref):
     if pref_word is None:
         return False, f'不支持的偏好: {pref}'
 
-    # 使用新的函数设置用户偏好（这会更新 USER_MUSIC_PREFERENCE 变量并持久化到JSON文件）
-    success = set_user_music_preference(pref_word)
-    if success:
-        return True, pref_word
-    else:
+    if pref_word not in stress.VALID_PREFERENCES:
         return False, f'设置偏好失败: {pref_word}'
-
-# 启动文件清理任务
-start_cleanup_scheduler()
+    profiles.set_preference(user_id, pref_word)
+    return True, pref_word
+
+# 启动文件清理任务与偏好写入线程（只在持有生成任务的进程中运行，避免多个 worker 同时淘汰）
+if not INFERENCE_URL:
+    start_cleanup_scheduler()
+    profiles.start()
+
+
+# 转发到推理进程时保留的请求头
+_PROXY_REQUEST_HEADERS = ('Content-Type', 'Accept', 'X-Profile', 'Cookie', USER_HEADER)
+# Web 层把客户端的真实地址写在这个请求头里转发（覆盖客户端自带的值）；推理进程只信任来自
+# TRUSTED_PROXIES 的请求中的这个头，其它来源一律按连接的对端地址计
+CLIENT_ADDR_HEADER = 'X-Forwarded-For'
+TRUSTED_PROXIES = {a.strip() for a in os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if a.strip()}
+# 转发响应时丢弃的逐跳 / 由本地服务器重新计算的响应头
+_PROXY_EXCLUDED_RESPONSE_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+# 转发的读超时（秒）；实时音频流在发出 WAV 头之后可能要等几分钟才有第一段数据（CPU 生成），不设读超时
+PROXY_READ_TIMEOUT = 60
+_PROXY_STREAMING_PATHS = ('/api/continuous/stream', '/api/mixer/stream')
+
+
+def _proxy_to_inference():
+    """把当前请求原样转发给推理进程，并以流的方式返回其响应"""
+    import requests
+    url = INFERENCE_URL.rstrip('/') + request.path
+    headers = {k: request.headers[k] for k in _PROXY_REQUEST_HEADERS if k in request.headers}
+    headers[CLIENT_ADDR_HEADER] = request.remote_addr or ''
+    try:
+        resp = requests.request(
+            request.method, url,
+            params=request.args,
+            data=request.get_data(),
+            headers=headers,
+            timeout=(3, None if request.path in _PROXY_STREAMING_PATHS else PROXY_READ_TIMEOUT),
+            stream=True
+        )
+    except requests.RequestException as e:
+        return jsonify({'error': f'推理服务不可用: {e}'}), 503
+    response_headers = [(k, v) for k, v in resp.raw.headers.items()
+                        if k.lower() not in _PROXY_EXCLUDED_RESPONSE_HEADERS]
+    return Response(_relay(resp), status=resp.status_code, headers=response_headers)
+
+
+def _relay(resp):
+    """转发响应正文，收到多少转发多少（iter_content 会等凑满一块或连接结束，实时音频流会被卡住）。
+    状态行已经发出，中途超时或推理进程断开时只能结束响应（客户端看到流中断）"""
+    import requests
+    import urllib3
+    read1 = getattr(resp.raw, 'read1', None)  # urllib3 >= 2.1
+    chunks = iter(lambda: read1(64 * 1024, decode_content=True), b'') if read1 else \
+        resp.iter_content(chunk_size=64 * 1024)
+    try:
+        for chunk in chunks:
+            yield chunk
+    except (requests.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+        print(f"转发推理服务响应时中断: {e}")
+    finally:
+        resp.close()
+
+
+def inference_route(view):
+    """标记需要在推理进程中执行的路由：Web 层直接转发，推理进程（或单进程开发模式）本地执行"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if INFERENCE_URL:
+            return _proxy_to_inference()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def drain_jobs(timeout=600):
+    """停止接受新的生成任务并等待进行中的任务完成，返回是否在超时前全部完成。
+    超时未完成的任务在进程退出后租约过期，下次启动时自动重试"""
+    global accepting_jobs
+    accepting_jobs = False
+    if measurement_proc is not None and measurement_proc.poll() is None:
+        measurement_proc.terminate()
+    if continuous_session is not None:
+        continuous_session.stop()
+    if mixer_session is not None:
+        mixer_session.stop()
+    # 不再领取新任务：排队中的任务保留在 jobs.db 中，重启后继续执行
+    for worker in generation_workers:
+        worker.stop()
+    deadline = time.time() + timeout
+    while any(worker.busy for worker in generation_workers) and time.time() < deadline:
+        time.sleep(0.5)
+    profiles.flush()
+    return not any(worker.busy for worker in generation_workers)
 
 @app.route('/')
 def index():
@@ -287,6 +295,7 @@ def get_stress_levels():
     return jsonify(list(STRESS_MUSIC_MAP.keys()))
 
 @app.route('/api/model-status')
+@inference_route
 def model_status():
     """检查模型加载状态"""
     # 检查模型是否正在加载中（通过检查线程是否还在运行）
@@ -297,9 +306,18 @@ def model_status():
         'loaded': model_loaded,
         'loading': is_loading,
         'status': 'ready' if model_loaded else ('loading' if is_loading else 'not_started'),
-        'message': '模型已就绪' if model_loaded else ('模型正在加载中，请稍候...' if is_loading else '模型尚未开始加载')
+        'message': '模型已就绪' if model_loaded else ('模型正在加载中，请稍候...' if is_loading else '模型尚未开始加载'),
+        # 提示词配置版本（stress.PROMPT_CONFIG）：依赖 prompt 的缓存以它为键
+        'prompt_config_version': stress.PROMPT_CONFIG.version
     }
     
+    # 推理后端、文本编码器缓存的命中情况与节省的耗时、解码模式（模型加载后才有）
+    if model_loaded and 'generation' in sys.modules:
+        status_info['backend'] = sys.modules['generation'].backend.name
+        status_info['encoder_cache'] = sys.modules['generation'].encoder_cache.snapshot()
+        # 当前解码模式（eager / compiled）及加速解码失败时的原因
+        status_info['decode'] = dict(sys.modules['generation'].decode_status)
+
     # 如果模型加载失败，提供更多信息
     if not model_loaded and not is_loading:
         status_info['error'] = True
@@ -307,277 +325,530 @@ def model_status():
     
     return jsonify(status_info)
 
-# 全局变量控制生成状态
-music_generation_status = {
-    'status': 'idle', # idle, processing, completed, failed
+# 生成任务：任务及其状态持久化在 generated_audio/jobs.db（见 job_queue.py），由 generation_workers 按先来先服务执行；
+# 进程重启或崩溃后排队中的任务继续执行，被中断的任务在租约过期后自动重试，已完成任务的结果仍可按 job_id 查询。
+# 准入控制（ETA、降级、429）与按客户端限流见 admission.py
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 1))  # CPU 上一次生成就会占满所有核心
+MAX_QUEUE_DEPTH = int(os.environ.get('MAX_QUEUE_DEPTH', 8))  # 排队中 + 运行中的任务数上限
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get('MAX_QUEUE_WAIT_SECONDS', 600))  # 新任务预计完成时间的上限
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', 6))  # 每个客户端每分钟的提交次数，0 为不限
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 3))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 30))  # 执行中任务的租约（心跳每 1/3 租约续一次）
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))  # 被中断的任务最多执行的次数
+JOB_RETENTION_SECONDS = 3600  # 已结束任务的状态保留时间
+
+IDLE_STATUS = {
+    'status': 'idle', # idle, queued, processing, completed, failed
+    'job_id': None,
     'file_id': None,
+    'draft_file_id': None,  # 渐进式生成的草稿档
+    'tier': None,  # draft / full：当前可播放的最高档
     'error': None
 }
+ACTIVE_STATES = ('queued', 'processing')
 
-# 启用 MPS 后备模式，以防部分算子在 GPU 上不支持
-os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
-# 解除 MPS 显存限制 (允许使用更多系统内存)，避免 OOM
-os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"
+# 任务队列、准入控制与限流只存在于推理进程中（Web 层把生成相关接口整体转发）
+jobs = admission = rate_limiter = None
+if not INFERENCE_URL:
+    jobs = JobQueue(os.path.join(AUDIO_DIR, 'jobs.db'), lease_seconds=JOB_LEASE_SECONDS,
+                    max_attempts=JOB_MAX_ATTEMPTS, retention_seconds=JOB_RETENTION_SECONDS)
+    admission = AdmissionController(
+        GENERATION_WORKERS, MAX_QUEUE_DEPTH, MAX_QUEUE_WAIT_SECONDS,
+        # 以片段库中最近的实测生成耗时作为初值，重启后 ETA 仍然可信
+        ServiceTimeEstimator({'full': library.recent_cost_seconds(), 'draft': library.recent_cost_seconds(draft=True)})
+    )
+    rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
 
-import uuid
-from datetime import datetime, timedelta
-import threading
-import time
-import shutil
-import gc  # 引入垃圾回收
 
-# ... (imports) ...
+def _readmit(job_ids):
+    """把（重新）回到队列中的任务登记到准入控制，使 ETA 与队列深度包含它们"""
+    job_ids = set(job_ids)
+    for job_id, _, payload in jobs.active():
+        if job_id in job_ids:
+            admission.finish(job_id)
+            admission.enqueue(job_id, payload.get('tiers', ('full',)))
 
-def generate_music_task(input_text):
-    global music_generation_status
-    print(f"🧵 后台线程启动，开始生成音乐，提示词: {input_text}")
-    try:
-        # 确保模型已加载
-        if model is None or processor is None:
-            raise Exception("模型未正确加载")
 
-        # 每轮生成前主动清理内存
-        gc.collect()
-        if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
-            torch.mps.empty_cache()
+def _run_job(job, worker_id, lease):
+    generate_music_task(job, worker_id, lease)
 
-        # 获取当前配置的设备
-        original_device = model.device
-        
-        # 使用 inference_mode 极限压榨 CPU 性能
-        with torch.inference_mode():
-            try:
-                print(f"🚀 尝试在 {original_device} 上生成...")
-                inputs = processor(
-                    text=[input_text],
-                    return_tensors="pt"
-                ).to(original_device)
-                
-                audio_values = model.generate(
-                    **inputs,
-                    max_new_tokens=1250,
-                    do_sample=True,
-                    guidance_scale=3.0,
-                    temperature=0.8,
-                    top_p=0.9
-                )
-            except RuntimeError as e:
-                print(f"⚠️ 硬件加速生成失败 ({e})")
-                print("🔄 正在自动回退到 CPU 重试...")
-                
-                model.to('cpu')
-                inputs = processor(text=[input_text], return_tensors="pt").to('cpu')
-                audio_values = model.generate(
-                    **inputs,
-                    max_new_tokens=1250,
-                    do_sample=True,
-                    guidance_scale=3.0,
-                    temperature=0.8,
-                    top_p=0.9
-                )
-                if original_device.type != 'cpu':
-                    try: model.to(original_device)
-                    except: pass
-
-        # 保存音频文件
-        file_id = str(uuid.uuid4())
-        output_file = os.path.join(AUDIO_DIR, f"{file_id}.wav")
-        
-        sampling_rate = model.config.audio_encoder.sampling_rate
-        # 必须先移回 CPU
-        audio_data = audio_values[0, 0].cpu().numpy()
-        
-        # --- 优化：去除直流偏移 (DC Offset)，防止拼接时的"噗"声 ---
-        if len(audio_data) > 0:
-            audio_data = audio_data - np.mean(audio_data)
-        
-        if len(audio_data) == 0:
-            raise ValueError("生成的音频数据为空")
 
-        # --- 策略：DSP 变奏循环 (A-B-A-B 结构) ---
-        target_duration = 300  # 5 分钟
-        current_duration = len(audio_data) / sampling_rate
-        
-        if current_duration > 0 and current_duration < target_duration:
-            print(f"🔄 正在应用 Overlap-Add 无缝重叠拼接策略 (Duration: {current_duration:.2f}s)...")
-            
-            # 1. 准备素材: A (原版) 和 B (变奏)
-            # 制作 B 段 (变奏)：施加柔和的低通滤波器
-            try:
-                b, a = scipy.signal.butter(4, 1200 / (sampling_rate / 2), 'low')
-                audio_data_lowpass = scipy.signal.lfilter(b, a, audio_data)
-                if np.isnan(audio_data_lowpass).any(): audio_data_lowpass = audio_data.copy() 
-            except:
-                audio_data_lowpass = audio_data.copy()
-
-            # 2. 定义重叠参数
-            overlap_sec = 3.0 # 3秒重叠
-            overlap_len = int(sampling_rate * overlap_sec)
-            
-            # --- 关键修复：防止音频过导致 Overlap 崩溃 ---
-            # 遇到"叮一声"就是因为音频还没 overlap 长，导致切片索引错乱
-            min_required_len = int(sampling_rate * 5.0) # 至少要有5秒才能做漂亮的 fade
-            if len(audio_data) < min_required_len:
-                print(f"⚠️ 生成音频过短 ({len(audio_data)/sampling_rate:.2f}s)，正在强制补齐...")
-                # 简单重复几次直到足够长，保证后续算法不崩
-                if len(audio_data) > 0:
-                    repeat_times = int(np.ceil(min_required_len / len(audio_data)))
-                    audio_data = np.tile(audio_data, repeat_times)
-                    # 同时也补齐 B 段
-                    audio_data_lowpass = np.tile(audio_data_lowpass, repeat_times)
-            
-            # 如果还是不够长（极小概率），缩小 Overlap
-            if len(audio_data) < 2 * overlap_len:
-                overlap_len = len(audio_data) // 3
-            # ---------------------------------------------
-            
-            # 3. 预计算淡入淡出曲线 (用于重叠区)
-            # 使用 sqrt(t) 曲线，保证功率恒定 (Constant Power Crossfade)
-            t = np.linspace(0, 1, overlap_len)
-            fade_in = np.sqrt(t)
-            fade_out = np.sqrt(1 - t)
-            
-            # 4. 开始拼接
-            # 计算总共需要多少段
-            # 每一段贡献的有效新长度是 (Length - Overlap)
-            segment_len = len(audio_data)
-            hop_len = segment_len - overlap_len
-            if hop_len <= 0: hop_len = segment_len // 2 # 防御性编码
-
-            target_samples = int(target_duration * sampling_rate)
-            num_segments = int(np.ceil(target_samples / hop_len)) + 2
-            
-            # 初始化大数组
-            # 预估一个足够长的长度，最后再截断
-            estimated_len = hop_len * num_segments + segment_len
-            combined_audio = np.zeros(estimated_len, dtype=np.float32)
-            
-            print(f"🧩 正在拼接 {num_segments} 个片段，重叠长度: {overlap_len} 采样点")
-
-            for i in range(num_segments):
-                # 选择素材: A-B-A-B
-                part = audio_data if i % 2 == 0 else audio_data_lowpass
-                
-                # 获取当前段在总数组中的位置
-                # 第 i 段的起始位置由 hop_len 决定
-                start = i * hop_len
-                
-                # 复制一份当前片段
-                this_segment = part.copy()
-                
-                # 如果这不是第一段，开头要 Fade In (为了和上一段的 Tail 融合)
-                if i > 0:
-                     this_segment[:overlap_len] *= fade_in
-                
-                # 如果这不是最后一段，结尾要 Fade Out (为了和下一段的 Head 融合)
-                if i < num_segments - 1:
-                     this_segment[-overlap_len:] *= fade_out
-                     
-                # 叠加到主数组 (Overlap-Add)
-                write_len = min(segment_len, len(combined_audio) - start)
-                if write_len > 0:
-                    combined_audio[start : start + write_len] += this_segment[:write_len]
-            
-            # 截取有效长度并赋值
-            final_valid_len = min(len(combined_audio), target_samples)
-            # 找到最后一个非零点的附近，或者直接用 target_samples
-            audio_data = combined_audio[:final_valid_len]
-
-        # 4. 最终检查与保存
-        # 检查 NaN / Inf
-        if np.isnan(audio_data).any() or np.isinf(audio_data).any():
-            print("❌ 检测到 NaN 或 Inf 数值！替换为 0...")
-            audio_data = np.nan_to_num(audio_data)
-            
-        print(f"🔍 音频数据检查: Min={audio_data.min()}, Max={audio_data.max()}")
-        
-        # 归一化
-        max_val = np.max(np.abs(audio_data))
-        if max_val > 0:
-            audio_data = audio_data / max_val
-            
-        # 最终转换为 Int16 (标准 WAV)
-        audio_data_int16 = (audio_data * 32767).clip(-32768, 32767).astype(np.int16)
-        scipy.io.wavfile.write(output_file, rate=sampling_rate, data=audio_data_int16)
-        
-        # 验证文件
-        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-            raise FileNotFoundError("音频文件保存失败")
-        
-        print(f"✅ 后台生成完成: {file_id}, 大小: {os.path.getsize(output_file)}")
-        music_generation_status = {
-            'status': 'completed',
-            'file_id': file_id,
-            'error': None
-        }
-        
+generation_workers = [] if INFERENCE_URL else [
+    JobWorker(jobs, _run_job, name=f'generation-{i}', on_requeue=_readmit) for i in range(GENERATION_WORKERS)
+]
+
+
+def start_generation_workers():
+    for worker in generation_workers:
+        worker.start()
+
+
+def _notify_workers():
+    for worker in generation_workers:
+        worker.notify()
+
+
+# 恢复上次运行遗留的任务：排队中与执行中的任务先计入准入控制（执行中的任务在租约过期后由工作线程放回队列）
+if not INFERENCE_URL:
+    _readmit(job_id for job_id, _, _ in jobs.active())
+
+# 在应用启动时开始加载模型（Web 层不加载，由推理进程负责）；模型就绪后工作线程开始领取任务
+if not INFERENCE_URL:
+    threading.Thread(target=load_model, daemon=True).start()
+
+
+def _client_address():
+    """客户端的真实地址：经 Web 层转发的请求取其写入的 X-Forwarded-For，否则为连接的对端地址"""
+    forwarded = request.headers.get(CLIENT_ADDR_HEADER)
+    if forwarded and request.remote_addr in TRUSTED_PROXIES:
+        return forwarded.split(',')[-1].strip()
+    return request.remote_addr
+
+
+def _rate_limit_keys():
+    """限流的桶：首先按客户端地址（客户端无法伪造），带 cookie / X-User-Id 的请求再额外按用户计
+    （user_id 由客户端提供，每次换一个新的 id 也绕不过地址桶）"""
+    keys = [f'addr:{_client_address()}']
+    user_id = request.headers.get(USER_HEADER) or request.cookies.get(USER_COOKIE)
+    if valid_user_id(user_id):
+        keys.append(f'user:{user_id}')
+    return keys
+
+
+def _acquire_rate_limit():
+    """依次消耗各个桶的令牌，返回 (是否允许, 被限流时建议的重试秒数)"""
+    for key in _rate_limit_keys():
+        allowed, retry_after = rate_limiter.acquire(key)
+        if not allowed:
+            return False, retry_after
+    return True, None
+
+
+def generate_music_task(job, worker_id, lease):
+    """执行一个从队列中领取的任务，按顺序生成 tiers 中的各档位。渐进式生成为 ('draft', 'full')：先生成草稿档
+    （几秒内可播放），再生成完整质量版本，两档结果记录在同一个任务状态中（draft_file_id / file_id），前端在完整版
+    就绪后交叉淡化切换；准入控制降级时只生成草稿档，草稿即为最终结果。
+    重试被中断的任务时，上次执行中已经完整写入的档位直接复用，不再重新生成。"""
+    job_id, payload = job['job_id'], job['payload']
+    input_text, stress_level, preference = payload['input_text'], payload['stress_level'], payload['preference']
+    tiers = payload['tiers']
+    if job['attempts'] > 1:
+        print(f"♻️ 重试被中断的任务 {job_id}（第 {job['attempts']} 次）")
+    print(f"🧵 后台线程启动，开始生成音乐，提示词: {input_text}")
+    admission.start(job_id)
+    jobs.update(job_id, worker_id, eta_seconds=None)
+    # 按需剖析：结果与本次任务一起记录在状态中，可通过 /api/profile/<profile_id> 下载
+    profile_mode = payload.get('profile_mode')
+    profile_id = new_profile_id() if profile_mode else None
+    draft_file_id = file_id = None
+    try:
+        with profile_block(profile_id, profile_mode):
+            for i, tier in enumerate(tiers):
+                draft = tier == 'draft'
+                rendered = (_recover_rendered(job, tier, input_text, stress_level, preference)
+                            or _render_music(job_id, worker_id, input_text, stress_level, draft, preference))
+                if lease.lost:
+                    # 租约已被收回，任务已交给其它执行者
+                    return
+                if draft:
+                    draft_file_id = rendered
+                    if i < len(tiers) - 1:
+                        jobs.update(job_id, worker_id, draft_file_id=draft_file_id, tier='draft')
+                else:
+                    file_id = rendered
+        jobs.complete(job_id, worker_id, file_id=file_id or draft_file_id,
+                      draft_file_id=draft_file_id if file_id else None, tier='full' if file_id else 'draft',
+                      source='model', error=None, profile_id=profile_id)
+
     except Exception as e:
         print(f"❌ 后台生成出错: {e}")
-        music_generation_status = {
-            'status': 'failed',
-            'file_id': None,
-            'error': str(e)
-        }
+        # 完整版失败时草稿仍可继续播放
+        jobs.fail(job_id, worker_id, str(e), file_id=None, draft_file_id=draft_file_id,
+                  tier='draft' if draft_file_id else None, profile_id=profile_id)
+    finally:
+        admission.finish(job_id)
+
+
+def _recover_rendered(job, tier, input_text, stress_level, preference):
+    """被中断的任务上次执行中已经完整写入（.wav 已就位）的该档位的 file_id；没有时返回 None"""
+    if tier == 'draft' and job['draft_file_id']:
+        file_id = job['draft_file_id']
+    elif job['rendering_tier'] == tier and job['rendering_file_id']:
+        file_id = job['rendering_file_id']
+    else:
+        return None
+    path = library.audio_path(file_id)
+    if not os.path.exists(path):
+        return None
+    row = library.get(file_id)
+    if row is None or row['prompt'] is None:
+        # 写完文件后、登记入库前被中断（启动对账时补登的条目没有 prompt）
+        library.add(file_id, prompt=input_text, stress_level=stress_level, preference=preference,
+                    draft=tier == 'draft', content_hash=content_hash(path))
+    print(f"♻️ 复用中断前已生成的{'草稿' if tier == 'draft' else '音乐'}: {file_id}")
+    return file_id
+
+
+def _render_music(job_id, worker_id, input_text, stress_level=None, draft=False, preference=None):
+    """执行一次完整的生成 + 后处理 + 保存，返回 file_id。出错时抛出异常。"""
+    import generation
+
+    started = time.time()
+    file_id = str(uuid.uuid4())
+    output_file = os.path.join(AUDIO_DIR, f"{file_id}.wav")
+    # 写入过程中 /api/audio/<rendering_file_id> 即可边写边播放；任务被中断后重试时据此复用已写完的文件
+    jobs.update(job_id, worker_id, rendering_file_id=file_id, rendering_tier='draft' if draft else 'full')
+    generation.render_music(input_text, output_file, draft=draft)
+
+    elapsed = time.time() - started
+    admission.estimator.record('draft' if draft else 'full', elapsed)
+    file_size = os.path.getsize(output_file)
+    library.add(file_id, prompt=input_text, stress_level=stress_level, size_bytes=file_size,
+                cost_seconds=elapsed, preference=preference, draft=draft,
+                content_hash=content_hash(output_file))
+    evictor.notify()
+    print(f"✅ 后台生成完成{'（草稿）' if draft else ''}: {file_id}, 大小: {file_size}, 耗时: {elapsed:.1f}s")
+    return file_id
+
+
+def _pick_existing(rows):
+    """从片段库的查询结果中随机取一个文件仍然存在的片段，记一次访问；没有时返回 None"""
+    candidates = [row['file_id'] for row in rows if os.path.exists(library.audio_path(row['file_id']))]
+    if not candidates:
+        return None
+    file_id = random.choice(candidates)
+    library.touch(file_id)
+    return file_id
+
+
+def _find_rendered(input_text):
+    """片段库中与 prompt 完全相同的片段（离线预生成或之前生成过），随机取一个变体；没有时返回 None"""
+    return _pick_existing(library.find_by_prompt(input_text))
+
+
+def _find_similar(stress_level, preference):
+    """片段库中同一压力等级（优先同一偏好）的片段，过载降级时使用；没有时返回 None"""
+    return _pick_existing(library.find(stress_level, preference))
+
+
+def _completed_from_library(user_id, file_id, message, degraded=False):
+    """直接以片段库中的片段完成一个任务（不做推理）"""
+    job_id = jobs.enqueue(user_id, {}, status='completed', file_id=file_id, tier='full', source='library',
+                          degraded=degraded)
+    return jsonify({
+        'success': True,
+        'status': 'completed',
+        'job_id': job_id,
+        'file_id': file_id,
+        'degraded': degraded,
+        'message': message
+    })
 
 @app.route('/api/generate-music', methods=['POST'])
+@inference_route
 def generate_music():
-    global music_generation_status
-    
-    # 检查是否正在运行
-    if music_generation_status['status'] == 'processing':
-         return jsonify({
-             'status': 'processing', 
-             'message': '任务正在进行中'
-         }), 200 # 幂等返回 200
-
-    # 重置状态
-    music_generation_status = {'status': 'processing', 'file_id': None, 'error': None}
-    
-    try:
-        # 模型加载检查
-        if not model_loaded:
-             return jsonify({'error': '模型正在加载中'}), 503
+    # 推理进程正在退出，不再接受新任务
+    if not accepting_jobs:
+        return jsonify({'error': '服务正在重启，请稍后重试'}), 503
+
+    # 该用户已有排队中或进行中的任务时直接返回该任务（幂等返回 200，不计入限流）
+    user_id = current_user_id()
+    current = jobs.latest_for_user(user_id)
+    if current is not None and current['status'] in ACTIVE_STATES:
+        return jsonify({
+            'status': current['status'],
+            'job_id': current['job_id'],
+            'message': '任务正在进行中'
+        }), 200
+
+    # 按客户端限流，防止单个浏览器反复提交把队列塞满
+    allowed, retry_after = _acquire_rate_limit()
+    if not allowed:
+        response = jsonify({'error': '请求过于频繁，请稍后重试', 'retry_after': retry_after, 'reason': 'rate_limited'})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
+    # 片段库中已有相同 prompt 的音乐时直接复用，不做推理（模型未加载完也可以）
+    profile = current_profile()
+    input_text = get_stress_music_prompt(profile=profile)
+    file_id = _find_rendered(input_text) if REUSE_RENDERED_AUDIO else None
+    if file_id:
+        return _completed_from_library(user_id, file_id, '已复用片段库中的音乐')
+
+    # 模型加载检查（放在登记任务之前，避免任务停留在 processing 导致优雅退出时空等）
+    if not model_loaded:
+         return jsonify({'error': '模型正在加载中'}), 503
 
-        # 生成 Prompt
-        from stress import get_stress_music_prompt
-        input_text = get_stress_music_prompt()
+    try:
+        stress_level = get_user_stress_level()
         
-        # 启动后台线程
-        thread = threading.Thread(target=generate_music_task, args=(input_text,))
-        thread.start()
+        # 可选剖析：请求头 X-Profile 或查询参数 ?profile=1|sample|cprofile
+        profile_mode = normalize_profile_mode(
+            request.headers.get('X-Profile') or request.args.get('profile')
+        )
+
+        # 渐进式生成：请求体 {"progressive": true} 或查询参数 ?progressive=1
+        data = request.get_json(silent=True) or {}
+        progressive = bool(data.get('progressive')) or request.args.get('progressive') in ('1', 'true')
+
+        # 准入控制：按当前队列与实测生成耗时估算完成时间，超出容量时降级或拒绝
+        decision = admission.decide(('draft', 'full') if progressive else ('full',))
+        if decision.action != 'accept':
+            # 优先使用片段库中相近的片段（同一压力等级），不增加任何负载
+            file_id = _find_similar(stress_level, profile.preference)
+            if file_id:
+                return _completed_from_library(user_id, file_id, '当前生成队列繁忙，已为您播放片段库中的相近音乐',
+                                               degraded=True)
+        if decision.action == 'reject':
+            response = jsonify({'error': '当前生成队列已满，请稍后重试', 'retry_after': decision.retry_after,
+                                'reason': decision.reason, 'admission': decision.to_dict()})
+            response.headers['Retry-After'] = str(decision.retry_after)
+            return response, 429
+
+        # 任务写入持久化队列后再唤醒工作线程（degrade 时只生成草稿档：更少的 token，更快完成）
+        payload = {'input_text': input_text, 'profile_mode': profile_mode, 'stress_level': stress_level,
+                   'tiers': list(decision.tiers), 'preference': profile.preference}
+        job_id = jobs.enqueue(user_id, payload, degraded=decision.action == 'degrade',
+                              eta_seconds=round(decision.eta_seconds, 1))
+        admission.enqueue(job_id, decision.tiers)
+        _notify_workers()
         
         return jsonify({
             'success': True,
-            'status': 'processing', 
-            'message': '音乐生成任务已在后台启动'
+            'status': 'queued',
+            'job_id': job_id,
+            'progressive': progressive,
+            'tiers': list(decision.tiers),
+            'degraded': decision.action == 'degrade',
+            'eta_seconds': round(decision.eta_seconds, 1),
+            'wait_seconds': round(decision.wait_seconds, 1),
+            'message': '音乐生成任务已加入队列'
         })
         
     except Exception as e:
-        music_generation_status['status'] = 'failed'
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/music-status', methods=['GET'])
+@inference_route
 def get_music_status():
-    return jsonify(music_generation_status)
+    """任务状态：查询参数 ?job_id= 指定任务，不指定时返回当前用户最近一次任务；
+    排队中的任务附带 queue_position（前面还有几个任务）与 wait_seconds（预计开始前的等待）"""
+    job_id = request.args.get('job_id')
+    status = jobs.get(job_id) if job_id else jobs.latest_for_user(current_user_id())
+    if status is None:
+        if job_id:
+            return jsonify(dict(IDLE_STATUS, status='unknown', job_id=job_id, error='任务不存在或已过期')), 404
+        return jsonify(IDLE_STATUS)
+    if status['status'] == 'queued':
+        position, wait_seconds = admission.position(status['job_id'])
+        status = dict(status, queue_position=position, wait_seconds=wait_seconds)
+    return jsonify(status)
+
+
+@app.route('/api/queue-status')
+@inference_route
+def queue_status():
+    """生成队列与准入控制的状态：队列深度、预计等待、各档位的实测生成耗时、准入 / 限流统计"""
+    return jsonify(dict(admission.snapshot(), jobs=jobs.counts(), rate_limit=dict(
+        per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, **rate_limiter.stats)))
+
+# 连续配乐会话（同一时刻最多一个，见 continuous.py）
+continuous_session = None
+# 每段时长的允许范围（秒）：过长会长时间占住模型、饿死其它生成任务，过短（≤ 0）会让生产线程反复出错重试
+MIN_SEGMENT_SECONDS = 5.0
+MAX_SEGMENT_SECONDS = 60.0
+
+
+@app.route('/api/continuous/start', methods=['POST'])
+@inference_route
+def continuous_start():
+    """开始连续配乐：后台逐段续写，每段都按当前压力等级重新计算 prompt"""
+    global continuous_session
+    if not accepting_jobs:
+        return jsonify({'error': '服务正在重启，请稍后重试'}), 503
+    if not model_loaded:
+        return jsonify({'error': '模型正在加载中'}), 503
+    if continuous_session is not None and continuous_session.running:
+        return jsonify({'success': True, 'message': '连续配乐已在运行', 'status': continuous_session.status()})
+
+    import generation
+    if not generation.backend.supports_audio_prompt:
+        return jsonify({'error': f'当前推理后端（{generation.backend.name}）不支持连续配乐'}), 501
+
+    from continuous import ContinuousSoundtrack
+    data = request.get_json(silent=True) or {}
+    try:
+        segment_seconds = float(data.get('segment_seconds', 25))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'segment_seconds 必须为数字'}), 400
+    if not MIN_SEGMENT_SECONDS <= segment_seconds <= MAX_SEGMENT_SECONDS:
+        return jsonify({'error': f'segment_seconds 必须在 {MIN_SEGMENT_SECONDS:g} 到 {MAX_SEGMENT_SECONDS:g} 秒之间'}), 400
+    # 每段都读取该用户最新的偏好档案（会话期间修改偏好从下一段开始生效）
+    user_id = current_user_id()
+    continuous_session = ContinuousSoundtrack(lambda: get_stress_music_prompt(profile=profiles.get(user_id)),
+                                              segment_seconds=segment_seconds)
+    continuous_session.start()
+    return jsonify({'success': True, 'message': '连续配乐已启动', 'stream_url': '/api/continuous/stream'})
+
+
+@app.route('/api/continuous/stream')
+@inference_route
+def continuous_stream():
+    """连续配乐的音频流（不定长 WAV，按实时速率输出）"""
+    if continuous_session is None or not continuous_session.running:
+        return jsonify({'error': '连续配乐未启动'}), 404
+    chunks = continuous_session.open_stream()
+    if chunks is None:
+        return jsonify({'error': '已有连接正在收听连续配乐'}), 409
+    return Response(chunks, mimetype='audio/wav', headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/api/continuous/stop', methods=['POST'])
+@inference_route
+def continuous_stop():
+    if continuous_session is not None:
+        continuous_session.stop()
+    return jsonify({'success': True, 'message': '连续配乐已停止'})
+
+
+@app.route('/api/continuous/status')
+@inference_route
+def continuous_status():
+    if continuous_session is None:
+        return jsonify({'running': False})
+    return jsonify(continuous_session.status())
+
+
+# 实时自适应混音（同一时刻最多一个，见 mixer.py）：只使用已生成的片段，不做模型推理
+mixer_session = None
+
+
+@app.route('/api/mixer/start', methods=['POST'])
+@inference_route
+def mixer_start():
+    """开始实时混音：随 HRV 变化在片段库中各压力等级的片段之间交叉淡化"""
+    global mixer_session
+    if not accepting_jobs:
+        return jsonify({'error': '服务正在重启，请稍后重试'}), 503
+    if mixer_session is not None and mixer_session.running:
+        return jsonify({'success': True, 'message': '实时混音已在运行', 'status': mixer_session.status()})
+
+    from mixer import AdaptiveMixer
+    from hrv_watcher import read_float_from_file
+    data = request.get_json(silent=True) or {}
+    try:
+        crossfade_seconds = float(data.get('crossfade_seconds', 2.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'crossfade_seconds 必须为数字'}), 400
+    latest_hrv_path = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_hrv.txt')
+    user_id = current_user_id()
+    session = AdaptiveMixer(library, AUDIO_DIR, functools.partial(read_float_from_file, latest_hrv_path),
+                            preference_fn=lambda: profiles.get(user_id).preference,
+                            crossfade_seconds=crossfade_seconds)
+    if not session.start():
+        return jsonify({'error': '片段库中还没有可用的音乐片段，请先生成音乐'}), 404
+    mixer_session = session
+    return jsonify({'success': True, 'message': '实时混音已启动', 'stream_url': '/api/mixer/stream'})
+
+
+@app.route('/api/mixer/stream')
+@inference_route
+def mixer_stream():
+    """实时混音的音频流（不定长 WAV，按实时速率输出）"""
+    if mixer_session is None or not mixer_session.running:
+        return jsonify({'error': '实时混音未启动'}), 404
+    chunks = mixer_session.open_stream()
+    if chunks is None:
+        return jsonify({'error': '已有连接正在收听实时混音'}), 409
+    return Response(chunks, mimetype='audio/wav', headers={'Cache-Control': 'no-store'})
+
+
+@app.route('/api/mixer/stop', methods=['POST'])
+@inference_route
+def mixer_stop():
+    if mixer_session is not None:
+        mixer_session.stop()
+    return jsonify({'success': True, 'message': '实时混音已停止'})
+
+
+@app.route('/api/mixer/status')
+@inference_route
+def mixer_status():
+    if mixer_session is None:
+        return jsonify({'running': False})
+    return jsonify(mixer_session.status())
 
 @app.route('/api/audio/<file_id>')
 def get_audio(file_id):
-    """获取生成的音频文件"""
+    """获取生成的音频文件（支持 Range / ETag / 304，长期缓存，见 http_cache.py）；
+    仍在写入（母带处理中）时以不定长 WAV 流返回已写入的部分，直到写入完成"""
     try:
         file_path = os.path.join(AUDIO_DIR, f"{file_id}.wav")
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=False)
-        else:
-            return jsonify({'error': '音频文件不存在'}), 404
+        if not os.path.exists(file_path):
+            try:
+                return Response(follow_wav(file_path), mimetype='audio/wav', headers={'Cache-Control': 'no-store'})
+            except FileNotFoundError:
+                # 既没有在写入，也不是刚刚发布
+                if not os.path.exists(file_path):
+                    return jsonify({'error': '音频文件不存在'}), 404
+        entry = library.get(file_id)
+        etag = entry['content_hash'] if entry else None
+        if not etag:
+            # 对账补登或旧版索引库中的文件：首次请求时补算内容哈希
+            etag = content_hash(file_path)
+            if entry:
+                library.set_content_hash(file_id, etag)
+        # 拖动进度条产生的后续范围请求不重复计为一次播放
+        if request.range is None or request.range.ranges[0][0] == 0:
+            library.touch(file_id)
+        return send_immutable_file(file_path, etag, mimetype='audio/wav')
+    except FileNotFoundError:
+        # 请求过程中被淘汰
+        return jsonify({'error': '音频文件不存在'}), 404
     except Exception as e:
         return jsonify({'error': f'获取音频文件时出错: {str(e)}'}), 500
 
+@app.route('/api/audio/<file_id>/overview')
+def get_audio_overview(file_id):
+    """获取音频的预计算概览（多分辨率峰值 / RMS / 频段能量，二进制格式见 overview.py），
+    供前端在不下载整个 WAV 的情况下绘制波形与频谱可视化。概览在生成时与音频一起写入（generation.render_music），
+    Web 层只发送已有的文件；旧文件没有概览时在推理进程中补算（概览计算依赖 numpy / scipy，Web 层不加载）。"""
+    try:
+        path = library.overview_path(file_id)
+        if not os.path.exists(path):
+            if INFERENCE_URL:
+                return _proxy_to_inference()
+            audio_path = library.audio_path(file_id)
+            if not os.path.exists(audio_path):
+                return jsonify({'error': '音频文件不存在'}), 404
+            import overview
+            overview.write_overview(audio_path, path)
+        return send_immutable_file(path, content_hash(path), mimetype='application/octet-stream')
+    except FileNotFoundError:
+        return jsonify({'error': '音频文件不存在'}), 404
+    except Exception as e:
+        return jsonify({'error': f'获取音频概览时出错: {str(e)}'}), 500
+
+@app.route('/api/profile/<profile_id>')
+def get_profile(profile_id):
+    """下载某次生成任务的剖析结果（.folded 折叠栈或 .pstats）"""
+    try:
+        profile_path, mode = find_profile(profile_id)
+        if profile_path is None:
+            return jsonify({'error': '剖析结果不存在'}), 404
+        return send_file(profile_path, as_attachment=True,
+                         download_name=os.path.basename(profile_path),
+                         mimetype='text/plain' if mode == 'sample' else 'application/octet-stream')
+    except Exception as e:
+        return jsonify({'error': f'获取剖析结果时出错: {str(e)}'}), 500
+
 # 删除重复的 /api/model-status 路由定义
 # 保留上面第275行开始的改进版本
 
 @app.route('/api/set-preference', methods=['POST'])
+@inference_route
 def set_preference():
-    """设置用户音乐偏好（流行/摇滚/古典），更新运行时的 STRESS_MUSIC_MAP 并持久化到 stress.py。"""
+    """设置当前用户的音乐偏好（流行/摇滚/古典等），写入该用户的偏好档案。"""
     try:
         if not request.is_json:
             return jsonify({'error':'请求必须是JSON格式'}), 400
@@ -586,7 +857,7 @@ def set_preference():
         if not pref:
             return jsonify({'error':'未提供 preference 字段'}), 400
 
-        ok, msg = update_and_persist_preference(pref)
+        ok, msg = update_and_persist_preference(pref, current_user_id())
         if ok:
             return jsonify({'success': True, 'preference': msg})
         else:
@@ -627,8 +898,9 @@ def latest_hrv():
 
 
 @app.route('/api/confirm-preference', methods=['POST'])
+@inference_route
 def confirm_preference():
-    """在前端确认偏好时：1) 更新并持久化 STRESS_MUSIC_MAP，2) 启动 hrv_watcher.py 进程。
+    """在前端确认偏好时写入当前用户的偏好档案（不再启动 hrv_watcher.py，前端在确认后触发生成）。
     请求体: { 'preference': '流行' }
     """
     try:
@@ -639,7 +911,7 @@ def confirm_preference():
         if not pref:
             return jsonify({'error':'未提供 preference 字段'}), 400
 
-        ok, msg = update_and_persist_preference(pref)
+        ok, msg = update_and_persist_preference(pref, current_user_id())
         # 如果持久化失败，仍然返回成功响应码 200，让前端决定是否继续生成音乐。
         # 前端有处理：若 success=false 则显示提示但继续生成。
         if not ok:
@@ -652,6 +924,7 @@ def confirm_preference():
 
 
 @app.route('/api/start-measurement', methods=['POST'])
+@inference_route
 def start_measurement():
     """启动 hrv_reader.py 测量进程。接收 JSON: { "port": "/dev/tty...", "baud": 115200, "window": 30 }
     如果已有测量在运行，则返回当前状态。"""
@@ -696,6 +969,7 @@ def start_measurement():
 
 
 @app.route('/api/measurement-status')
+@inference_route
 def measurement_status():
     """返回当前测量状态（running/finished/error 和输出片段）"""
     try:
@@ -725,37 +999,31 @@ def measurement_status():
 def storage_status():
     """获取存储状态"""
     try:
-        if not os.path.exists(AUDIO_DIR):
-            return jsonify({
-                'total_files': 0,
-                'total_size_mb': 0,
-                'max_files': MAX_AUDIO_FILES,
-                'retention_hours': AUDIO_RETENTION_HOURS
-            })
-        
-        files = os.listdir(AUDIO_DIR)
-        audio_files = [f for f in files if f.endswith('.wav')]
-        
-        total_size = 0
-        for file in audio_files:
-            file_path = os.path.join(AUDIO_DIR, file)
-            total_size += os.path.getsize(file_path)
-        
+        stats = library.stats()
+        eviction = library.eviction_stats()
         return jsonify({
-            'total_files': len(audio_files),
-            'total_size_mb': round(total_size / (1024 * 1024), 2),
+            'total_files': stats['total_files'],
+            'total_size_mb': round(stats['total_bytes'] / (1024 * 1024), 2),
+            'budget_mb': round(MAX_AUDIO_BYTES / (1024 * 1024), 2),
             'max_files': MAX_AUDIO_FILES,
-            'retention_hours': AUDIO_RETENTION_HOURS
+            'eviction': {
+                'evicted_files': eviction['evicted_files'],
+                'evicted_size_mb': round(eviction['evicted_bytes'] / (1024 * 1024), 2),
+                'total_hits': eviction['total_hits'],
+                'last_evicted_at': eviction['last_evicted_at'],
+                'inflation': eviction['inflation']
+            }
         })
     except Exception as e:
         return jsonify({'error': f'获取存储状态失败: {str(e)}'}), 500
 
 @app.route('/api/cleanup-files', methods=['POST'])
+@inference_route
 def cleanup_files():
     """手动清理文件"""
     try:
-        cleanup_old_files()
-        return jsonify({'success': True, 'message': '文件清理完成'})
+        evicted = cleanup_old_files()
+        return jsonify({'success': True, 'message': '文件清理完成', 'evicted': len(evicted)})
     except Exception as e:
         return jsonify({'error': f'清理文件失败: {str(e)}'}), 500
 
@@ -789,11 +1057,14 @@ def simulate_hrv():
 
 
 @app.route('/api/get-stress-map')
+@inference_route
 def get_stress_map():
-    """只读：返回当前运行时的 STRESS_MUSIC_MAP，便于前端或测试脚本验证偏好已写入内存/文件。"""
+    """只读：返回当前用户偏好下的压力-音乐映射，便于前端或测试脚本验证偏好已写入档案。"""
     try:
-        # 直接返回运行时内存中的映射
-        return jsonify({'success': True, 'stress_map': STRESS_MUSIC_MAP})
+        profile = current_profile()
+        return jsonify({'success': True, 'preference': profile.preference,
+                        'stress_map': stress.stress_music_map_for(profile.preference),
+                        'config_version': stress.PROMPT_CONFIG.version})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -809,4 +1080,6 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"⚠️  清空 latest_hrv.txt 文件时出错: {e}")
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # 不启用重载器：重载器的父进程也会执行模块级代码（加载模型、任务工作线程、后台淘汰、与目录对账），
+    # 变成两个进程同时领取任务、淘汰文件并各自加载模型
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+audio_buffer.py
+
+音频数据在进程内的两种合法形态：处理中为 float32（-1..1），落盘 / 缓存 / 网络传输时为 int16。
+
+numpy 的很多默认行为会悄悄把数据升为 float64（`np.linspace`、`scipy.signal.lfilter`、与 Python float
+或 float64 数组的运算、整型数组的 mean 等），在 5 分钟的音频上每次都多出一份 2 倍大小的副本。
+生成、滤波、循环拼接、编码各环节在边界处统一经过这里：
+
+  - as_float32(x)     torch 张量 / 任意 numpy 数组 -> 一维 float32（已是 float32 时不复制）；
+                      int16 PCM 按 1/32768 缩放；其他整型、float64 等会被转换（而不是原样放行）
+  - to_int16(x)       float32 -> int16（原地缩放）
+  - AudioBuffer       int16 静态存储的单声道音频（可内存映射 WAV 文件），按需取出 float32 片段
+  - check_float32(x)  断言数组为 float32，tools/check_dtypes.py 用它检查热路径
+
+WAV 文件的写入（增量写入、原子发布）见 wav_io.py。本模块只依赖 numpy（读取 WAV 时延迟导入 scipy.io.wavfile）。
+"""
+
+import numpy as np
+
+from wav_io import write_wav
+
+
+_INT16_SCALE = np.float32(1.0 / 32768)
+
+
+def as_float32(audio):
+    """转换为一维 float32 波形；已是 float32 的 numpy 数组原样返回（不复制）"""
+    if hasattr(audio, 'detach'):  # torch.Tensor
+        audio = audio.detach().cpu().float().numpy()
+    audio = np.asarray(audio)
+    if audio.ndim > 1:
+        audio = audio.reshape(-1) if audio.shape[0] == 1 or audio.shape[-1] == 1 else _downmix(audio)
+    if audio.dtype == np.float32:
+        return audio
+    if audio.dtype == np.int16:
+        out = audio.astype(np.float32)
+        out *= _INT16_SCALE
+        return out
+    if np.iscomplexobj(audio):
+        raise TypeError(f"不支持的音频数据类型: {audio.dtype}")
+    return audio.astype(np.float32)
+
+
+def _downmix(audio):
+    """多声道 -> 单声道 float32（按 float32 累加求平均；int16 数组的 mean 默认会得到 float64）"""
+    if audio.shape[0] < audio.shape[-1]:  # (channels, samples)
+        audio = audio.T
+    if audio.dtype == np.int16:
+        mono = audio.mean(axis=1, dtype=np.float32)
+        mono *= _INT16_SCALE
+        return mono
+    return audio.astype(np.float32, copy=False).mean(axis=1, dtype=np.float32)
+
+
+def to_int16(audio):
+    """float32（-1..1）转换为 16-bit PCM。缩放与截断在 audio 上原地进行，不产生 float64 或额外的 float 副本"""
+    audio *= np.float32(32767)
+    np.clip(audio, -32768, 32767, out=audio)
+    return audio.astype(np.int16)
+
+
+def check_float32(audio, where=''):
+    """断言 audio 为 float32 数组（numpy 的 float64 升级在这里暴露出来，而不是悄悄翻倍内存）"""
+    dtype = getattr(audio, 'dtype', None)
+    if dtype != np.float32:
+        raise TypeError(f"{where or '音频数据'} 应为 float32，实际为 {dtype}")
+    return audio
+
+
+class AudioBuffer:
+    """int16 静态存储的单声道音频。samples 可以是内存映射的数组（不占用进程内存）"""
+
+    __slots__ = ('samples', 'sampling_rate')
+
+    def __init__(self, samples, sampling_rate):
+        samples = np.asarray(samples)
+        if samples.dtype != np.int16:
+            # to_int16 原地缩放，先复制一份，不修改调用方的数组
+            samples = to_int16(np.array(as_float32(samples)))
+        self.samples = samples
+        self.sampling_rate = int(sampling_rate)
+
+    @classmethod
+    def read_wav(cls, path, mmap=False):
+        """读取 WAV；int16 单声道文件在 mmap=True 时直接内存映射"""
+        from scipy.io import wavfile
+        sampling_rate, samples = wavfile.read(path, mmap=mmap)
+        if samples.ndim > 1:
+            samples = _downmix(samples)
+        return cls(samples, sampling_rate)
+
+    def write_wav(self, path):
+        write_wav(path, self.samples, self.sampling_rate)
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sampling_rate
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+    def float32(self, start=0, end=None, out=None):
+        """取出 [start, end) 的 float32 副本（-1..1）；可传入预分配的 out"""
+        segment = self.samples[start:end]
+        if out is None:
+            out = np.empty(len(segment), dtype=np.float32)
+        out = out[:len(segment)]
+        out[:] = segment
+        out *= _INT16_SCALE
+        return out
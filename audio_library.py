@@ -0,0 +1,372 @@
+"""
+audio_library.py
+
+生成音频的索引库：用 SQLite（`generated_audio/library.db`）记录每个音频文件的
+file_id、prompt、压力等级、大小、创建时间与最近访问时间。
+
+- 写入音频后调用 `add()`，播放/下载时调用 `touch()`，索引与磁盘保持同步；
+- 文件总数与总字节数由触发器维护在 `library_stats` 单行表中，`stats()` 为 O(1)；
+- 淘汰采用按字节预算的 GDSF（Greedy-Dual-Size-Frequency）策略：
+      priority = L + (1 + hit_count) * cost_seconds / size_mb
+  其中 cost_seconds 为重新生成该片段的耗时，L 为“通胀值”（每次淘汰后取被淘汰条目的 priority），
+  因此最近访问、常被播放、生成代价高、体积小的片段会被保留；
+- `priority` 列上建有索引，淘汰时按索引顺序取出优先级最低的条目，相当于一个持久化的最小堆，
+  不再需要 `os.listdir` + 逐个 `getmtime`；
+- 索引库本身在磁盘上，重启后直接复用；启动时 `reconcile()` 会与目录做一次对账；
+- `BackgroundEvictor` 在有新文件写入时被唤醒，小批量地把库收敛到预算内，代替每小时一次的全量清理。
+
+SQLite 使用 WAL 模式，多个进程（例如多个 Web worker）可同时读写同一个库。
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+from wav_io import OVERVIEW_SUFFIX, PART_SUFFIX
+
+# 未知生成耗时（例如对账时补登的旧文件）时使用的默认重新生成代价（秒）
+DEFAULT_COST_SECONDS = 120.0
+# 超过这个时间没有更新的 .wav.part 视为中断的写入残留，对账时删除
+STALE_PART_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_files (
+    file_id       TEXT PRIMARY KEY,
+    prompt        TEXT,
+    stress_level  TEXT,
+    size_bytes    INTEGER NOT NULL DEFAULT 0,
+    created_at    REAL NOT NULL,
+    last_accessed REAL NOT NULL,
+    hit_count     INTEGER NOT NULL DEFAULT 0,
+    cost_seconds  REAL NOT NULL DEFAULT 120.0,
+    priority      REAL NOT NULL DEFAULT 0,
+    preference    TEXT,
+    target_bpm    INTEGER,
+    variant       INTEGER,
+    draft         INTEGER NOT NULL DEFAULT 0,
+    content_hash  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_audio_files_last_accessed ON audio_files(last_accessed);
+CREATE INDEX IF NOT EXISTS idx_audio_files_created_at ON audio_files(created_at);
+
+CREATE TABLE IF NOT EXISTS library_stats (
+    id          INTEGER PRIMARY KEY CHECK (id = 1),
+    total_files INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO library_stats (id, total_files, total_bytes) VALUES (1, 0, 0);
+
+CREATE TABLE IF NOT EXISTS eviction_stats (
+    id               INTEGER PRIMARY KEY CHECK (id = 1),
+    inflation        REAL NOT NULL DEFAULT 0,
+    evicted_files    INTEGER NOT NULL DEFAULT 0,
+    evicted_bytes    INTEGER NOT NULL DEFAULT 0,
+    total_hits       INTEGER NOT NULL DEFAULT 0,
+    last_evicted_at  REAL
+);
+INSERT OR IGNORE INTO eviction_stats (id) VALUES (1);
+
+CREATE TRIGGER IF NOT EXISTS trg_audio_files_insert AFTER INSERT ON audio_files BEGIN
+    UPDATE library_stats SET total_files = total_files + 1,
+                             total_bytes = total_bytes + NEW.size_bytes WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_audio_files_delete AFTER DELETE ON audio_files BEGIN
+    UPDATE library_stats SET total_files = total_files - 1,
+                             total_bytes = total_bytes - OLD.size_bytes WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_audio_files_resize AFTER UPDATE OF size_bytes ON audio_files BEGIN
+    UPDATE library_stats SET total_bytes = total_bytes - OLD.size_bytes + NEW.size_bytes WHERE id = 1;
+END;
+"""
+
+# 旧版索引库缺少的列（原地迁移）
+_MIGRATIONS = {
+    'hit_count': "ALTER TABLE audio_files ADD COLUMN hit_count INTEGER NOT NULL DEFAULT 0",
+    'cost_seconds': "ALTER TABLE audio_files ADD COLUMN cost_seconds REAL NOT NULL DEFAULT 120.0",
+    'priority': "ALTER TABLE audio_files ADD COLUMN priority REAL NOT NULL DEFAULT 0",
+    'preference': "ALTER TABLE audio_files ADD COLUMN preference TEXT",
+    'target_bpm': "ALTER TABLE audio_files ADD COLUMN target_bpm INTEGER",
+    'variant': "ALTER TABLE audio_files ADD COLUMN variant INTEGER",
+    'draft': "ALTER TABLE audio_files ADD COLUMN draft INTEGER NOT NULL DEFAULT 0",
+    'content_hash': "ALTER TABLE audio_files ADD COLUMN content_hash TEXT",
+}
+
+_COLUMNS = ('file_id', 'prompt', 'stress_level', 'size_bytes', 'created_at', 'last_accessed',
+            'hit_count', 'cost_seconds', 'priority', 'preference', 'target_bpm', 'variant', 'draft',
+            'content_hash')
+
+# GDSF 优先级：(1 + hit_count) * cost / size_mb，体积下限 0.01 MB 防止除零
+_VALUE_SQL = "(1 + {hits}) * cost_seconds / MAX(size_bytes / 1048576.0, 0.01)"
+
+
+class AudioLibrary:
+    """生成音频的持久化索引。所有方法都是线程安全的。"""
+
+    def __init__(self, db_path, audio_dir):
+        self.db_path = db_path
+        self.audio_dir = audio_dir
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(audio_files)")}
+            for column, ddl in _MIGRATIONS.items():
+                if column not in existing:
+                    self._conn.execute(ddl)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audio_files_priority ON audio_files(priority)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audio_files_level ON audio_files(stress_level, preference)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_audio_files_prompt ON audio_files(prompt)"
+            )
+            self._conn.commit()
+
+    def audio_path(self, file_id):
+        return os.path.join(self.audio_dir, f"{file_id}.wav")
+
+    def overview_path(self, file_id):
+        """与音频一起保存的预计算概览（overview.py）"""
+        return os.path.join(self.audio_dir, f"{file_id}{OVERVIEW_SUFFIX}")
+
+    # ------------------------------------------------------------------ 写入 / 访问
+
+    def _inflation(self):
+        return self._conn.execute("SELECT inflation FROM eviction_stats WHERE id = 1").fetchone()['inflation']
+
+    def add(self, file_id, prompt=None, stress_level=None, size_bytes=None, created_at=None,
+            cost_seconds=None, preference=None, target_bpm=None, variant=None, draft=False, content_hash=None):
+        """登记一个新生成的音频文件（已存在则覆盖元数据）。
+
+        cost_seconds 为本次生成耗时，作为该片段的重新生成代价参与淘汰优先级计算；
+        preference 为生成时的用户音乐偏好（未设置为 None），target_bpm / variant 为离线预生成
+        （tools/prerender.py）记录的目标 BPM 与变体序号，draft 标记渐进式生成的草稿档；
+        content_hash 为文件内容哈希（wav_io.content_hash），用作 /api/audio 的 ETag，未知时在首次请求时补算。
+        """
+        if size_bytes is None:
+            size_bytes = os.path.getsize(self.audio_path(file_id))
+        if cost_seconds is None or cost_seconds <= 0:
+            cost_seconds = DEFAULT_COST_SECONDS
+        now = created_at if created_at is not None else time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM audio_files WHERE file_id = ?", (file_id,))
+            self._conn.execute(
+                "INSERT INTO audio_files (file_id, prompt, stress_level, size_bytes, created_at, last_accessed, "
+                "cost_seconds, preference, target_bpm, variant, draft, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_id, prompt, stress_level, int(size_bytes), now, now, float(cost_seconds), preference,
+                 target_bpm, variant, int(bool(draft)), content_hash)
+            )
+            self._conn.execute(
+                f"UPDATE audio_files SET priority = ? + {_VALUE_SQL.format(hits='hit_count')} WHERE file_id = ?",
+                (self._inflation(), file_id)
+            )
+
+    def touch(self, file_id):
+        """记录一次访问（命中数 +1 并按当前通胀值刷新优先级），返回该文件是否在索引中。"""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                f"UPDATE audio_files SET last_accessed = ?, hit_count = hit_count + 1, "
+                f"priority = ? + {_VALUE_SQL.format(hits='(hit_count + 1)')} WHERE file_id = ?",
+                (time.time(), self._inflation(), file_id)
+            )
+            if cur.rowcount > 0:
+                self._conn.execute("UPDATE eviction_stats SET total_hits = total_hits + 1 WHERE id = 1")
+            return cur.rowcount > 0
+
+    def set_content_hash(self, file_id, content_hash):
+        """补记文件内容哈希（对账补登或旧版索引库中的条目没有记录）"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE audio_files SET content_hash = ? WHERE file_id = ?", (content_hash, file_id))
+
+    def get(self, file_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM audio_files WHERE file_id = ?", (file_id,)
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, stress_level, preference=None, limit=8):
+        """按压力等级与偏好查找已生成的片段，常播放的、较新的排在前面。
+
+        没有完全匹配偏好的片段时，回退到同一压力等级的任意片段。
+        """
+        query = (f"SELECT {', '.join(_COLUMNS)} FROM audio_files WHERE stress_level = ? AND draft = 0 {{extra}} "
+                 f"ORDER BY hit_count DESC, created_at DESC LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(query.format(extra="AND preference IS ?"),
+                                      (stress_level, preference, limit)).fetchall()
+            if not rows:
+                rows = self._conn.execute(query.format(extra=""), (stress_level, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def find_by_prompt(self, prompt):
+        """返回与 prompt 完全相同的已生成片段（不含草稿档），按变体序号排列。"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM audio_files WHERE prompt = ? AND draft = 0 "
+                f"ORDER BY variant, created_at", (prompt,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def recent_cost_seconds(self, draft=False, limit=20):
+        """最近 limit 个模型生成片段（草稿档或完整档）生成耗时的中位数，没有记录时返回 None。
+
+        用作准入控制（admission.py）的生成耗时初值；离线预生成（variant 不为空）与对账补登（没有 prompt）的片段不计入。
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cost_seconds FROM audio_files WHERE draft = ? AND variant IS NULL AND prompt IS NOT NULL "
+                "ORDER BY created_at DESC LIMIT ?", (int(bool(draft)), limit)
+            ).fetchall()
+        costs = sorted(row['cost_seconds'] for row in rows)
+        return costs[len(costs) // 2] if costs else None
+
+    def remove(self, file_id):
+        """删除音频文件（连同概览）及其索引条目，返回是否确实删除了音频文件。"""
+        path = self.audio_path(file_id)
+        removed = False
+        try:
+            os.remove(path)
+            removed = True
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(self.overview_path(file_id))
+        except FileNotFoundError:
+            pass
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM audio_files WHERE file_id = ?", (file_id,))
+        return removed
+
+    # ------------------------------------------------------------------ 统计 / 清理
+
+    def stats(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total_files, total_bytes FROM library_stats WHERE id = 1"
+            ).fetchone()
+        return {'total_files': row['total_files'], 'total_bytes': row['total_bytes']}
+
+    def eviction_stats(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT inflation, evicted_files, evicted_bytes, total_hits, last_evicted_at "
+                "FROM eviction_stats WHERE id = 1"
+            ).fetchone()
+        return dict(row)
+
+    def over_budget(self, max_bytes, max_files=None):
+        stats = self.stats()
+        return stats['total_bytes'] > max_bytes or (max_files is not None and stats['total_files'] > max_files)
+
+    def evict_to_budget(self, max_bytes, max_files=None, limit=None):
+        """按 GDSF 优先级从低到高淘汰，直到总字节数（以及可选的文件数）回到预算内。
+
+        limit 限制本次最多淘汰的条目数，便于后台小批量增量执行。返回被淘汰的 file_id 列表。
+        """
+        evicted = []
+        while self.over_budget(max_bytes, max_files) and (limit is None or len(evicted) < limit):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT file_id, size_bytes, priority FROM audio_files ORDER BY priority LIMIT 1"
+                ).fetchone()
+            if row is None:
+                break
+            self.remove(row['file_id'])
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE eviction_stats SET inflation = MAX(inflation, ?), evicted_files = evicted_files + 1, "
+                    "evicted_bytes = evicted_bytes + ?, last_evicted_at = ? WHERE id = 1",
+                    (row['priority'], row['size_bytes'], time.time())
+                )
+            evicted.append(row['file_id'])
+        return evicted
+
+    def reconcile(self):
+        """与磁盘目录对账：补登未入库的 .wav，移除已不存在文件的条目，删除中断写入残留的 .wav.part
+        与音频已被删除的 .overview。仅在启动时调用一次。"""
+        if not os.path.exists(self.audio_dir):
+            return
+        on_disk = {}
+        overviews = []
+        now = time.time()
+        for entry in os.scandir(self.audio_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith('.wav'):
+                on_disk[entry.name[:-4]] = entry.stat()
+            elif entry.name.endswith('.wav' + PART_SUFFIX) and now - entry.stat().st_mtime > STALE_PART_SECONDS:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+            elif entry.name.endswith(OVERVIEW_SUFFIX):
+                overviews.append(entry)
+        with self._lock:
+            indexed = {row['file_id'] for row in self._conn.execute("SELECT file_id FROM audio_files")}
+        added = 0
+        for file_id, st in on_disk.items():
+            if file_id not in indexed:
+                self.add(file_id, size_bytes=st.st_size, created_at=st.st_mtime)
+                added += 1
+        for entry in overviews:
+            if entry.name[:-len(OVERVIEW_SUFFIX)] not in on_disk:
+                # 音频已不存在的概览
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        stale = indexed - on_disk.keys()
+        if stale:
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM audio_files WHERE file_id = ?", [(f,) for f in stale])
+        if added or stale:
+            print(f"🗂️  音频索引已对账: 新增 {added} 条, 移除 {len(stale)} 条")
+
+
+class BackgroundEvictor:
+    """后台增量淘汰线程：有新文件写入时调用 `notify()` 唤醒，按小批量把索引库收敛到预算内。
+
+    每批之间短暂让出 CPU，避免一次性删除大量文件阻塞磁盘；即使没有通知，也会按 `idle_interval`
+    定期自检一次（例如其它进程写入了文件）。
+    """
+
+    def __init__(self, library, max_bytes, max_files=None, batch_size=4, idle_interval=300, batch_pause=0.05):
+        self.library = library
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.batch_pause = batch_pause
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='audio-evictor', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.idle_interval)
+            self._wakeup.clear()
+            try:
+                while True:
+                    evicted = self.library.evict_to_budget(self.max_bytes, self.max_files, limit=self.batch_size)
+                    for file_id in evicted:
+                        print(f"已淘汰音频文件: {file_id}.wav")
+                    if len(evicted) < self.batch_size:
+                        break
+                    time.sleep(self.batch_pause)
+            except Exception as e:
+                print(f"后台淘汰音频文件时出错: {e}")
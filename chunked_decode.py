@@ -0,0 +1,72 @@
+"""
+chunked_decode.py
+
+分块把 EnCodec codes 解码为波形，限制单个任务的峰值内存。
+
+一次性解码整段 codes 时，EnCodec 解码器各层的中间激活都与整段音频等长（通道数高达数百），
+峰值内存远大于最终的波形本身。这里按 chunk_frames 帧一块解码，每块在两侧各多解码
+overlap_frames 帧作为上下文（卷积感受野 / LSTM 状态预热），只保留中间部分，相邻两块在
+边界附近做线性交叉淡化，结果直接累加到预先分配好的 float32 输出数组中。
+
+本模块只依赖 numpy，decode_fn 由调用方提供（PyTorch 或 ONNX Runtime 的 EnCodec 解码器）。
+
+用法示例：
+    audio = decode_in_chunks(lambda a, b: decode(codes[..., a:b]), num_frames, hop_length=640)
+"""
+
+import numpy as np
+
+
+DEFAULT_CHUNK_FRAMES = 250  # 每块 5 秒（EnCodec 50 帧/秒）
+DEFAULT_OVERLAP_FRAMES = 24  # 每侧上下文约 0.5 秒
+
+
+def decode_in_chunks(decode_fn, num_frames, hop_length, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                     overlap_frames=DEFAULT_OVERLAP_FRAMES, out=None):
+    """分块解码，返回单声道 float32 波形（长度 num_frames * hop_length）。
+
+    decode_fn(start, end) 解码 [start, end) 帧，返回一维波形（长度约为 (end - start) * hop_length）。
+    out 可传入预先分配的输出数组（会被清零后写入）。
+    """
+    total = num_frames * hop_length
+    if out is None:
+        out = np.zeros(total, dtype=np.float32)
+    else:
+        out = out[:total]
+        out.fill(0)
+    if num_frames <= chunk_frames + 2 * overlap_frames:
+        audio = np.asarray(decode_fn(0, num_frames), dtype=np.float32)
+        n = min(total, len(audio))
+        out[:n] = audio[:n]
+        return out
+
+    # 交叉淡化区间：以块边界为中心、宽 2 * half 帧；上下文必须覆盖淡化区间
+    half = max(1, min(overlap_frames, chunk_frames // 2) // 2)
+    ramp = (np.arange(2 * half * hop_length, dtype=np.float32) + 0.5) / (2 * half * hop_length)
+
+    # 均分块边界，避免最后一块过短（短于淡化区间）
+    num_chunks = -(-num_frames // chunk_frames)
+    bounds = np.linspace(0, num_frames, num_chunks + 1).round().astype(int)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        start, end = int(start), int(end)
+        decode_start = max(0, start - overlap_frames)
+        decode_end = min(num_frames, end + overlap_frames)
+        audio = np.asarray(decode_fn(decode_start, decode_end), dtype=np.float32)
+
+        # 本块写入的范围：[start - half, end + half)，两端的淡化区与相邻块重叠
+        keep_start = max(0, start - half)
+        keep_end = min(num_frames, end + half)
+        offset = (keep_start - decode_start) * hop_length
+        segment = audio[offset:offset + (keep_end - keep_start) * hop_length]
+        dest = out[keep_start * hop_length:keep_start * hop_length + len(segment)]
+
+        if start > 0:
+            n = min(len(ramp), len(segment))
+            segment[:n] *= ramp[:n]
+        if end < num_frames:
+            n = min(len(ramp), len(segment))
+            segment[len(segment) - n:] *= ramp[::-1][len(ramp) - n:]
+        dest += segment[:len(dest)]
+        del audio, segment
+
+    return out
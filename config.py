@@ -4,9 +4,9 @@ class Config:
     """基础配置"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     AUDIO_DIR = os.environ.get('AUDIO_DIR') or 'generated_audio'
-    MAX_AUDIO_FILES = int(os.environ.get('MAX_AUDIO_FILES', 50))
-    CLEANUP_INTERVAL = int(os.environ.get('CLEANUP_INTERVAL', 3600))
-    AUDIO_RETENTION_HOURS = int(os.environ.get('AUDIO_RETENTION_HOURS', 24))
+    MAX_AUDIO_BYTES = int(os.environ.get('MAX_AUDIO_BYTES', 1024 * 1024 * 1024))
+    MAX_AUDIO_FILES = int(os.environ.get('MAX_AUDIO_FILES', 500))
+    CLEANUP_IDLE_INTERVAL = int(os.environ.get('CLEANUP_IDLE_INTERVAL', 300))
     
     # 模型配置
     MODEL_PATH = os.environ.get('MODEL_PATH') or '/Users/xibei/MusicGPT/model'
@@ -0,0 +1,199 @@
+"""
+continuous.py
+
+自适应连续配乐：不再把一段音乐 A-B-A-B 循环 5 分钟，而是随 HRV 的变化逐段生成一条连续的音频流。
+
+- 后台生产线程在播放位置之前预先生成下一段（默认 25 秒），每段都以上一段结尾（默认 5 秒）
+  作为 MusicGen 的音频提示续写，并根据当前的压力等级重新计算文本 prompt；
+- 相邻两段在衔接处做等功率交叉淡化（上一段结尾 vs. 模型对同一段音频提示的重新解码），拼成一条流，
+  再经过一条跨段持续运行的母带处理链（dsp.mastering_chain，流式响度归一化 + 前视限幅）；
+- 预读量根据实测的单段生成耗时自适应：缓冲的未播放时长低于“生成耗时 × 安全系数”时就开始生成下一段，
+  保证 CPU 生成速度跟得上播放；没跟上时记录一次 underrun；
+- `stream()` 以实时速率输出一条不定长的 16-bit WAV 流，供 `<audio>` 直接播放。
+
+本模块依赖 numpy 和 generation（torch），只应在推理进程中延迟导入。
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import dsp
+import generation
+from audio_buffer import to_int16
+from wav_io import ExclusiveStream, wav_stream_header
+
+
+class ContinuousSoundtrack:
+    def __init__(self, prompt_fn, segment_seconds=25.0, context_seconds=5.0, crossfade_seconds=1.5,
+                 min_lookahead_seconds=10.0, safety_factor=1.5, client_buffer_seconds=3.0):
+        self.prompt_fn = prompt_fn
+        self.segment_seconds = segment_seconds
+        self.context_seconds = context_seconds
+        self.crossfade_seconds = crossfade_seconds
+        self.min_lookahead_seconds = min_lookahead_seconds
+        self.safety_factor = safety_factor
+        self.client_buffer_seconds = client_buffer_seconds
+
+        # 模型已加载时采样率已知，stream() 可以立即返回 WAV 头，不必等第一段生成完
+        self.sampling_rate = generation.model.config.audio_encoder.sampling_rate if generation.model is not None else None
+        self._blocks = deque()  # 已生成、尚未输出的 int16 块
+        self._buffered_samples = 0
+        self._held_tail = None  # 上一段最后 crossfade 长度的采样，留待与下一段交叉淡化
+        self._context = None  # 下一段续写使用的音频提示
+        self._master = None  # 跨段持续运行的母带处理链（去直流、响度归一化、前视限幅，见 dsp.py）
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._stream_lock = threading.Lock()  # 同一时间只有一个收听连接（见 open_stream）
+        self._thread = None
+        self.stats = {
+            'segments': 0,
+            'underruns': 0,
+            'last_generation_seconds': None,
+            'last_prompt': None,
+            'error': None,
+        }
+
+    # ------------------------------------------------------------------ 生产端
+
+    def start(self):
+        self._thread = threading.Thread(target=self._produce_loop, name='continuous-soundtrack', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stopped.is_set()
+
+    def buffered_seconds(self):
+        if not self.sampling_rate:
+            return 0.0
+        return self._buffered_samples / self.sampling_rate
+
+    def lookahead_target(self):
+        """需要保持的预读时长：至少 min_lookahead，且不少于一段的生成耗时 × 安全系数"""
+        last = self.stats['last_generation_seconds'] or 0.0
+        return max(self.min_lookahead_seconds, last * self.safety_factor)
+
+    def _produce_loop(self):
+        while not self._stopped.is_set():
+            with self._cond:
+                while (not self._stopped.is_set() and self.sampling_rate
+                       and self.buffered_seconds() >= self.lookahead_target()):
+                    self._cond.wait(timeout=0.5)
+            if self._stopped.is_set():
+                break
+            try:
+                prompt = self.prompt_fn()
+                started = time.time()
+                audio, prompt_samples, sampling_rate = generation.generate_continuation(
+                    prompt, self._context, self.segment_seconds
+                )
+                self.stats['last_generation_seconds'] = time.time() - started
+                self.stats['last_prompt'] = prompt
+                self._append_segment(audio, prompt_samples, sampling_rate)
+                print(f"🎼 连续配乐第 {self.stats['segments']} 段已生成"
+                      f"（{self.stats['last_generation_seconds']:.1f}s，缓冲 {self.buffered_seconds():.1f}s）: {prompt}")
+            except Exception as e:
+                self.stats['error'] = str(e)
+                print(f"❌ 连续配乐生成失败: {e}")
+                self._stopped.wait(5)
+
+    def _append_segment(self, audio, prompt_samples, sampling_rate):
+        self.sampling_rate = sampling_rate
+        audio = np.nan_to_num(audio)
+        audio -= audio.mean()
+        xf = int(self.crossfade_seconds * sampling_rate)
+
+        if self._held_tail is None or prompt_samples == 0:
+            body = audio[prompt_samples:]
+        else:
+            # 音频提示的重新解码与上一段结尾对应同一时间段：在其末尾 xf 个采样上做等功率交叉淡化
+            n = min(xf, prompt_samples, len(self._held_tail))
+            t = np.linspace(0, 1, n, dtype=np.float32)
+            faded = self._held_tail[-n:] * np.sqrt(1 - t) + audio[prompt_samples - n:prompt_samples] * np.sqrt(t)
+            body = np.concatenate([self._held_tail[:-n], faded, audio[prompt_samples:]]) if n else \
+                np.concatenate([self._held_tail, audio[prompt_samples:]])
+
+        context_len = int(self.context_seconds * sampling_rate)
+        self._context = body[-context_len:].copy()
+        if xf > 0:
+            emit, self._held_tail = body[:-xf], body[-xf:].copy()
+        else:
+            # 不做交叉淡化：整段直接输出（body[:-0] 是空数组）
+            emit, self._held_tail = body, body[:0].copy()
+
+        if self._master is None:
+            self._master = dsp.mastering_chain(sampling_rate)
+        block = to_int16(self._master.process(emit))
+        with self._cond:
+            self._blocks.append(block)
+            self._buffered_samples += len(block)
+            self.stats['segments'] += 1
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------ 消费端
+
+    def _next_block(self):
+        with self._cond:
+            waited = False
+            while not self._blocks and not self._stopped.is_set():
+                waited = True
+                self._cond.wait(timeout=0.5)
+            if not self._blocks:
+                return None
+            if waited and self.stats['segments'] > 1:
+                self.stats['underruns'] += 1
+            block = self._blocks.popleft()
+            self._buffered_samples -= len(block)
+            self._cond.notify_all()
+            return block
+
+    def open_stream(self):
+        """占用唯一的收听连接并返回 WAV 字节流（close() 时释放）；已有连接在收听时返回 None。
+
+        所有连接共享同一个块队列，第二个连接会与第一个轮流 popleft()，各自只听到一半的音频。
+        """
+        if not self._stream_lock.acquire(blocking=False):
+            return None
+        return ExclusiveStream(self.stream(), self._stream_lock)
+
+    def stream(self, chunk_seconds=0.25):
+        """生成 WAV 字节流；按实时速率输出（最多领先 client_buffer_seconds），使缓冲量反映真实的预读。"""
+        with self._cond:
+            while self.sampling_rate is None and not self._stopped.is_set():
+                self._cond.wait(timeout=0.5)
+        if self.sampling_rate is None:
+            return
+        sr = self.sampling_rate
+        yield wav_stream_header(sr)
+
+        chunk = int(chunk_seconds * sr)
+        sent = 0
+        started = time.time()
+        while True:
+            block = self._next_block()
+            if block is None:
+                return
+            for i in range(0, len(block), chunk):
+                ahead = sent / sr - (time.time() - started)
+                if ahead > self.client_buffer_seconds:
+                    time.sleep(ahead - self.client_buffer_seconds)
+                piece = block[i:i + chunk]
+                sent += len(piece)
+                yield piece.tobytes()
+
+    def status(self):
+        return {
+            'running': self.running,
+            'sampling_rate': self.sampling_rate,
+            'buffered_seconds': round(self.buffered_seconds(), 2),
+            'lookahead_target_seconds': round(self.lookahead_target(), 2),
+            **self.stats,
+        }
@@ -0,0 +1,477 @@
+"""
+dsp.py
+
+分块（流式）音频后处理管线。每个处理级（stage）只看到一块 float32 采样，内部保存跨块的状态，
+因此同一条管线既可以处理整段音频（`Pipeline.run`，按块循环），也可以接在一条不定长的流后面
+（`Pipeline.process`，例如连续配乐）。
+
+处理级：
+  - Sanitize              把 NaN / Inf 替换为 0（原地）
+  - SOSFilter             有状态的二阶节 IIR 滤波（块之间保留 zi，结果与整段滤波一致）；
+                          `SOSFilter.lowpass` 为 Butterworth 低通（B 段变奏使用）
+  - DCBlocker             一阶高通（默认 10 Hz）的运行直流消除，代替整段求均值
+  - LoudnessNormalizer    按 ITU-R BS.1770 K 加权响度（400 ms 门限块、绝对 / 相对门限）归一化到目标 LUFS，
+                          流式时用最近 window_seconds 秒估计响度，增益平滑变化；可用 initial_lufs 预先给定
+  - LookaheadLimiter      前视限幅：信号延迟 lookahead_ms，增益在峰值到达之前线性降到位，
+                          保证输出不超过 ceiling，之后按 release_ms 恢复；代替必须看完整段的全局峰值归一化
+
+`mastering_chain()` 组合出生成结果的标准母带处理链：Sanitize -> DCBlocker -> LoudnessNormalizer -> LookaheadLimiter。
+`render_loop()` 是生成结果的完整后处理（去直流 -> A-B-A-B 重叠拼接 -> 母带处理 -> int16），
+可以边处理边写入 wav_io.WavWriter。
+`Pipeline.profile()` 返回每一级累计耗时，供 tools/bench_dsp.py 逐级测量。
+
+本模块只依赖 numpy 和 scipy.signal，所有处理级都保持 float32（见 audio_buffer.py）。
+
+用法示例：
+    chain = mastering_chain(sampling_rate)
+    audio = chain.run(audio, out=audio)           # 整段（原地）
+    for block in stream:                          # 流式
+        send(to_int16(chain.process(block)))
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+import scipy.signal
+
+from audio_buffer import as_float32, to_int16
+
+
+DEFAULT_BLOCK_SIZE = 8192
+DEFAULT_TARGET_LUFS = -16.0
+DEFAULT_CEILING_DB = -1.0
+
+
+class Stage:
+    """处理级基类：process(block) 返回处理后的块（可以原地修改输入，长度可以与输入不同）"""
+
+    def process(self, block):
+        raise NotImplementedError
+
+    def flush(self):
+        """输入结束时输出内部缓冲的剩余采样"""
+        return np.zeros(0, dtype=np.float32)
+
+    def reset(self):
+        pass
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+
+class Sanitize(Stage):
+    def process(self, block):
+        if not np.isfinite(block).all():
+            np.nan_to_num(block, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        return block
+
+
+class SOSFilter(Stage):
+    """有状态的二阶节滤波。第一块用稳态初值（避免起始处的阶跃瞬态）"""
+
+    def __init__(self, sos):
+        self.sos = np.asarray(sos, dtype=np.float32)
+        self._zi_unit = scipy.signal.sosfilt_zi(self.sos).astype(np.float32)
+        self._zi = None
+
+    @classmethod
+    def lowpass(cls, sampling_rate, cutoff_hz, order=4):
+        return cls(scipy.signal.butter(order, cutoff_hz / (sampling_rate / 2), 'low', output='sos'))
+
+    @classmethod
+    def highpass(cls, sampling_rate, cutoff_hz, order=2):
+        return cls(scipy.signal.butter(order, cutoff_hz / (sampling_rate / 2), 'high', output='sos'))
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        if self._zi is None:
+            self._zi = self._zi_unit * block[0]
+        block[:], self._zi = scipy.signal.sosfilt(self.sos, block, zi=self._zi)
+        return block
+
+    def reset(self):
+        self._zi = None
+
+
+class DCBlocker(SOSFilter):
+    """一阶高通 y[n] = x[n] - x[n-1] + r * y[n-1]，截止频率约 cutoff_hz"""
+
+    def __init__(self, sampling_rate, cutoff_hz=10.0):
+        r = float(np.exp(-2 * np.pi * cutoff_hz / sampling_rate))
+        super().__init__([[1.0, -1.0, 0.0, 1.0, -r, 0.0]])
+
+
+def k_weighting_sos(sampling_rate):
+    """BS.1770 K 加权滤波器（高架 + 高通）的二阶节系数"""
+    def biquad(kind, gain_db, q, fc):
+        a = 10 ** (gain_db / 40)
+        w0 = 2 * np.pi * fc / sampling_rate
+        alpha = np.sin(w0) / (2 * q)
+        cos = np.cos(w0)
+        if kind == 'high_shelf':
+            b = [a * ((a + 1) + (a - 1) * cos + 2 * np.sqrt(a) * alpha),
+                 -2 * a * ((a - 1) + (a + 1) * cos),
+                 a * ((a + 1) + (a - 1) * cos - 2 * np.sqrt(a) * alpha)]
+            den = [(a + 1) - (a - 1) * cos + 2 * np.sqrt(a) * alpha,
+                   2 * ((a - 1) - (a + 1) * cos),
+                   (a + 1) - (a - 1) * cos - 2 * np.sqrt(a) * alpha]
+        else:
+            b = [(1 + cos) / 2, -(1 + cos), (1 + cos) / 2]
+            den = [1 + alpha, -2 * cos, 1 - alpha]
+        return [c / den[0] for c in b] + [1.0] + [c / den[0] for c in den[1:]]
+
+    return np.array([biquad('high_shelf', 4.0, 1 / np.sqrt(2), 1500.0),
+                     biquad('high_pass', 0.0, 0.5, 38.0)], dtype=np.float32)
+
+
+def _gated_loudness(mean_squares):
+    """由 400 ms 块的均方值计算门限后的积分响度（LUFS），没有有效块时返回 None"""
+    ms = np.asarray(mean_squares, dtype=np.float64)
+    ms = ms[ms > 0]
+    if len(ms) == 0:
+        return None
+    loudness = -0.691 + 10 * np.log10(ms)
+    ms = ms[loudness > -70.0]
+    if len(ms) == 0:
+        return None
+    relative_gate = -0.691 + 10 * np.log10(ms.mean()) - 10.0
+    ms = ms[-0.691 + 10 * np.log10(ms) > relative_gate]
+    return float(-0.691 + 10 * np.log10(ms.mean()))
+
+
+def integrated_loudness(audio, sampling_rate):
+    """整段音频的积分响度（LUFS，400 ms 不重叠门限块的简化实现），静音时返回 None"""
+    weighted = scipy.signal.sosfilt(k_weighting_sos(sampling_rate), np.asarray(audio, dtype=np.float32))
+    block = int(0.4 * sampling_rate)
+    n = len(weighted) // block
+    if n == 0:
+        return _gated_loudness([np.mean(np.square(weighted))]) if len(weighted) else None
+    return _gated_loudness(np.square(weighted[:n * block]).reshape(n, block).mean(axis=1))
+
+
+class LoudnessNormalizer(Stage):
+    def __init__(self, sampling_rate, target_lufs=DEFAULT_TARGET_LUFS, window_seconds=30.0, initial_lufs=None,
+                 max_gain_db=20.0, min_gain_db=-20.0, slew_db_per_second=3.0):
+        self.sampling_rate = sampling_rate
+        self.target_lufs = target_lufs
+        self.max_gain_db = max_gain_db
+        self.min_gain_db = min_gain_db
+        self.slew_db_per_second = slew_db_per_second
+        self.initial_lufs = initial_lufs
+        self._k = SOSFilter(k_weighting_sos(sampling_rate))
+        self._gate_block = int(0.4 * sampling_rate)
+        self._blocks = deque(maxlen=max(1, int(window_seconds / 0.4)))
+        self.reset()
+
+    def reset(self):
+        self._k.reset()
+        self._blocks.clear()
+        self._acc = 0.0
+        self._acc_n = 0
+        self.measured_lufs = self.initial_lufs
+        self._gain_db = self._target_gain_db()
+
+    def _target_gain_db(self):
+        if self.measured_lufs is None:
+            return 0.0
+        return float(np.clip(self.target_lufs - self.measured_lufs, self.min_gain_db, self.max_gain_db))
+
+    def _measure(self, block):
+        weighted = self._k.process(block.copy())
+        pos = 0
+        while pos < len(weighted):
+            take = min(len(weighted) - pos, self._gate_block - self._acc_n)
+            self._acc += float(np.dot(weighted[pos:pos + take], weighted[pos:pos + take]))
+            self._acc_n += take
+            pos += take
+            if self._acc_n == self._gate_block:
+                self._blocks.append(self._acc / self._gate_block)
+                self._acc, self._acc_n = 0.0, 0
+                measured = _gated_loudness(self._blocks)
+                if measured is not None:
+                    self.measured_lufs = measured
+
+    def process(self, block):
+        if len(block) == 0:
+            return block
+        # 给定 initial_lufs 时（例如整段生成前已测得片段响度）增益保持不变，不再流式估计
+        if self.initial_lufs is None:
+            self._measure(block)
+        start = self._gain_db
+        step = self.slew_db_per_second * len(block) / self.sampling_rate
+        end = float(np.clip(self._target_gain_db(), start - step, start + step))
+        self._gain_db = end
+        if start == end:
+            block *= np.float32(10 ** (end / 20))
+        else:
+            ramp = np.linspace(start, end, len(block), dtype=np.float32)
+            ramp *= np.float32(np.log(10) / 20)
+            np.exp(ramp, out=ramp)
+            block *= ramp
+        return block
+
+
+class LookaheadLimiter(Stage):
+    """前视限幅器。输出比输入延迟 lookahead 个采样，flush() 输出最后的延迟部分"""
+
+    def __init__(self, sampling_rate, ceiling_db=DEFAULT_CEILING_DB, lookahead_ms=5.0, release_ms=150.0):
+        self.ceiling = np.float32(10 ** (ceiling_db / 20))
+        self.frame = max(1, int(sampling_rate * lookahead_ms / 1000))
+        # 每帧增益最多恢复的倍数（release_ms 内恢复约 e 倍，即 8.7 dB）
+        self.release = float(np.exp(self.frame / (sampling_rate * release_ms / 1000)))
+        self.reset()
+
+    def reset(self):
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._held = None  # 已知下一帧之前不能输出的当前帧
+        self._held_required = 1.0
+        self._gain = 1.0
+        self.gain_reduction_db = 0.0
+
+    def _required(self, frame):
+        peak = float(np.max(np.abs(frame))) if len(frame) else 0.0
+        return min(1.0, float(self.ceiling) / peak) if peak > 0 else 1.0
+
+    def _emit(self, next_required):
+        """输出 _held：增益从上一帧结束时的值线性过渡到本帧结束时的值（两者都不超过本帧所需增益）"""
+        frame = self._held
+        end = min(self._held_required, next_required, self._gain * self.release, 1.0)
+        if end == self._gain == 1.0:
+            out = frame
+        else:
+            ramp = np.linspace(self._gain, end, len(frame) + 1, dtype=np.float32)[1:]
+            out = frame * ramp
+        self._gain = end
+        self.gain_reduction_db = min(self.gain_reduction_db, 20 * np.log10(max(end, 1e-6)))
+        return out
+
+    def process(self, block):
+        data = np.concatenate([self._pending, block]) if len(self._pending) else np.array(block, dtype=np.float32)
+        n = len(data) // self.frame
+        self._pending = data[n * self.frame:]
+        outputs = []
+        for k in range(n):
+            frame = data[k * self.frame:(k + 1) * self.frame]
+            required = self._required(frame)
+            if self._held is not None:
+                outputs.append(self._emit(required))
+            self._held, self._held_required = frame, required
+        if not outputs:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def flush(self):
+        outputs = []
+        if self._held is not None:
+            outputs.append(self._emit(self._required(self._pending)))
+            self._held = None
+        if len(self._pending):
+            self._held, self._held_required = self._pending, self._required(self._pending)
+            outputs.append(self._emit(1.0))
+            self._held = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._seconds = [0.0] * len(self.stages)
+        self._samples = [0] * len(self.stages)
+
+    def _through(self, block, first):
+        for i in range(first, len(self.stages)):
+            started = time.perf_counter()
+            self._samples[i] += len(block)
+            block = self.stages[i].process(block)
+            self._seconds[i] += time.perf_counter() - started
+        return block
+
+    def process(self, block):
+        """处理一块 float32 采样（可能被原地修改），返回输出块（有前视延迟的处理级会让输出变短）"""
+        return self._through(block, 0)
+
+    def flush(self):
+        """输入结束：依次冲出各级缓冲的采样，并让它们经过后面的处理级"""
+        outputs = []
+        for i, stage in enumerate(self.stages):
+            tail = stage.flush()
+            if len(tail):
+                outputs.append(self._through(tail, i + 1))
+        return np.concatenate(outputs) if outputs else np.zeros(0, dtype=np.float32)
+
+    def blocks(self, audio, block_size=DEFAULT_BLOCK_SIZE):
+        """按块处理整段音频，逐块产出结果（最后是 flush 冲出的尾部）；audio 会被原地修改"""
+        for start in range(0, len(audio), block_size):
+            y = self.process(audio[start:start + block_size])
+            if len(y):
+                yield y
+        y = self.flush()
+        if len(y):
+            yield y
+
+    def run(self, audio, block_size=DEFAULT_BLOCK_SIZE, out=None):
+        """按块处理整段音频，返回与输入等长的结果；out 可以是 audio 本身（原地处理）"""
+        if out is None:
+            out = np.empty(len(audio), dtype=np.float32)
+        pos = 0
+        for y in self.blocks(audio, block_size):
+            out[pos:pos + len(y)] = y
+            pos += len(y)
+        return out[:pos]
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def profile(self):
+        """各处理级的累计耗时（秒）与处理的采样数"""
+        return [{'stage': stage.name, 'seconds': round(seconds, 6), 'samples': samples}
+                for stage, seconds, samples in zip(self.stages, self._seconds, self._samples)]
+
+
+def mastering_chain(sampling_rate, target_lufs=DEFAULT_TARGET_LUFS, ceiling_db=DEFAULT_CEILING_DB,
+                    initial_lufs=None):
+    """生成结果的母带处理链：清理 NaN -> 去直流 -> 响度归一化 -> 前视限幅"""
+    return Pipeline([
+        Sanitize(),
+        DCBlocker(sampling_rate),
+        LoudnessNormalizer(sampling_rate, target_lufs=target_lufs, initial_lufs=initial_lufs),
+        LookaheadLimiter(sampling_rate, ceiling_db=ceiling_db),
+    ])
+
+
+def render_loop(audio_data, sampling_rate, target_duration=300, writer=None):
+    """生成结果的完整后处理：去直流 -> A-B-A-B 重叠拼接到 target_duration 秒 -> 母带处理，返回 16-bit PCM。
+
+    全程 float32 且尽量原地进行（峰值内存 ≈ 原始片段 + 变奏片段 + 最终输出），audio_data 可能被修改。
+    给定 writer（wav_io.WavWriter）时，母带处理的每一块转换为 int16 后立即写入 writer，
+    不再分配整段的 int16 输出，返回写入的采样数。
+    """
+    audio_data = as_float32(audio_data)
+    if len(audio_data) == 0:
+        raise ValueError("生成的音频数据为空")
+
+    # --- 优化：清理 NaN / Inf 并去除直流偏移 (DC Offset)，防止拼接时的"噗"声（分块处理） ---
+    Pipeline([Sanitize(), DCBlocker(sampling_rate)]).run(audio_data, out=audio_data)
+    # 循环拼接不改变响度：先在原始片段上测量，母带处理时直接使用固定增益
+    clip_lufs = integrated_loudness(audio_data, sampling_rate)
+
+    # --- 策略：DSP 变奏循环 (A-B-A-B 结构) ---
+    current_duration = len(audio_data) / sampling_rate
+    
+    if current_duration > 0 and current_duration < target_duration:
+        print(f"🔄 正在应用 Overlap-Add 无缝重叠拼接策略 (Duration: {current_duration:.2f}s)...")
+        
+        # 1. 准备素材: A (原版) 和 B (变奏)
+        # 制作 B 段 (变奏)：施加柔和的低通滤波器
+        # 使用二阶节（SOS）形式：float32 下数值稳定，输出直接是 float32，不产生 float64 副本
+        try:
+            lowpass = Pipeline([SOSFilter.lowpass(sampling_rate, 1200, order=4)])
+            audio_data_lowpass = lowpass.run(audio_data)
+            if not np.isfinite(audio_data_lowpass).all(): audio_data_lowpass = audio_data.copy()
+        except:
+            audio_data_lowpass = audio_data.copy()
+
+        # 2. 定义重叠参数
+        overlap_sec = 3.0 # 3秒重叠
+        overlap_len = int(sampling_rate * overlap_sec)
+        
+        # --- 关键修复：防止音频过导致 Overlap 崩溃 ---
+        # 遇到"叮一声"就是因为音频还没 overlap 长，导致切片索引错乱
+        min_required_len = int(sampling_rate * 5.0) # 至少要有5秒才能做漂亮的 fade
+        if len(audio_data) < min_required_len:
+            print(f"⚠️ 生成音频过短 ({len(audio_data)/sampling_rate:.2f}s)，正在强制补齐...")
+            # 简单重复几次直到足够长，保证后续算法不崩
+            if len(audio_data) > 0:
+                repeat_times = int(np.ceil(min_required_len / len(audio_data)))
+                audio_data = np.tile(audio_data, repeat_times)
+                # 同时也补齐 B 段
+                audio_data_lowpass = np.tile(audio_data_lowpass, repeat_times)
+        
+        # 如果还是不够长（极小概率），缩小 Overlap
+        if len(audio_data) < 2 * overlap_len:
+            overlap_len = len(audio_data) // 3
+        # ---------------------------------------------
+        
+        # 3. 预计算淡入淡出曲线 (用于重叠区)
+        # 使用 sqrt(t) 曲线，保证功率恒定 (Constant Power Crossfade)
+        t = np.linspace(0, 1, overlap_len, dtype=np.float32)
+        fade_in = np.sqrt(t)
+        fade_out = np.sqrt(1 - t)
+        
+        # 4. 开始拼接
+        # 计算总共需要多少段
+        # 每一段贡献的有效新长度是 (Length - Overlap)
+        segment_len = len(audio_data)
+        hop_len = segment_len - overlap_len
+        if hop_len <= 0: hop_len = segment_len // 2 # 防御性编码
+
+        target_samples = int(target_duration * sampling_rate)
+        num_segments = int(np.ceil(target_samples / hop_len)) + 2
+        
+        # 输出数组只分配最终需要的长度，超出部分在写入时截断
+        combined_audio = np.zeros(target_samples, dtype=np.float32)
+        scratch = np.empty(overlap_len, dtype=np.float32)
+        
+        print(f"🧩 正在拼接 {num_segments} 个片段，重叠长度: {overlap_len} 采样点")
+
+        for i in range(num_segments):
+            # 选择素材: A-B-A-B
+            part = audio_data if i % 2 == 0 else audio_data_lowpass
+            
+            # 获取当前段在总数组中的位置
+            # 第 i 段的起始位置由 hop_len 决定
+            start = i * hop_len
+            write_len = min(segment_len, len(combined_audio) - start)
+            if write_len <= 0:
+                break
+            dest = combined_audio[start : start + write_len]
+
+            # 不复制整段：中间部分直接叠加，首尾的淡入 / 淡出区借助一个重叠区大小的临时缓冲
+            # 如果这不是第一段，开头要 Fade In (为了和上一段的 Tail 融合)
+            head = overlap_len if i > 0 else 0
+            # 如果这不是最后一段，结尾要 Fade Out (为了和下一段的 Head 融合)
+            tail = overlap_len if i < num_segments - 1 else 0
+            body_end = max(head, segment_len - tail)
+
+            if head:
+                n = min(head, write_len)
+                np.multiply(part[:n], fade_in[:n], out=scratch[:n])
+                dest[:n] += scratch[:n]
+            if write_len > head:
+                dest[head:min(body_end, write_len)] += part[head:min(body_end, write_len)]
+            if tail and write_len > body_end:
+                n = write_len - body_end
+                np.multiply(part[body_end:write_len], fade_out[:n], out=scratch[:n])
+                dest[body_end:write_len] += scratch[:n]
+        
+        del audio_data_lowpass
+        audio_data = combined_audio
+
+    # 4. 母带处理：响度归一化到目标 LUFS + 前视限幅（代替全局峰值归一化），原地分块处理
+    master = mastering_chain(sampling_rate, initial_lufs=clip_lufs)
+    if writer is not None:
+        # 边处理边写入：每块转换为 Int16 后追加到 WAV，读取方可以播放已写入的前缀
+        for block in master.blocks(audio_data):
+            writer.write(to_int16(block))
+        result = writer.frames
+    else:
+        master.run(audio_data, out=audio_data)
+        # 最终转换为 Int16 (标准 WAV)
+        result = to_int16(audio_data)
+    limiter = master.stages[-1]
+    print(f"🔍 响度: {clip_lufs if clip_lufs is None else round(clip_lufs, 1)} LUFS -> {DEFAULT_TARGET_LUFS} LUFS，"
+          f"最大限幅 {limiter.gain_reduction_db:.1f} dB")
+    return result
+
+
+def master_to_int16(audio, sampling_rate, target_lufs=DEFAULT_TARGET_LUFS, ceiling_db=DEFAULT_CEILING_DB):
+    """整段音频的母带处理（先测量响度，再以固定增益处理），原地修改 audio 并返回 16-bit PCM"""
+    audio = as_float32(audio)
+    chain = mastering_chain(sampling_rate, target_lufs, ceiling_db,
+                            initial_lufs=integrated_loudness(audio, sampling_rate))
+    return to_int16(chain.run(audio, out=audio))
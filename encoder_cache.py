@@ -0,0 +1,127 @@
+"""
+encoder_cache.py
+
+MusicGen 文本编码器（T5）输出缓存。
+
+prompt 来自 `stress.py` 中很小的固定词表（压力等级 × 速度档位 × BPM），每次生成却都要重新跑一遍
+processor 和 T5 编码器。这里按规范化后的 prompt 缓存编码器的 hidden states 以及 classifier-free
+guidance（guidance_scale > 1）所需的无条件分支（全零 hidden states + 全零 attention mask），
+之后的生成直接把 `encoder_outputs` 传给 `model.generate`，跳过文本编码。
+
+- 缓存与模型实例绑定：换了模型（重新加载）或提示词配置版本（`stress.PROMPT_CONFIG.version`）变化时整体失效；
+- LRU，最多保留 max_entries 个 prompt；
+- stats 记录命中 / 未命中次数、实际编码耗时和命中节省的耗时（按该 prompt 首次编码的实测耗时累计）。
+
+本模块依赖 torch / transformers，只应在推理路径中延迟导入。
+
+用法示例：
+    cache = TextEncoderCache()
+    audio_values = model.generate(**cache.conditioning(model, processor, prompt), max_new_tokens=500)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+import stress
+
+
+ENCODER_CACHE_SIZE = 128
+
+
+def normalize_prompt(prompt):
+    """规范化 prompt：去掉首尾空白并合并连续空白（T5 分词区分大小写，因此不改变大小写）"""
+    return ' '.join(str(prompt).split())
+
+
+def _prompt_config_version():
+    # 通过模块属性读取：替换为新的 PromptConfig（例如重新加载 stress 模块）时缓存整体失效
+    return stress.PROMPT_CONFIG.version
+
+
+class TextEncoderCache:
+    def __init__(self, max_entries=ENCODER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (prompt, guidance_scale) -> (kwargs, encode_seconds)
+        self._owner = None  # (id(model), 提示词配置版本)
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'encode_seconds': 0.0,
+            'saved_seconds': 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_owner(self, model):
+        owner = (id(model), _prompt_config_version())
+        if owner != self._owner:
+            if self._owner is not None:
+                self.stats['invalidations'] += 1
+            self._entries.clear()
+            self._owner = owner
+
+    def conditioning(self, model, processor, prompt, guidance_scale=None):
+        """返回可直接展开传给 model.generate 的 input_ids / attention_mask / encoder_outputs。
+
+        guidance_scale 为 None 时使用模型 generation_config 中的默认值；传给 generate 的
+        guidance_scale 必须与这里一致，否则无条件分支的批大小对不上。
+        """
+        if guidance_scale is None:
+            guidance_scale = getattr(model.generation_config, 'guidance_scale', None)
+        key = (normalize_prompt(prompt), guidance_scale)
+
+        with self._lock:
+            self._check_owner(model)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                self.stats['saved_seconds'] += entry[1]
+                return dict(entry[0])
+
+        started = time.perf_counter()
+        with torch.inference_mode():
+            inputs = processor(text=[key[0]], padding=True, return_tensors="pt").to(model.device)
+            hidden = model.text_encoder(
+                input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask']
+            ).last_hidden_state
+            attention_mask = inputs['attention_mask']
+            if guidance_scale is not None and guidance_scale > 1:
+                # 与 MusicGen generate 内部一致：无条件分支为全零 hidden states，并屏蔽其 attention
+                hidden = torch.cat([hidden, torch.zeros_like(hidden)], dim=0)
+                attention_mask = torch.cat([attention_mask, torch.zeros_like(attention_mask)], dim=0)
+        encode_seconds = time.perf_counter() - started
+
+        kwargs = {
+            'input_ids': inputs['input_ids'],
+            'attention_mask': attention_mask,
+            'encoder_outputs': BaseModelOutput(last_hidden_state=hidden),
+        }
+        with self._lock:
+            self.stats['misses'] += 1
+            self.stats['encode_seconds'] += encode_seconds
+            self._entries[key] = (kwargs, encode_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(kwargs)
+
+    def snapshot(self):
+        with self._lock:
+            s = dict(self.stats)
+            s['entries'] = len(self._entries)
+            s['prompt_config_version'] = self._owner[1] if self._owner is not None else None
+        lookups = s['hits'] + s['misses']
+        s['hit_rate'] = round(s['hits'] / lookups, 3) if lookups else None
+        s['encode_seconds'] = round(s['encode_seconds'], 4)
+        s['saved_seconds'] = round(s['saved_seconds'], 4)
+        # 平均每次生成节省的文本编码耗时
+        s['saved_seconds_per_job'] = round(s['saved_seconds'] / lookups, 4) if lookups else None
+        return s
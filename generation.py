@@ -0,0 +1,384 @@
+"""
+generation.py
+
+音乐生成引擎：加载 MusicGen 模型，执行生成与音频后处理（去直流、A-B-A-B 重叠拼接、归一化）并保存 WAV。
+
+生成本身通过可插拔的推理后端完成（MUSICGEN_BACKEND）：默认 `TransformersBackend`（transformers + PyTorch），
+也可以使用 `onnx_backend.OnnxBackend`（ONNX Runtime，需先用 tools/export_onnx.py 导出）。
+
+本模块会导入 torch / transformers / scipy / numpy 等重依赖，只应在推理路径中（模型加载线程、
+生成任务线程）延迟导入；Web 层和命令行工具不要在模块顶部导入它，以保持启动速度。
+"""
+
+import os
+import gc  # 引入垃圾回收
+import threading
+import time
+import types
+
+# 启用 MPS 后备模式，以防部分算子在 GPU 上不支持（必须在导入 torch 之前设置）
+os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+# 解除 MPS 显存限制 (允许使用更多系统内存)，避免 OOM
+os.environ["PYTORCH_MPS_HIGH_WATERMARK_RATIO"] = "0.0"
+
+# 解码模式：eager（默认）或 compiled（静态 KV 缓存 + torch.compile 编译解码器，失败时自动回退到 eager）
+DECODE_MODE = os.environ.get("MUSICGEN_DECODE", "eager")
+# torch.compile 的编译产物缓存在磁盘上，重启后无需重新编译（必须在导入 torch 之前设置）
+COMPILE_CACHE_DIR = os.environ.get(
+    "MUSICGEN_COMPILE_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated_audio", "compile_cache")
+)
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
+import numpy as np
+import torch
+from transformers import AutoProcessor, MusicgenForConditionalGeneration
+
+from encoder_cache import TextEncoderCache
+from chunked_decode import decode_in_chunks
+from audio_buffer import as_float32
+from wav_io import WavWriter
+import dsp
+import overview
+
+MODEL_PATH = "/Users/xibei/MusicGPT/model"
+
+# 推理后端：transformers（默认）或 onnx；onnx 后端加载失败时回退到 transformers
+BACKEND = os.environ.get("MUSICGEN_BACKEND", "transformers")
+ONNX_DIR = os.environ.get("MUSICGEN_ONNX_DIR", os.path.join(MODEL_PATH, "onnx"))
+
+# 全局变量存储模型（避免重复加载）
+model = None
+processor = None
+# 当前使用的推理后端（load_model 成功后设置）
+backend = None
+
+# 同一时刻只允许一个 generate 调用占用模型（单次生成与连续播放会话共用一个模型）
+model_lock = threading.Lock()
+
+# 生成参数（单次生成与连续播放共用）
+GENERATION_KWARGS = dict(do_sample=True, guidance_scale=3.0, temperature=0.8, top_p=0.9)
+# 单次生成的 token 数（EnCodec 50 帧/秒，约 25 秒音频）
+RENDER_MAX_NEW_TOKENS = 1250
+
+# 渐进式生成的草稿档：约 5 秒、不使用 classifier-free guidance（批大小减半），几秒内即可开始播放；
+# 随后在后台以完整参数重新生成并替换（见 app.generate_music_task）
+DRAFT_MAX_NEW_TOKENS = 250
+DRAFT_GENERATION_KWARGS = dict(GENERATION_KWARGS, guidance_scale=1.0)
+
+# 当前解码模式（见 enable_accelerated_decoding），/api/model-status 会返回它
+decode_status = {
+    'requested': DECODE_MODE,
+    'active': 'eager',
+    'static_cache': False,
+    'warmup_seconds': None,
+    'error': None,
+}
+
+# 文本编码器输出缓存（见 encoder_cache.py），模型重新加载或提示词配置版本变化时自动失效
+encoder_cache = TextEncoderCache()
+
+
+def load_model(model_path=MODEL_PATH, backend_name=None):
+    """加载推理后端，返回是否加载成功"""
+    global backend
+    backend_name = backend_name or BACKEND
+    if backend_name == 'onnx':
+        try:
+            from onnx_backend import OnnxBackend
+            backend = OnnxBackend(ONNX_DIR)
+            print(f"✅ ONNX Runtime 后端已加载: {ONNX_DIR}")
+            return True
+        except Exception as e:
+            print(f"⚠️ ONNX 后端加载失败 ({e})，回退到 transformers 后端")
+    elif backend_name != 'transformers':
+        print(f"⚠️ 未知的推理后端: {backend_name}，使用 transformers 后端")
+
+    ok = _load_transformers_model(model_path)
+    backend = TransformersBackend() if ok else None
+    return ok
+
+
+def _load_transformers_model(model_path):
+    """加载处理器和模型，返回是否加载成功"""
+    global model, processor
+    try:
+        print("🎵 开始加载音乐生成模型...")
+        
+        # 检查模型路径是否存在
+        if not os.path.exists(model_path):
+            print(f"❌ 模型路径不存在: {model_path}")
+            print("💡 请确保模型文件已正确下载并放置到指定路径")
+            return False
+        
+        # 检查必要的模型文件
+        required_files = ["config.json", "pytorch_model.bin", "preprocessor_config.json"]
+        missing_files = []
+        for file in required_files:
+            file_path = os.path.join(model_path, file)
+            if not os.path.exists(file_path):
+                missing_files.append(file)
+                print(f"❌ 缺少模型文件: {file}")
+        
+        if missing_files:
+            print(f"💡 缺少以下模型文件: {', '.join(missing_files)}")
+            print("💡 请下载完整的模型文件")
+            return False
+        
+        print("📦 正在加载处理器和模型...")
+        # 强制使用 CPU 以修复 MPS 产生的"大风吹"噪声问题
+        # 虽然 MPS 理论上更快，但在当前 PyTorch/MusicGen 组合下输出可能是纯噪声
+        device = "cpu"
+        print(f"🖥️  强制使用设备: {device} (为了保证音质绝对稳定，放弃 GPU 加速)")
+        
+        # 这里的旧代码已注释，因为 MPS 确实不可用
+        # if torch.cuda.is_available(): ...
+            
+        processor = AutoProcessor.from_pretrained(model_path)
+        model = MusicgenForConditionalGeneration.from_pretrained(model_path).to(device)
+        
+        # 验证模型加载是否成功
+        if processor is None or model is None:
+            raise Exception("模型或处理器加载失败")
+        
+        encoder_cache.clear()
+        print("✅ 模型加载完成！")
+        print(f"📊 模型信息: {model.config}")
+        if DECODE_MODE != 'eager':
+            enable_accelerated_decoding(DECODE_MODE)
+        return True
+        
+    except FileNotFoundError as e:
+        print(f"❌ 模型文件错误: {e}")
+        return False
+    except ImportError as e:
+        print(f"❌ 依赖库错误: {e}")
+        print("💡 请确保已安装 transformers 和 torch 库")
+        return False
+    except Exception as e:
+        print(f"❌ 模型加载失败: {e}")
+        print("💡 可能的原因：模型文件损坏、内存不足、CUDA错误等")
+        return False
+
+
+def enable_accelerated_decoding(mode='compiled', warmup_tokens=None):
+    """开启加速解码：静态（预分配）KV 缓存 + torch.compile 编译解码器前向，返回是否成功。
+
+    编译在这里用一次预热生成触发（编译产物写入 COMPILE_CACHE_DIR，重启后直接复用）；
+    任一步骤失败都会恢复 eager 解码，并把原因记录在 decode_status['error'] 中。
+    """
+    decode_status.update(requested=mode, active='eager', static_cache=False, warmup_seconds=None, error=None)
+    if mode != 'compiled':
+        return False
+    if model is None or processor is None:
+        decode_status['error'] = '模型未加载'
+        return False
+    if not hasattr(torch, 'compile'):
+        decode_status['error'] = '当前 torch 版本不支持 torch.compile'
+        print("⚠️ 当前 torch 版本不支持 torch.compile，使用 eager 解码")
+        return False
+
+    decoder = model.decoder
+    try:
+        os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+        # 静态 KV 缓存：按 max_new_tokens 一次性预分配，每步形状固定，编译后的图可以复用
+        if getattr(decoder, '_supports_static_cache', False):
+            model.generation_config.cache_implementation = 'static'
+            decode_status['static_cache'] = True
+        else:
+            print("ℹ️ 当前 transformers 的 MusicGen 解码器不支持静态 KV 缓存，仅编译解码器")
+        decoder.forward = torch.compile(decoder.forward, dynamic=not decode_status['static_cache'])
+
+        # 静态缓存的形状取决于 max_new_tokens，用与正式生成相同的长度预热，避免首个任务再次编译
+        if warmup_tokens is None:
+            warmup_tokens = RENDER_MAX_NEW_TOKENS if decode_status['static_cache'] else 16
+        print(f"🔧 正在编译解码器（预热 {warmup_tokens} tokens，缓存目录: {COMPILE_CACHE_DIR}）...")
+        started = time.time()
+        with model_lock, torch.inference_mode():
+            model.generate(**_text_inputs("warmup"), max_new_tokens=warmup_tokens, **GENERATION_KWARGS)
+        decode_status['warmup_seconds'] = round(time.time() - started, 2)
+        decode_status['active'] = 'compiled'
+        print(f"✅ 加速解码已启用（预热 {decode_status['warmup_seconds']}s）")
+        return True
+    except Exception as e:
+        disable_accelerated_decoding(e)
+        return False
+
+
+def disable_accelerated_decoding(error=None):
+    """恢复 eager 解码（去掉编译后的 forward 与静态缓存设置）"""
+    if model is not None:
+        model.decoder.__dict__.pop('forward', None)
+        if getattr(model.generation_config, 'cache_implementation', None) == 'static':
+            model.generation_config.cache_implementation = None
+    decode_status.update(active='eager', static_cache=False, error=str(error) if error else None)
+    if error is not None:
+        print(f"⚠️ 加速解码不可用 ({error})，已回退到 eager 解码")
+
+
+def _generate(**kwargs):
+    """调用 model.generate；加速解码在运行时失败时回退到 eager 并重试一次"""
+    try:
+        return model.generate(**kwargs)
+    except Exception as e:
+        if decode_status['active'] != 'compiled':
+            raise
+        disable_accelerated_decoding(e)
+        return model.generate(**kwargs)
+
+
+def _generate_audio(**kwargs):
+    """调用 model.generate 并返回单声道 float32 波形。
+
+    generate 内部会把整段 codes 一次性交给 EnCodec 解码，中间激活与整段音频等长；这里临时替换
+    audio_encoder.decode，只记录 codes，再用 decode_in_chunks 分块解码到预分配的输出数组中，
+    限制单个任务的峰值内存。立体声模型仍使用整段解码。需在 model_lock 与 inference_mode 中调用。
+    """
+    audio_encoder = model.audio_encoder
+    if getattr(model.config.audio_encoder, 'audio_channels', 1) != 1:
+        return as_float32(_generate(**kwargs)[0, 0])
+
+    captured = {}
+
+    def capture(audio_codes, audio_scales=None, *args, **kw):
+        captured['codes'], captured['scales'] = audio_codes, audio_scales
+        return types.SimpleNamespace(audio_values=torch.zeros((audio_codes.shape[1], 1, 0)))
+
+    audio_encoder.decode = capture
+    try:
+        audio_values = _generate(**kwargs)
+    finally:
+        audio_encoder.__dict__.pop('decode', None)
+    if 'codes' not in captured:
+        # 当前 transformers 版本没有经过 audio_encoder.decode，直接使用 generate 的输出
+        return as_float32(audio_values[0, 0])
+
+    codes, scales = captured['codes'], captured['scales']
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    frame_rate = getattr(model.config.audio_encoder, 'frame_rate', 50)
+
+    def decode(start, end):
+        return as_float32(audio_encoder.decode(codes[..., start:end], scales).audio_values[0, 0])
+
+    return decode_in_chunks(decode, codes.shape[-1], sampling_rate // frame_rate)
+
+
+def _text_inputs(prompt_text, guidance_scale=None):
+    """生成所需的文本条件输入：优先使用缓存的编码器输出，缓存不可用时回退到 processor 的原始输入"""
+    if guidance_scale is None:
+        guidance_scale = GENERATION_KWARGS['guidance_scale']
+    try:
+        return encoder_cache.conditioning(model, processor, prompt_text, guidance_scale)
+    except Exception as e:
+        print(f"⚠️ 文本编码缓存不可用 ({e})，回退到逐次编码")
+        return dict(processor(text=[prompt_text], padding=True, return_tensors="pt").to(model.device))
+
+
+class TransformersBackend:
+    """默认推理后端：transformers + PyTorch（eager 或编译解码，见 enable_accelerated_decoding）"""
+
+    name = 'transformers'
+    supports_audio_prompt = True
+
+    def generate(self, input_text, max_new_tokens, **generation_kwargs):
+        """生成音乐，返回 (单声道 float32 波形, 采样率)"""
+        # 每轮生成前主动清理内存
+        gc.collect()
+        if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+            torch.mps.empty_cache()
+
+        # 获取当前配置的设备
+        original_device = model.device
+
+        # 使用 inference_mode 极限压榨 CPU 性能
+        with model_lock, torch.inference_mode():
+            try:
+                print(f"🚀 尝试在 {original_device} 上生成...")
+                inputs = _text_inputs(input_text, generation_kwargs.get('guidance_scale'))
+
+                audio_data = _generate_audio(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    **generation_kwargs
+                )
+            except RuntimeError as e:
+                print(f"⚠️ 硬件加速生成失败 ({e})")
+                print("🔄 正在自动回退到 CPU 重试...")
+
+                model.to('cpu')
+                # 回退路径不使用缓存（缓存的张量位于原设备上）
+                inputs = processor(text=[input_text], return_tensors="pt").to('cpu')
+                audio_data = as_float32(model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    **generation_kwargs
+                )[0, 0])
+                if original_device.type != 'cpu':
+                    try: model.to(original_device)
+                    except: pass
+
+        return audio_data, model.config.audio_encoder.sampling_rate
+
+
+def render_music(input_text, output_file, draft=False):
+    """执行一次完整的生成 + 后处理，并把结果写入 output_file（16-bit WAV）。出错时抛出异常。
+
+    draft=True 时使用草稿档参数（DRAFT_MAX_NEW_TOKENS / DRAFT_GENERATION_KWARGS），后处理相同。
+    """
+    # 确保模型已加载
+    if backend is None:
+        raise Exception("模型未正确加载")
+
+    max_new_tokens, generation_kwargs = (
+        (DRAFT_MAX_NEW_TOKENS, DRAFT_GENERATION_KWARGS) if draft else (RENDER_MAX_NEW_TOKENS, GENERATION_KWARGS)
+    )
+    print(f"🧠 推理后端: {backend.name}{'（草稿档）' if draft else ''}")
+    audio_data, sampling_rate = backend.generate(input_text, max_new_tokens, **generation_kwargs)
+
+    # 去直流 -> A-B-A-B 重叠拼接到 5 分钟 -> 母带处理（全程 float32，见 dsp.render_loop）
+    # 母带处理的结果逐块写入 <output_file>.part（可被 /api/audio 边写边读），完成后原子重命名为 output_file
+    with WavWriter(output_file, sampling_rate) as writer:
+        dsp.render_loop(audio_data, sampling_rate, writer=writer)
+
+    # 验证文件
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        raise FileNotFoundError("音频文件保存失败")
+
+    # 预计算波形 / 频谱概览（<file_id>.overview），失败不影响本次生成，接口会在首次请求时补算
+    try:
+        overview.write_overview(output_file)
+    except Exception as e:
+        print(f"⚠️ 概览计算失败: {e}")
+
+
+def generate_continuation(prompt_text, audio_context=None, duration_seconds=25.0):
+    """以 audio_context（上一段结尾的 float32 波形）为音频提示，续写 duration_seconds 秒音乐。
+
+    返回 (audio, prompt_samples, sampling_rate)：audio 为 float32 波形，前 prompt_samples 个采样点
+    是模型对音频提示的重新解码（可用于与上一段做交叉淡化），其后为新续写的内容。
+    没有 audio_context 时等同于一次普通的文本生成，prompt_samples 为 0。
+    """
+    if backend is not None and not backend.supports_audio_prompt:
+        raise Exception(f"当前推理后端（{backend.name}）不支持音频提示续写，请使用 transformers 后端")
+    if model is None or processor is None:
+        raise Exception("模型未正确加载")
+
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    # MusicGen 的 EnCodec 每秒 50 帧，每帧对应一个生成 token
+    frame_rate = getattr(model.config.audio_encoder, 'frame_rate', 50)
+    max_new_tokens = int(duration_seconds * frame_rate)
+
+    with model_lock, torch.inference_mode():
+        inputs = _text_inputs(prompt_text)
+        if audio_context is not None and len(audio_context) > 0:
+            # 只对音频提示做特征提取，文本部分复用缓存的编码器输出
+            inputs.update(processor(
+                audio=audio_context,
+                sampling_rate=sampling_rate,
+                return_tensors="pt"
+            ).to(model.device))
+        audio = _generate_audio(**inputs, max_new_tokens=max_new_tokens, **GENERATION_KWARGS)
+
+    prompt_samples = min(len(audio_context), len(audio)) if audio_context is not None else 0
+    return audio, prompt_samples, sampling_rate
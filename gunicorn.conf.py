@@ -0,0 +1,55 @@
+"""
+gunicorn 配置：多 worker 的 Web 层 + 一个专用推理进程。
+
+  gunicorn -c gunicorn.conf.py wsgi:app
+
+- 未设置 INFERENCE_URL 时，master 启动时会拉起一个本地推理进程（inference_service.py），
+  退出时向它发送 SIGTERM 并等待其排空进行中的生成任务；
+- 已设置 INFERENCE_URL（例如 docker-compose 中推理服务单独部署）时直接使用外部推理服务。
+"""
+
+import os
+import sys
+import subprocess
+import multiprocessing
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 120
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-'
+
+INFERENCE_PORT = int(os.environ.get('INFERENCE_PORT', 5003))
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 600))
+
+_inference_proc = None
+
+
+def on_starting(server):
+    global _inference_proc
+    if os.environ.get('INFERENCE_URL'):
+        server.log.info(f"使用外部推理服务: {os.environ['INFERENCE_URL']}")
+        return
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inference_service.py')
+    _inference_proc = subprocess.Popen([
+        sys.executable, script,
+        '--host', '127.0.0.1', '--port', str(INFERENCE_PORT),
+        '--drain-timeout', str(DRAIN_TIMEOUT)
+    ])
+    # worker 在 fork 时继承该环境变量
+    os.environ['INFERENCE_URL'] = f'http://127.0.0.1:{INFERENCE_PORT}'
+    server.log.info(f"已启动推理进程 pid={_inference_proc.pid}")
+
+
+def on_exit(server):
+    if _inference_proc is None or _inference_proc.poll() is not None:
+        return
+    server.log.info("正在停止推理进程（等待进行中的任务完成）...")
+    _inference_proc.terminate()
+    try:
+        _inference_proc.wait(timeout=DRAIN_TIMEOUT + 10)
+    except subprocess.TimeoutExpired:
+        _inference_proc.kill()
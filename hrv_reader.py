@@ -13,6 +13,9 @@ Arduino 端（示例）应输出形如：
   ...（每次检测到心跳时输出）
 
 脚本会维护一个滑动窗口（默认 30 个 IBI），并持续计算 RMSSD。
+
+性能剖析（可选）：
+  HRV_PROFILE=sample python hrv_reader.py --port ...   # 或 HRV_PROFILE=cprofile
 """
 
 import argparse
@@ -33,6 +36,7 @@ except Exception:
     raise
 
 from stress import hrv_to_stress_level, get_stress_music_prompt
+from profiler import profile_block, new_profile_id, normalize_profile_mode
 
 IBI_RE = re.compile(r"IBI\s*:\s*(\d+(?:\.\d+)?)")
 BPM_RE = re.compile(r"BPM\s*=\s*(\d+(?:\.\d+)?)")
@@ -246,4 +250,8 @@ if __name__ == '__main__':
     parser.add_argument('--compact', action='store_true', help='简洁输出：每次只打印一行 HRV（格式: HRV=xx ms, 压力等级=...）')
     args = parser.parse_args()
 
-    run(args.port, args.baud, args.window, service_url=args.service_url, final=args.final, compact=args.compact)
\ No newline at end of file
+    # 可选剖析：设置环境变量 HRV_PROFILE=1|sample|cprofile，结果保存在 generated_audio/profiles/
+    profile_mode = normalize_profile_mode(os.environ.get('HRV_PROFILE'))
+    profile_id = f"hrv_reader_{time.strftime('%Y%m%d_%H%M%S')}_{new_profile_id()[:8]}" if profile_mode else None
+    with profile_block(profile_id, profile_mode):
+        run(args.port, args.baud, args.window, service_url=args.service_url, final=args.final, compact=args.compact)
\ No newline at end of file
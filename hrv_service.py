@@ -2,23 +2,25 @@
 hrv_service.py
 
 常驻服务：启动时加载 MusicGen 模型并暴露 HTTP 接口接受 HRV 值（POST /hrv）。
-接收到 HRV 后立即在后台线程触发音乐生成（非阻塞），并将生成的音频保存到 `generated_audio/`。
+接收到 HRV 后把生成任务交给有界的后台执行器（非阻塞），并将生成的音频保存到 `generated_audio/`。
+
+执行器按压力等级合并任务（"latest wins"）：同一压力等级最多只有一个生成在运行，
+运行期间到达的新 HRV 只会更新该等级的待执行任务，不会堆积成几十个并发生成。
 
 用法示例：
   python hrv_service.py --host 0.0.0.0 --port 5002
 
 接口：
   POST /hrv  JSON: {"hrv": 25.3}
-    - 返回：{"status":"accepted","message":"started generation","job_id":"..."}
+    - 返回：{"status":"accepted","job_id":"...","stress_level":"高","queue_state":"pending|queued|coalesced"}
   GET /status
-    - 返回基本运行状态
+    - 返回基本运行状态与执行器队列情况
 
 注意：该服务会在启动时加载模型，可能耗时较长（一次性开销），但之后生成延迟会低得多。
 """
 
 import os
 import time
-import threading
 import datetime
 import json
 from flask import Flask, request, jsonify
@@ -26,19 +28,21 @@ from flask import Flask, request, jsonify
 # 仅在运行环境可用时导入 heavy 依赖，便于本地编辑和错误提示
 try:
     from transformers import AutoProcessor, MusicgenForConditionalGeneration
-    import scipy.io.wavfile
     import torch
+    import dsp
 except Exception as e:
     # 在导入失败时，服务仍可启动，但会在尝试生成音乐时报错
     AutoProcessor = None
     MusicgenForConditionalGeneration = None
-    scipy = None
     torch = None
+    dsp = None
     _IMPORT_ERROR = e
 else:
     _IMPORT_ERROR = None
 
-from stress import get_stress_music_prompt
+from stress import get_stress_music_prompt, hrv_to_stress_level
+from job_executor import CoalescingExecutor
+from wav_io import write_wav
 
 app = Flask(__name__)
 
@@ -50,15 +54,22 @@ LATEST_HRV_FILE = os.path.join(GENERATED_DIR, 'latest_hrv.txt')
 # 全局模型变量
 processor = None
 model = None
+# 文本编码器输出缓存（见 encoder_cache.py），随模型一起创建
+encoder_cache = None
+
+# 有界生成执行器：默认单线程（CPU 生成会占满所有核心），可通过 HRV_SERVICE_WORKERS 调整
+executor = CoalescingExecutor(max_workers=int(os.environ.get('HRV_SERVICE_WORKERS', 1)), name='hrv-generate')
 
 
 def load_model():
-    global processor, model
+    global processor, model, encoder_cache
     if AutoProcessor is None or MusicgenForConditionalGeneration is None:
         raise RuntimeError(f"模型依赖导入失败: {_IMPORT_ERROR}")
     print(f"加载模型，路径: {MODEL_DIR} ...")
     processor = AutoProcessor.from_pretrained(MODEL_DIR)
     model = MusicgenForConditionalGeneration.from_pretrained(MODEL_DIR)
+    from encoder_cache import TextEncoderCache
+    encoder_cache = TextEncoderCache()
     print("模型加载完成")
 
 
@@ -74,11 +85,8 @@ def generate_music_background(hrv_value, prompt_text=None):
 
         print(f"开始生成音乐：HRV={hrv_value}, prompt={prompt_text}")
 
-        inputs = processor(
-            text=[prompt_text],
-            padding=True,
-            return_tensors="pt"
-        )
+        # 同一 prompt 的文本编码结果在多次生成之间复用
+        inputs = encoder_cache.conditioning(model, processor, prompt_text)
 
         # 生成参数可以根据需要调整
         audio_values = model.generate(
@@ -93,8 +101,9 @@ def generate_music_background(hrv_value, prompt_text=None):
         ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         out_path = os.path.join(GENERATED_DIR, f'generated_{ts}.wav')
 
-        # audio_values 可能需要转换，保持与原 music.py 行为一致
-        scipy.io.wavfile.write(out_path, rate=sampling_rate, data=audio_values[0, 0].numpy())
+        # 与 music.py / Web 端相同的母带处理（见 dsp.py），保存为 16-bit WAV
+        audio = dsp.master_to_int16(audio_values[0, 0], sampling_rate)
+        write_wav(out_path, audio, sampling_rate)
         print(f"音乐生成完成，保存到: {out_path}")
 
         # 更新 latest_hrv.txt
@@ -115,7 +124,12 @@ def status():
     if _IMPORT_ERROR is not None:
         ok = False
         msg = f"import error: {_IMPORT_ERROR}"
-    return jsonify({'status': 'running' if ok else 'error', 'detail': msg})
+    return jsonify({
+        'status': 'running' if ok else 'error',
+        'detail': msg,
+        'executor': executor.snapshot(),
+        'encoder_cache': encoder_cache.snapshot() if encoder_cache is not None else None
+    })
 
 
 @app.route('/hrv', methods=['POST'])
@@ -137,12 +151,16 @@ def receive_hrv():
     except Exception as e:
         print("写入 latest_hrv.txt 失败：", e)
 
-    # 非阻塞触发生成
-    job_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
-    thread = threading.Thread(target=generate_music_background, args=(hrv_val, None), daemon=True)
-    thread.start()
+    # 非阻塞触发生成：按压力等级合并，同一等级只保留最新的 HRV
+    stress_level = hrv_to_stress_level(hrv_val)
+    job_id, queue_state = executor.submit(stress_level, generate_music_background, hrv_val, None)
 
-    return jsonify({'status': 'accepted', 'job_id': job_id}), 202
+    return jsonify({
+        'status': 'accepted',
+        'job_id': job_id,
+        'stress_level': stress_level,
+        'queue_state': queue_state
+    }), 202
 
 
 def main(host, port):
@@ -1,24 +1,48 @@
 """
 hrv_watcher.py
 
-说明：简单的基于轮询的文件监听器。监视 `generated_audio/latest_hrv.txt` 的修改时间或内容变化，
-当检测到新 HRV 值时调用 `music.py`（在子进程中）触发音乐生成。
+说明：事件驱动的 HRV 文件监听器。监视 `generated_audio/latest_hrv.txt` 的变化：
+  - 优先使用文件系统通知（watchdog：Linux inotify / macOS FSEvents / Windows ReadDirectoryChangesW），
+    检测延迟为毫秒级；未安装 watchdog 时自动回退到轮询；
+  - 检测到新 HRV 值时交给触发引擎（见 `trigger.py`）判断：只有压力等级越过迟滞带并保持一段时间，
+    或 BPM 变化导致速度档位改变时，才触发音乐生成；
+  - 生成在常驻的进程内生成器中异步执行（模型只加载一次），生成期间仍持续监听 HRV；
+    生成期间到达的多次触发会合并为一次（"latest wins"）。也可以用 --service-url 把触发转发给
+    常驻服务 `hrv_service.py`。
 
 用法示例：
-  python hrv_watcher.py --poll 2 --debounce 10
+  python hrv_watcher.py --dwell 10 --hysteresis 2
+  python hrv_watcher.py --service-url http://127.0.0.1:5002/hrv
 
 参数：
-  --poll: 轮询间隔（秒），默认 2s
-  --debounce: 防抖间隔（秒），检测到变化后在该时间内不再重复触发，默认 10s
-  --once: 检测到一次变化后退出
-
-注意：该脚本通过运行 `python music.py` 来触发生成。如果你想用其它命令或虚拟环境，请调整 `MUSIC_CMD`。
+  --poll: 轮询回退模式下的轮询间隔（秒），默认 0.5s
+  --dwell: 新状态需要保持的时间（秒）才会触发，默认 10s（旧参数名 --debounce 仍可用）
+  --hysteresis: 压力等级切换的迟滞带宽（HRV ms），默认 2ms
+  --service-url: 可选，把触发 POST 给常驻服务，而不是在本进程内生成
+  --once: 完成一次生成后退出
 """
 
 import argparse
+import json
 import os
+import threading
 import time
-import subprocess
+import urllib.error
+import urllib.request
+
+from trigger import RegenerationTrigger
+from job_executor import CoalescingExecutor
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except Exception:
+    # 未安装 watchdog 时回退到轮询
+    Observer = None
+    FileSystemEventHandler = object
+
+
+_WRITE_EVENTS = ('modified', 'created', 'moved', 'closed')
 
 
 def read_float_from_file(path):
@@ -30,79 +54,168 @@ def read_float_from_file(path):
         return None
 
 
-def main(poll_interval, debounce_seconds, once):
-    base_dir = os.path.dirname(__file__)
+class _FileChangeHandler(FileSystemEventHandler):
+    def __init__(self, path, on_change):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+
+    def on_any_event(self, event):
+        # 覆盖写入产生 modified / created / closed 事件，原子替换（os.replace）产生 moved 事件；
+        # 忽略 opened / closed_no_write 等读取事件，否则本进程读文件会再次触发自己
+        if event.event_type not in _WRITE_EVENTS:
+            return
+        paths = (getattr(event, 'src_path', None), getattr(event, 'dest_path', None))
+        if any(p and os.path.abspath(p) == self.path for p in paths):
+            self.on_change()
+
+
+class FileWatcher:
+    """监听单个文件的变化，有变化时调用 on_change()。优先使用文件系统通知，否则轮询 mtime。"""
+
+    def __init__(self, path, on_change, poll_interval=0.5):
+        self.path = path
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.mode = None
+        self._observer = None
+        self._stop = threading.Event()
+        self._poll_thread = None
+
+    def start(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_FileChangeHandler(self.path, self.on_change), directory, recursive=False)
+                self._observer.start()
+                self.mode = 'events'
+                return
+            except Exception as e:
+                print(f"文件系统通知不可用（{e}），回退到轮询")
+                self._observer = None
+        self.mode = 'polling'
+        self._poll_thread = threading.Thread(target=self._poll_loop, name='hrv-poll', daemon=True)
+        self._poll_thread.start()
+
+    def _poll_loop(self):
+        last_mtime = None
+        while not self._stop.wait(self.poll_interval):
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                continue
+            if mtime != last_mtime:
+                last_mtime = mtime
+                self.on_change()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+
+def _generate_in_process(hrv_value):
+    """在本进程内生成音乐；music 模块只导入一次，模型常驻内存"""
+    import music
+    from stress import get_stress_music_prompt
+    started = time.time()
+    music.generate_music(input_text=get_stress_music_prompt(hrv_value))
+    print(f"音乐生成完成（{time.time() - started:.1f}s）")
+
+
+def _post_to_service(service_url, hrv_value):
+    payload = json.dumps({"hrv": float(hrv_value)}).encode('utf-8')
+    req = urllib.request.Request(service_url, data=payload, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            print(f"已转发给常驻服务: {resp.status} {resp.read().decode('utf-8')}")
+    except urllib.error.URLError as e:
+        print("向 HRV 服务发送失败：", e)
+
+
+def main(poll_interval, dwell_seconds, once, hysteresis_ms=2.0, service_url=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
     latest_hrv_path = os.path.join(base_dir, 'generated_audio', 'latest_hrv.txt')
+    latest_bpm_path = os.path.join(base_dir, 'generated_audio', 'latest_bpm.txt')
+
+    # 只有压力等级越过迟滞带并保持 dwell 秒，或速度档位改变时才重新生成
+    trig = RegenerationTrigger(hysteresis_ms=hysteresis_ms, dwell_seconds=dwell_seconds)
+
+    # 单线程生成器：同一时刻只有一个生成在运行，期间的多次触发合并为最新的一次
+    executor = CoalescingExecutor(max_workers=1, name='watcher-generate')
+    generated = threading.Event()
+
+    def dispatch(hrv_value):
+        if service_url:
+            _post_to_service(service_url, hrv_value)
+            generated.set()
+            return
+
+        def job():
+            try:
+                _generate_in_process(hrv_value)
+            finally:
+                generated.set()
+        _, state = executor.submit('music', job)
+        print(f"已提交生成任务（{state}）")
+
+    if not service_url:
+        # 启动时预先加载模型，第一次触发无需等待
+        import music
+        executor.submit('music', music.load_model)
 
-    # 可定制的音乐生成命令（可替换为虚拟环境内的 python 可执行路径）
-    MUSIC_CMD = ['python', os.path.join(base_dir, 'music.py')]
+    changed = threading.Event()
+    watcher = FileWatcher(latest_hrv_path, changed.set, poll_interval=poll_interval)
+    watcher.start()
+    print(f"监听文件: {latest_hrv_path}（{'文件系统通知' if watcher.mode == 'events' else '轮询'}模式）")
 
-    last_mtime = None
-    last_value = None
-    last_trigger = 0
+    # 启动时如果已有 HRV 数据，先评估一次
+    if os.path.exists(latest_hrv_path):
+        changed.set()
 
-    print(f"监听文件: {latest_hrv_path}")
     try:
         while True:
-            if os.path.exists(latest_hrv_path):
-                mtime = os.path.getmtime(latest_hrv_path)
-                if last_mtime is None:
-                    last_mtime = mtime
-                    last_value = read_float_from_file(latest_hrv_path)
-                # 文件修改时间变化视为新数据
-                if mtime != last_mtime:
-                    cur_time = time.time()
-                    if cur_time - last_trigger < debounce_seconds:
-                        print("检测到更新，但在防抖周期内，跳过触发")
-                        last_mtime = mtime
-                        last_value = read_float_from_file(latest_hrv_path)
-                    else:
-                        # 记录触发前的值，用于日志
-                        old_value = last_value
-                        last_mtime = mtime
-                        new_val = read_float_from_file(latest_hrv_path)
-                        print(f"检测到 HRV 更新: {old_value} -> {new_val} (mtime {mtime})")
-                        last_value = new_val
-                        last_trigger = cur_time
-                        print("触发音乐生成（调用 music.py）...")
-                        try:
-                            # 使用 subprocess 启动音乐生成功能；注意这可能比较耗时
-                            # 在生成期间，subprocess.run 会阻塞，不会继续检查HRV
-                            # 传递 --no-auto 参数，避免自动触发逻辑（因为watcher已经检测到更新）
-                            subprocess.run(MUSIC_CMD + ['--no-auto'], check=True)
-                            print("音乐生成完成")
-                            # 生成完成后，重新读取文件的最新修改时间，避免在生成期间
-                            # 如果有新的HRV更新，立即再次触发
-                            if os.path.exists(latest_hrv_path):
-                                # 更新 last_mtime 为当前文件的最新修改时间
-                                # 这样即使生成期间HRV更新了，也不会立即再次触发
-                                last_mtime = os.path.getmtime(latest_hrv_path)
-                                last_value = read_float_from_file(latest_hrv_path)
-                                # 更新 last_trigger 为当前时间，确保防抖机制生效
-                                last_trigger = time.time()
-                        except subprocess.CalledProcessError as e:
-                            print("调用 music.py 失败:", e)
-                            # 即使失败，也更新 mtime 和 trigger，避免重复触发失败的任务
-                            if os.path.exists(latest_hrv_path):
-                                last_mtime = os.path.getmtime(latest_hrv_path)
-                                last_value = read_float_from_file(latest_hrv_path)
-                                last_trigger = time.time()
-                        if once:
-                            print("--once 指定，已完成一次触发后退出")
-                            return
+            if once and generated.is_set():
+                print("--once 指定，已完成一次生成后退出")
+                return
+            # 有候选状态在等待驻留时间时需要定时复查，否则只在文件变化时醒来
+            if not changed.wait(timeout=0.5 if trig.pending or once else None):
+                fire, reason = trig.recheck()
             else:
-                # 文件还不存在，等待
-                pass
-            time.sleep(poll_interval)
+                changed.clear()
+                new_val = read_float_from_file(latest_hrv_path)
+                if new_val is None:
+                    # 文件正在写入或为空，等待下一次事件
+                    continue
+                bpm = read_float_from_file(latest_bpm_path)
+                fire, reason = trig.update(new_val, bpm)
+                if not fire:
+                    print(f"检测到 HRV 更新: {new_val} (BPM {bpm})，无需重新生成（{reason}；{trig.summary()}）")
+            if fire:
+                level, bucket = trig.committed
+                hrv_value = read_float_from_file(latest_hrv_path)
+                print(f"触发音乐生成: HRV {hrv_value} -> 压力等级 {level}, {bucket}（{reason}）")
+                dispatch(hrv_value)
     except KeyboardInterrupt:
         print("已停止监听（KeyboardInterrupt）")
+    finally:
+        watcher.stop()
+        print(f"触发统计: {trig.summary()}")
+        executor.shutdown(wait=False, cancel_pending=True)
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='监听 latest_hrv.txt 并在更新时触发 music.py')
-    parser.add_argument('--poll', type=float, default=2.0, help='轮询间隔（秒），默认 2s')
-    parser.add_argument('--debounce', type=float, default=10.0, help='防抖（秒），默认 10s')
-    parser.add_argument('--once', action='store_true', help='检测到一次后退出')
+    parser = argparse.ArgumentParser(description='监听 latest_hrv.txt 并在压力等级 / 速度档位变化时生成音乐')
+    parser.add_argument('--poll', type=float, default=0.5, help='轮询回退模式下的轮询间隔（秒），默认 0.5s')
+    parser.add_argument('--dwell', '--debounce', dest='dwell', type=float, default=10.0,
+                        help='新的压力等级 / 速度档位需要保持的时间（秒）才会触发生成，默认 10s')
+    parser.add_argument('--hysteresis', type=float, default=2.0,
+                        help='压力等级切换的迟滞带宽（HRV ms），默认 2ms')
+    parser.add_argument('--service-url', default=None,
+                        help='可选：常驻服务 URL，例如 http://127.0.0.1:5002/hrv，提供时把触发转发给服务')
+    parser.add_argument('--once', action='store_true', help='完成一次生成后退出')
     args = parser.parse_args()
 
-    main(args.poll, args.debounce, args.once)
+    main(args.poll, args.dwell, args.once, hysteresis_ms=args.hysteresis, service_url=args.service_url)
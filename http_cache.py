@@ -0,0 +1,85 @@
+"""
+http_cache.py
+
+已生成音频文件的 HTTP 传输：强 ETag、条件请求、字节范围与长期缓存。
+
+生成的 WAV 以随机（或由内容决定的）file_id 命名，发布后内容不再改变，因此：
+- ETag 为文件内容哈希（wav_io.content_hash），If-None-Match 命中时返回 304，不传输正文；
+- `Cache-Control: public, max-age=一年, immutable`，浏览器重播时直接使用本地缓存，不再发条件请求；
+- 支持单个字节范围（`Range: bytes=a-b`，If-Range 按强比较校验 ETag），`<audio>` 拖动进度条时只取需要的部分；
+  多个范围时返回完整文件（RFC 9110 允许），范围无效时返回 416；
+- 正文交给服务器的 `wsgi.file_wrapper`（gunicorn 对普通文件使用 sendfile 零拷贝发送）；范围不到文件末尾
+  时改用按长度截断的读取生成器，保证不会多发数据。
+
+用法示例：
+    return send_immutable_file(path, etag=content_hash, mimetype='audio/wav')
+"""
+
+import os
+
+from flask import Response, request
+
+# 一年：生成的文件发布后不再改变
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CHUNK_BYTES = 64 * 1024
+
+
+def send_immutable_file(path, etag, mimetype='application/octet-stream', max_age=IMMUTABLE_MAX_AGE):
+    """发送一个发布后不再改变的文件，处理 If-None-Match / Range / If-Range"""
+    size = os.path.getsize(path)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={max_age}, immutable',
+        'Accept-Ranges': 'bytes',
+    }
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    start, length, status = 0, size, 200
+    byte_range = request.range
+    # If-Range 只接受强 ETag；不匹配时忽略 Range，返回完整的新内容
+    if byte_range is not None and len(byte_range.ranges) == 1 and _if_range_matches(etag):
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, length, status = bounds[0], bounds[1] - bounds[0], 206
+        headers['Content-Range'] = f'bytes {start}-{bounds[1] - 1}/{size}'
+
+    headers['Content-Length'] = str(length)
+    if request.method == 'HEAD':
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    # 在发出状态行之前打开文件：文件在 stat 之后被淘汰时 FileNotFoundError 仍由调用方处理（404），
+    # 而不是在已经发出 200 / 206 之后中途截断
+    f = open(path, 'rb')
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and start + length == size:
+        # 服务器可以直接 sendfile：从当前偏移发送到文件末尾。文件由服务器在响应结束时调用
+        # FileWrapper.close() 关闭（PEP 3333）；direct_passthrough 下 werkzeug 直接把 wrapper 交给服务器，
+        # Response.call_on_close 的回调不会执行
+        f.seek(start)
+        return Response(file_wrapper(f, CHUNK_BYTES), status=status, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+    return Response(_read_range(f, start, length), status=status, headers=headers, mimetype=mimetype,
+                    direct_passthrough=True)
+
+
+def _if_range_matches(etag):
+    """RFC 9110 §13.1.5：If-Range 必须强比较，弱校验器（W/"..."）与日期一律视为不匹配"""
+    # 直接读原始请求头：request.if_range 解析时会丢掉 W/ 标记
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True  # 没有 If-Range
+    return if_range.strip() == f'"{etag}"'
+
+
+def _read_range(f, start, length):
+    # 与 wav_io.follow_wav 相同：文件由调用方打开，生成器负责关闭
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
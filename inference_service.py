@@ -0,0 +1,63 @@
+"""
+inference_service.py
+
+生产部署中的专用推理进程：加载 MusicGen 模型，并承载所有有状态的接口（生成任务、模型状态、
+用户偏好、HRV 测量、文件淘汰）。Web 层（gunicorn 多 worker，见 `wsgi.py` / `gunicorn.conf.py`）
+通过环境变量 `INFERENCE_URL` 把这些请求转发到这里，自身保持轻量。
+
+用法示例：
+  python inference_service.py --host 127.0.0.1 --port 5003
+
+收到 SIGTERM / SIGINT 时优雅退出：先停止接受新的生成任务，等待进行中的任务完成
+（最多 --drain-timeout 秒），再关闭 HTTP 服务。排队中的任务保留在持久化队列（job_queue.py）中，
+重启后继续执行；超时未完成的任务在租约过期后自动重试。
+"""
+
+import os
+import signal
+import argparse
+import threading
+
+from werkzeug.serving import make_server
+
+
+def main(host, port, drain_timeout):
+    # 本进程就是推理进程，不能再转发给自己
+    os.environ.pop('INFERENCE_URL', None)
+    import app as web_app
+
+    server = make_server(host, port, web_app.app, threaded=True)
+    stopping = threading.Event()
+
+    def drain_and_stop():
+        print(f"⏳ 正在等待进行中的生成任务完成（最多 {drain_timeout} 秒）...")
+        if web_app.drain_jobs(drain_timeout):
+            print("✅ 所有任务已完成")
+        else:
+            print("⚠️ 等待超时，仍有任务未完成")
+        server.shutdown()
+
+    def handle_signal(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        print(f"🛑 收到信号 {signum}，开始优雅退出")
+        # serve_forever 运行在主线程，shutdown 必须从其它线程调用
+        threading.Thread(target=drain_and_stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    print(f"🚀 推理服务已启动: http://{host}:{port}")
+    server.serve_forever()
+    print("👋 推理服务已停止")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='专用推理进程（模型 + 生成任务）')
+    parser.add_argument('--host', default=os.environ.get('INFERENCE_HOST', '127.0.0.1'), help='监听地址，默认 127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('INFERENCE_PORT', 5003)), help='监听端口，默认 5003')
+    parser.add_argument('--drain-timeout', type=float, default=float(os.environ.get('DRAIN_TIMEOUT', 600)),
+                        help='退出时等待进行中任务的最长时间（秒），默认 600')
+    args = parser.parse_args()
+    main(args.host, args.port, args.drain_timeout)
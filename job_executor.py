@@ -0,0 +1,109 @@
+"""
+job_executor.py
+
+有界、按 key 合并（"latest wins"）的后台任务执行器。
+
+- 固定数量的工作线程（默认 1 个，CPU 上的模型生成本身就会占满所有核心）；
+- 同一个 key（例如压力等级）同一时刻最多只有一个任务在运行；
+- 每个 key 最多保留一个待执行任务：任务尚未开始时再次提交，只会用最新的参数替换它，
+  因此短时间内的大量更新（例如每次心跳都 POST 一次 HRV）只会产生一次生成。
+
+用法示例：
+    executor = CoalescingExecutor(max_workers=1)
+    job_id, state = executor.submit('高', generate, hrv_value)
+"""
+
+import uuid
+import threading
+from collections import OrderedDict
+
+
+class CoalescingExecutor:
+    def __init__(self, max_workers=1, name='job-executor'):
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> (job_id, fn, args, kwargs)
+        self._running = {}  # key -> job_id
+        self._shutdown = False
+        self.stats = {'submitted': 0, 'coalesced': 0, 'completed': 0, 'failed': 0}
+        self._threads = []
+        for i in range(max_workers):
+            t = threading.Thread(target=self._worker, name=f'{name}-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """提交任务，返回 (job_id, state)。
+
+        state 取值：
+          - 'pending'  : 新任务，等待空闲线程执行
+          - 'queued'   : 同 key 的任务正在运行，本任务在其完成后执行
+          - 'coalesced': 替换了同 key 尚未开始的任务（旧任务不会再执行）
+        """
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('executor 已关闭')
+            job_id = uuid.uuid4().hex
+            replaced = key in self._pending
+            # 对已存在的 key 赋值不会改变其在 OrderedDict 中的位置，保证各 key 之间先来先服务
+            self._pending[key] = (job_id, fn, args, kwargs)
+            self.stats['submitted'] += 1
+            if replaced:
+                self.stats['coalesced'] += 1
+                state = 'coalesced'
+            elif key in self._running:
+                state = 'queued'
+            else:
+                state = 'pending'
+            self._cond.notify()
+            return job_id, state
+
+    def _next_key(self):
+        for key in self._pending:
+            if key not in self._running:
+                return key
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    key = self._next_key()
+                    if key is not None:
+                        break
+                    if self._shutdown and not self._pending:
+                        return
+                    self._cond.wait()
+                job_id, fn, args, kwargs = self._pending.pop(key)
+                self._running[key] = job_id
+
+            ok = True
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                ok = False
+                print(f"后台任务 {job_id} ({key}) 执行失败: {e}")
+            finally:
+                with self._cond:
+                    del self._running[key]
+                    self.stats['completed' if ok else 'failed'] += 1
+                    self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'max_workers': self.max_workers,
+                'running': {str(k): v for k, v in self._running.items()},
+                'pending': {str(k): v[0] for k, v in self._pending.items()},
+                'stats': dict(self.stats),
+            }
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_pending:
+                self._pending.clear()
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
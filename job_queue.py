@@ -0,0 +1,360 @@
+"""
+job_queue.py
+
+持久化的生成任务队列：任务及其状态保存在 SQLite（`generated_audio/jobs.db`）中，进程重启或崩溃后
+排队中的任务继续执行、被中断的任务自动重试、已完成任务的结果仍可查询（前端按 job_id 轮询不会落空）。
+
+状态流转：
+    queued ──claim()──> processing ──complete()──> completed
+                            │ └──────fail()──────> failed
+                            └─ 租约过期（进程崩溃 / 卡死）：attempts < max_attempts 时回到 queued，否则 failed
+
+- 租约：工作线程 `claim()` 到任务时取得 lease_seconds 秒的租约，执行期间由心跳线程（`lease()`）
+  每 lease_seconds / 3 秒续约一次；进程崩溃后租约到期，`requeue_expired()` 把任务放回队列重试；
+  续约失败（租约已被收回）的执行者写回的结果会被忽略；
+- 任务先进先出，`claim()` 在 `BEGIN IMMEDIATE` 事务中完成，多个线程 / 进程同时领取也不会重复；
+- 任务执行过程中通过 `update()` 记录中间结果（草稿档 file_id、正在写入的 file_id 及其档位），
+  重试时执行者可以直接复用中断前已经发布的结果；
+- `JobWorker` 是通用的工作线程：领取任务、维持心跳、调用处理函数，空闲时定期收回过期租约并清理过期任务。
+
+SQLite 使用 WAL 模式，Web 进程与推理进程可以同时读写同一个库。
+
+用法示例：
+    queue = JobQueue('generated_audio/jobs.db')
+    job_id = queue.enqueue(user_id, {'prompt': prompt, 'tiers': ['draft', 'full']})
+    JobWorker(queue, handle_job).start()
+    queue.get(job_id)['status']
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# 租约时长（秒）：心跳每 LEASE_SECONDS / 3 续约一次，进程崩溃后最多这么久任务会被重新放回队列
+LEASE_SECONDS = 30.0
+# 被中断（租约过期）的任务最多执行的次数
+MAX_ATTEMPTS = 3
+# 已结束任务的保留时间（秒）
+RETENTION_SECONDS = 24 * 3600
+
+ACTIVE_STATES = ('queued', 'processing')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id            TEXT PRIMARY KEY,
+    user_id           TEXT,
+    status            TEXT NOT NULL,
+    payload           TEXT NOT NULL DEFAULT '{}',
+    file_id           TEXT,
+    draft_file_id     TEXT,
+    tier              TEXT,
+    source            TEXT,
+    degraded          INTEGER NOT NULL DEFAULT 0,
+    error             TEXT,
+    profile_id        TEXT,
+    rendering_file_id TEXT,
+    rendering_tier    TEXT,
+    eta_seconds       REAL,
+    attempts          INTEGER NOT NULL DEFAULT 0,
+    max_attempts      INTEGER NOT NULL DEFAULT 3,
+    lease_owner       TEXT,
+    lease_expires     REAL,
+    created_at        REAL NOT NULL,
+    started_at        REAL,
+    finished_at       REAL,
+    updated_at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, created_at);
+"""
+
+# 通过 update() / complete() 等可以写入的字段
+_RESULT_FIELDS = ('file_id', 'draft_file_id', 'tier', 'source', 'degraded', 'error', 'profile_id',
+                  'rendering_file_id', 'rendering_tier', 'eta_seconds')
+# 返回给调用方（/api/music-status）的字段
+_STATUS_FIELDS = ('job_id', 'status') + _RESULT_FIELDS + ('attempts', 'created_at', 'started_at', 'finished_at')
+
+
+def new_worker_id(name='worker'):
+    """工作线程标识：主机名 + 进程号 + 随机后缀（进程重启后不会与旧进程的租约混淆）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{name}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """持久化任务队列。所有方法都是线程安全的。"""
+
+    def __init__(self, db_path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 retention_seconds=RETENTION_SECONDS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # isolation_level=None：事务由 BEGIN IMMEDIATE / COMMIT 显式控制
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    # ------------------------------------------------------------------ 提交 / 查询
+
+    def enqueue(self, user_id, payload, job_id=None, status='queued', **fields):
+        """登记一个新任务，返回 job_id。status='completed' 用于不需要执行的任务（例如直接复用片段库）"""
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        row = dict(job_id=job_id, user_id=user_id, status=status, payload=json.dumps(payload, ensure_ascii=False),
+                   max_attempts=self.max_attempts, created_at=now, updated_at=now,
+                   finished_at=now if status not in ACTIVE_STATES else None)
+        row.update(self._result_fields(fields))
+        columns = ', '.join(row)
+        self._write(f"INSERT INTO jobs ({columns}) VALUES ({', '.join('?' * len(row))})", tuple(row.values()))
+        return job_id
+
+    @staticmethod
+    def _result_fields(fields):
+        unknown = set(fields) - set(_RESULT_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的任务字段: {', '.join(sorted(unknown))}")
+        return {k: int(bool(v)) if k == 'degraded' else v for k, v in fields.items()}
+
+    @staticmethod
+    def _status(row):
+        status = {k: row[k] for k in _STATUS_FIELDS}
+        status['degraded'] = bool(status['degraded'])
+        return status
+
+    def get(self, job_id):
+        """任务状态（dict），不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_STATUS_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._status(row) if row is not None else None
+
+    def latest_for_user(self, user_id):
+        """该用户最近一次任务的状态，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_STATUS_FIELDS)} FROM jobs WHERE user_id = ? "
+                f"ORDER BY created_at DESC LIMIT 1", (user_id,)
+            ).fetchone()
+        return self._status(row) if row is not None else None
+
+    def active(self):
+        """排队中与执行中的任务（先来先服务的顺序），每项为 (job_id, status, payload)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, status, payload FROM jobs WHERE status IN ('queued', 'processing') "
+                "ORDER BY created_at"
+            ).fetchall()
+        return [(row['job_id'], row['status'], json.loads(row['payload'])) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    # ------------------------------------------------------------------ 执行
+
+    def claim(self, worker_id):
+        """领取最早的排队任务并取得租约，返回 {'job_id', 'payload', 'attempts', 状态字段...}；队列为空时返回 None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'processing', lease_owner = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, started_at = ?, updated_at = ? WHERE job_id = ?",
+                        (worker_id, now + self.lease_seconds, now, now, row['job_id'])
+                    )
+                    job = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row['job_id'],)).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        claimed = self._status(job)
+        claimed['payload'] = json.loads(job['payload'])
+        return claimed
+
+    def heartbeat(self, job_id, worker_id):
+        """续约，返回租约是否仍属于 worker_id（False 表示任务已被收回，执行者应放弃）"""
+        now = time.time()
+        return self._write(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE job_id = ? AND lease_owner = ? AND status = 'processing'",
+            (now + self.lease_seconds, now, job_id, worker_id)
+        ) > 0
+
+    def update(self, job_id, worker_id, **fields):
+        """记录执行中的中间结果（只有持有租约的执行者可以写入），返回是否写入"""
+        fields = self._result_fields(fields)
+        assignments = ', '.join(f"{k} = ?" for k in fields)
+        return self._write(
+            f"UPDATE jobs SET {assignments}, updated_at = ? "
+            f"WHERE job_id = ? AND lease_owner = ? AND status = 'processing'",
+            (*fields.values(), time.time(), job_id, worker_id)
+        ) > 0
+
+    def _finish(self, job_id, worker_id, status, fields):
+        fields = self._result_fields(fields)
+        assignments = ''.join(f"{k} = ?, " for k in fields)
+        now = time.time()
+        return self._write(
+            f"UPDATE jobs SET {assignments}status = ?, lease_owner = NULL, lease_expires = NULL, "
+            f"finished_at = ?, updated_at = ? WHERE job_id = ? AND lease_owner = ? AND status = 'processing'",
+            (*fields.values(), status, now, now, job_id, worker_id)
+        ) > 0
+
+    def complete(self, job_id, worker_id, **fields):
+        """标记完成并写入结果；租约已被收回时不写入并返回 False"""
+        return self._finish(job_id, worker_id, 'completed', fields)
+
+    def fail(self, job_id, worker_id, error, **fields):
+        """标记失败（处理函数抛出的异常不重试，只有被中断的任务才重试）"""
+        return self._finish(job_id, worker_id, 'failed', dict(fields, error=error))
+
+    def requeue_expired(self):
+        """收回过期租约：未超过 max_attempts 的任务放回队列，否则标记失败。返回放回队列的任务 id 列表"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute(
+                    "SELECT job_id, attempts, max_attempts FROM jobs "
+                    "WHERE status = 'processing' AND lease_expires < ?", (now,)
+                ).fetchall()
+                requeued = [row['job_id'] for row in expired if row['attempts'] < row['max_attempts']]
+                for row in expired:
+                    if row['attempts'] < row['max_attempts']:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'queued', lease_owner = NULL, lease_expires = NULL, "
+                            "updated_at = ? WHERE job_id = ?", (now, row['job_id'])
+                        )
+                    else:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, lease_owner = NULL, lease_expires = NULL, "
+                            "finished_at = ?, updated_at = ? WHERE job_id = ?",
+                            (f"任务被中断 {row['attempts']} 次，已放弃", now, now, row['job_id'])
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        for job_id in requeued:
+            print(f"♻️ 任务 {job_id} 的租约已过期，重新放回队列")
+        return requeued
+
+    def prune(self):
+        """删除结束超过 retention_seconds 的任务，返回删除的数量"""
+        return self._write(
+            "DELETE FROM jobs WHERE status NOT IN ('queued', 'processing') AND finished_at < ?",
+            (time.time() - self.retention_seconds,)
+        )
+
+    def lease(self, job_id, worker_id):
+        """上下文管理器：执行期间在后台线程中定期续约；`lost` 为 True 表示租约已被收回"""
+        return _Lease(self, job_id, worker_id)
+
+
+class _Lease:
+    def __init__(self, queue, job_id, worker_id):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker_id):
+                    self.lost = True
+                    print(f"⚠️ 任务 {self.job_id} 的租约已被收回")
+                    return
+            except sqlite3.Error as e:
+                # 暂时写不进去（例如库被锁）：下一次心跳再试，租约到期前总有机会
+                print(f"任务心跳失败: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name=f'lease-{self.job_id[:8]}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+class JobWorker:
+    """持久化队列的工作线程：领取任务 → 心跳续约 → handler(job, worker_id)。
+
+    `notify()` 在有新任务时立即唤醒；没有通知时每 poll_seconds 秒检查一次队列（其它进程提交的任务、
+    到期需要收回的租约）。`stop()` 之后不再领取新任务，`busy` 表示是否有任务正在执行。
+    """
+
+    def __init__(self, queue, handler, name='job-worker', poll_seconds=5.0, on_requeue=None):
+        self.queue = queue
+        self.handler = handler
+        self.name = name
+        self.poll_seconds = poll_seconds
+        self.on_requeue = on_requeue
+        self.worker_id = new_worker_id(name)
+        self.busy = False
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    def _run(self):
+        last_maintenance = 0.0
+        while not self._stopping:
+            try:
+                if time.monotonic() - last_maintenance >= self.poll_seconds:
+                    last_maintenance = time.monotonic()
+                    requeued = self.queue.requeue_expired()
+                    if requeued and self.on_requeue is not None:
+                        self.on_requeue(requeued)
+                    self.queue.prune()
+                self.busy = True
+                job = None if self._stopping else self.queue.claim(self.worker_id)
+                if job is None:
+                    self.busy = False
+                    self._wakeup.wait(self.poll_seconds)
+                    self._wakeup.clear()
+                    continue
+                with self.queue.lease(job['job_id'], self.worker_id) as lease:
+                    self.handler(job, self.worker_id, lease)
+            except Exception as e:
+                print(f"任务队列工作线程出错: {e}")
+                time.sleep(1)
+            finally:
+                self.busy = False
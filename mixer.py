@@ -0,0 +1,257 @@
+"""
+mixer.py
+
+实时自适应混音器：在预先生成好的片段库上，随实时 HRV 的变化在不同压力等级的片段之间交叉淡化，
+输出一条连续的音频流。热路径上没有任何模型推理，压力等级变化后 1 秒内就能听到切换。
+
+- 片段来自音频库（audio_library.py）中已生成的 WAV：每个压力等级（按当前用户偏好）取若干个，
+  以 int16 内存映射方式打开（AudioBuffer），不占用额外内存；每隔 refresh_seconds 重新查询一次，
+  新生成的片段会自动加入；
+- 每 poll_seconds 读取一次最新 HRV，经 RegenerationTrigger 的迟滞 / 驻留判定得到目标压力等级；
+- 目标等级与正在播放的片段不同时，用 crossfade_seconds 的等功率交叉淡化切换到目标等级的片段；
+  目标等级没有可用片段时，使用最接近的等级；片段播放到结尾前同样淡化到同一等级的另一个片段（无缝循环）；
+- `stream()` 以实时速率输出不定长的 16-bit WAV 流（最多领先 client_buffer_seconds），
+  较小的领先量保证切换能很快被听到。
+
+用法示例：
+    mixer = AdaptiveMixer(library, 'generated_audio', hrv_fn=read_latest_hrv)
+    if mixer.start():
+        for chunk in mixer.stream():
+            send(chunk)
+"""
+
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from audio_buffer import AudioBuffer, to_int16
+from wav_io import ExclusiveStream, wav_stream_header
+from trigger import RegenerationTrigger
+
+
+STRESS_LEVELS = ('低', '中', '高')
+
+
+class _Voice:
+    """正在播放的一个片段及其播放位置"""
+
+    __slots__ = ('file_id', 'level', 'buffer', 'position')
+
+    def __init__(self, file_id, level, buffer):
+        self.file_id = file_id
+        self.level = level
+        self.buffer = buffer
+        self.position = 0
+
+    def remaining(self):
+        return len(self.buffer) - self.position
+
+    def read(self, n):
+        """读取 n 个采样（float32，-1..1），到结尾时从头继续"""
+        out = np.empty(n, dtype=np.float32)
+        filled = 0
+        while filled < n:
+            take = min(n - filled, len(self.buffer) - self.position)
+            self.buffer.float32(self.position, self.position + take, out=out[filled:filled + take])
+            self.position += take
+            filled += take
+            if self.position >= len(self.buffer):
+                self.position = 0
+        return out
+
+
+class AdaptiveMixer:
+    def __init__(self, library, audio_dir, hrv_fn, preference_fn=None, crossfade_seconds=2.0,
+                 poll_seconds=0.25, dwell_seconds=0.5, hysteresis_ms=2.0, refresh_seconds=30.0,
+                 clips_per_level=4, client_buffer_seconds=0.5):
+        self.library = library
+        self.audio_dir = audio_dir
+        self.hrv_fn = hrv_fn
+        self.preference_fn = preference_fn or (lambda: None)
+        self.crossfade_seconds = crossfade_seconds
+        self.poll_seconds = poll_seconds
+        self.refresh_seconds = refresh_seconds
+        self.clips_per_level = clips_per_level
+        self.client_buffer_seconds = client_buffer_seconds
+        self.trigger = RegenerationTrigger(hysteresis_ms=hysteresis_ms, dwell_seconds=dwell_seconds)
+
+        self.sampling_rate = None
+        self._clips = {}  # 压力等级 -> [(file_id, AudioBuffer)]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._stream_lock = threading.Lock()  # 同一时间只有一个收听连接（见 open_stream）
+        self._started = False
+        self._target = None
+        self._target_since = None
+        self._voice = None  # 正在播放的片段
+        self._incoming = None  # 正在淡入的片段（交叉淡化进行中）
+        self._fade_pos = 0
+        self.stats = {
+            'transitions': 0,
+            'loops': 0,
+            'last_switch_latency': None,
+            'silent_blocks': 0,
+            'error': None,
+        }
+
+    # ------------------------------------------------------------------ 片段库
+
+    def refresh(self):
+        """从音频库重新加载各压力等级的片段，返回片段总数"""
+        preference = self.preference_fn()
+        clips = {}
+        for level in STRESS_LEVELS:
+            loaded = []
+            for row in self.library.find(level, preference, limit=self.clips_per_level):
+                path = os.path.join(self.audio_dir, f"{row['file_id']}.wav")
+                try:
+                    clip = AudioBuffer.read_wav(path, mmap=True)
+                except (OSError, ValueError):
+                    continue  # 文件已被淘汰或尚未写完
+                if self.sampling_rate is None:
+                    self.sampling_rate = clip.sampling_rate
+                if clip.sampling_rate != self.sampling_rate or len(clip) == 0:
+                    continue
+                loaded.append((row['file_id'], clip))
+            if loaded:
+                clips[level] = loaded
+        with self._lock:
+            self._clips = clips
+        return sum(len(v) for v in clips.values())
+
+    def _resolve_level(self, level):
+        """目标等级没有可用片段时，返回最接近的有片段的等级"""
+        with self._lock:
+            available = [lv for lv in STRESS_LEVELS if lv in self._clips]
+        if not available:
+            return None
+        index = STRESS_LEVELS.index(level) if level in STRESS_LEVELS else len(STRESS_LEVELS) - 1
+        return min(available, key=lambda lv: abs(STRESS_LEVELS.index(lv) - index))
+
+    def _pick(self, level, exclude=None):
+        with self._lock:
+            candidates = list(self._clips.get(level, ()))
+        if not candidates:
+            return None
+        others = [c for c in candidates if c[0] != exclude]
+        file_id, clip = random.choice(others or candidates)
+        self.library.touch(file_id)
+        return _Voice(file_id, level, clip)
+
+    # ------------------------------------------------------------------ 控制
+
+    def start(self):
+        """加载片段并开始；片段库中没有任何可用片段时返回 False"""
+        if not self.refresh():
+            return False
+        self._poll()
+        self._started = True
+        return True
+
+    def stop(self):
+        self._stopped.set()
+
+    @property
+    def running(self):
+        return self._started and not self._stopped.is_set()
+
+    def _poll(self):
+        self.trigger.update(self.hrv_fn())
+        level = self.trigger.committed[0]
+        if level != self._target:
+            self._target = level
+            self._target_since = time.monotonic()
+
+    # ------------------------------------------------------------------ 混音
+
+    def _schedule(self, n):
+        """根据目标等级与播放位置决定是否开始一次交叉淡化"""
+        if self._incoming is not None:
+            return
+        level = self._resolve_level(self._target)
+        if level is None:
+            return
+        if self._voice is None:
+            self._voice = self._pick(level)
+            return
+        xf = int(self.crossfade_seconds * self.sampling_rate)
+        if self._voice.level != level:
+            self._incoming = self._pick(level)
+            self.stats['transitions'] += 1
+            self.stats['last_switch_latency'] = round(time.monotonic() - self._target_since, 3)
+        elif self._voice.remaining() <= xf + n:
+            self._incoming = self._pick(level, exclude=self._voice.file_id)
+            self.stats['loops'] += 1
+        self._fade_pos = 0
+
+    def _render(self, n):
+        """混出下一块 n 个采样（int16）"""
+        self._schedule(n)
+        if self._voice is None:
+            self.stats['silent_blocks'] += 1
+            return np.zeros(n, dtype=np.int16)
+        if self._incoming is None:
+            out = self._voice.read(n)
+        else:
+            xf = max(1, int(self.crossfade_seconds * self.sampling_rate))
+            m = min(n, xf - self._fade_pos)
+            t = (np.arange(self._fade_pos, self._fade_pos + m, dtype=np.float32) + 0.5) / xf
+            out = self._voice.read(m) * np.sqrt(1 - t) + self._incoming.read(m) * np.sqrt(t)
+            self._fade_pos += m
+            if self._fade_pos >= xf:
+                self._voice, self._incoming = self._incoming, None
+                if m < n:
+                    out = np.concatenate([out, self._voice.read(n - m)])
+        return to_int16(out)
+
+    def open_stream(self):
+        """占用唯一的收听连接并返回 WAV 字节流（close() 时释放）；已有连接在收听时返回 None。
+
+        混音状态（正在播放 / 淡入的片段、淡化进度）是共享的，两个连接会各自推进同一个混音，双倍速播放。
+        """
+        if not self._stream_lock.acquire(blocking=False):
+            return None
+        return ExclusiveStream(self.stream(), self._stream_lock)
+
+    def stream(self, block_seconds=0.05):
+        """生成 WAV 字节流；按实时速率输出，每 poll_seconds 检查一次 HRV"""
+        sr = self.sampling_rate
+        yield wav_stream_header(sr)
+
+        n = max(1, int(block_seconds * sr))
+        sent = 0
+        started = last_poll = last_refresh = time.monotonic()
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            try:
+                if now - last_poll >= self.poll_seconds:
+                    self._poll()
+                    last_poll = now
+                if now - last_refresh >= self.refresh_seconds:
+                    self.refresh()
+                    last_refresh = now
+            except Exception as e:
+                self.stats['error'] = str(e)
+            block = self._render(n)
+            ahead = sent / sr - (time.monotonic() - started)
+            if ahead > self.client_buffer_seconds:
+                time.sleep(ahead - self.client_buffer_seconds)
+            sent += n
+            yield block.tobytes()
+
+    def status(self):
+        with self._lock:
+            clips = {level: [file_id for file_id, _ in v] for level, v in self._clips.items()}
+        voice, incoming = self._voice, self._incoming
+        return {
+            'running': self.running,
+            'sampling_rate': self.sampling_rate,
+            'target_level': self._target,
+            'playing': {'file_id': voice.file_id, 'level': voice.level} if voice else None,
+            'fading_to': {'file_id': incoming.file_id, 'level': incoming.level} if incoming else None,
+            'clips': clips,
+            **self.stats,
+        }
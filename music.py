@@ -1,16 +1,30 @@
 import os
-import scipy
 from stress import get_stress_music_prompt
 import time
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
 
-print("Start downloading model...")
+MODEL_PATH = "/Users/xibei/MusicGPT/model"
 
-# 加载处理器和模型（路径按用户本地模型存放位置）
-processor = AutoProcessor.from_pretrained("/Users/xibei/MusicGPT/model")
-print("Processor loaded")
-model = MusicgenForConditionalGeneration.from_pretrained("/Users/xibei/MusicGPT/model")
-print("Model loaded")
+# 处理器和模型在首次生成时才加载（导入本模块不会触发 torch / transformers 导入）
+processor = None
+model = None
+# 文本编码器输出缓存（见 encoder_cache.py），随模型一起创建
+encoder_cache = None
+
+
+def load_model():
+    """加载处理器和模型（路径按用户本地模型存放位置），重复调用时直接返回。"""
+    global processor, model, encoder_cache
+    if processor is not None and model is not None:
+        return
+    from transformers import AutoProcessor, MusicgenForConditionalGeneration
+    from encoder_cache import TextEncoderCache
+
+    print("Start downloading model...")
+    processor = AutoProcessor.from_pretrained(MODEL_PATH)
+    print("Processor loaded")
+    model = MusicgenForConditionalGeneration.from_pretrained(MODEL_PATH)
+    encoder_cache = TextEncoderCache()
+    print("Model loaded")
 
 
 def generate_music(input_text: str = None, output_path: str = "generated_audio/musicgen_out.wav"):
@@ -33,11 +47,10 @@ def generate_music(input_text: str = None, output_path: str = "generated_audio/m
 
     print("input_text:", input_text)
 
-    inputs = processor(
-        text=[input_text],
-        padding=True,
-        return_tensors="pt"
-    )
+    load_model()
+
+    # 同一 prompt 的文本编码结果在多次生成之间复用
+    inputs = encoder_cache.conditioning(model, processor, input_text)
 
     start = time.time()
     # 启用采样以避免每次都生成完全相同的输出
@@ -53,7 +66,11 @@ def generate_music(input_text: str = None, output_path: str = "generated_audio/m
 
     sampling_rate = model.config.audio_encoder.sampling_rate
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    scipy.io.wavfile.write(output_path, rate=sampling_rate, data=audio_values[0, 0].numpy())
+    # 与 Web 端相同的母带处理（去直流、响度归一化、前视限幅，见 dsp.py），保存为 16-bit WAV
+    import dsp
+    from wav_io import write_wav
+    audio = dsp.master_to_int16(audio_values[0, 0], sampling_rate)
+    write_wav(output_path, audio, sampling_rate)
     print(f"音乐已保存到: {output_path}")
 
 
@@ -64,6 +81,9 @@ if __name__ == '__main__':
     import sys
     # 检查是否有 --no-auto 参数（用于被watcher调用时避免重复触发）
     auto_trigger = '--no-auto' not in sys.argv
+
+    # 作为脚本运行时先加载模型，再根据 HRV 文件决定是否生成
+    load_model()
     
     if auto_trigger:
         latest_hrv_path = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_hrv.txt')
@@ -0,0 +1,161 @@
+"""
+onnx_backend.py
+
+ONNX Runtime 推理后端：用 `tools/export_onnx.py` 导出的四个图在 CPU 上生成音乐，不依赖 PyTorch。
+
+导出目录结构：
+    text_encoder.onnx       T5 文本编码器（已包含 enc_to_dec_proj 投影与 attention mask）
+    decoder.onnx            MusicGen 解码器首步（无 past）
+    decoder_with_past.onnx  MusicGen 解码器增量步（带 KV 缓存）
+    audio_decoder.onnx      EnCodec 解码器（codes -> 波形）
+    musicgen_onnx.json      码本数、特殊 token、采样率、KV 缓存输入输出名等元数据
+    tokenizer 文件          与原模型相同的 T5 分词器
+
+生成循环（classifier-free guidance、temperature / top-k / top-p 采样、码本延迟模式）在 numpy 中实现，
+与 transformers 的 MusicGen generate 保持一致。只支持文本条件生成，不支持音频提示续写。
+
+用法示例：
+    backend = OnnxBackend('/path/to/model/onnx')
+    audio, sampling_rate = backend.generate(prompt, 1250, guidance_scale=3.0, temperature=0.8, top_p=0.9)
+"""
+
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+
+from chunked_decode import decode_in_chunks
+
+
+ONNX_FILES = ('text_encoder.onnx', 'decoder.onnx', 'decoder_with_past.onnx', 'audio_decoder.onnx')
+META_FILE = 'musicgen_onnx.json'
+
+
+def _session(path, threads=None):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def sample_next_tokens(logits, temperature=1.0, top_k=0, top_p=1.0, do_sample=True, rng=None):
+    """对每一行 logits 采样一个 token，顺序与 transformers 一致：temperature -> top-k -> top-p。"""
+    logits = logits.astype(np.float64)
+    if not do_sample:
+        return logits.argmax(axis=-1)
+    rng = rng or np.random.default_rng()
+    if temperature and temperature != 1.0:
+        logits = logits / temperature
+    vocab = logits.shape[-1]
+    if top_k and top_k < vocab:
+        kth = np.partition(logits, vocab - top_k, axis=-1)[:, vocab - top_k][:, None]
+        logits = np.where(logits < kth, -np.inf, logits)
+
+    probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    probs /= probs.sum(axis=-1, keepdims=True)
+    if top_p is not None and top_p < 1.0:
+        order = np.argsort(-probs, axis=-1)
+        sorted_probs = np.take_along_axis(probs, order, axis=-1)
+        # 保留累计概率首次达到 top_p 之前（含）的 token，至少保留一个
+        keep_sorted = np.cumsum(sorted_probs, axis=-1) - sorted_probs < top_p
+        keep = np.zeros_like(keep_sorted)
+        np.put_along_axis(keep, order, keep_sorted, axis=-1)
+        probs = np.where(keep, probs, 0.0)
+        probs /= probs.sum(axis=-1, keepdims=True)
+
+    u = rng.random((probs.shape[0], 1))
+    return np.minimum((np.cumsum(probs, axis=-1) < u).sum(axis=-1), vocab - 1)
+
+
+class OnnxBackend:
+    """ONNX Runtime 推理后端（接口与 generation.TransformersBackend 相同）"""
+
+    name = 'onnx'
+    supports_audio_prompt = False
+
+    def __init__(self, onnx_dir, threads=None):
+        missing = [f for f in ONNX_FILES + (META_FILE,) if not os.path.exists(os.path.join(onnx_dir, f))]
+        if missing:
+            raise FileNotFoundError(f"ONNX 导出不完整，缺少: {', '.join(missing)}（请先运行 tools/export_onnx.py）")
+        with open(os.path.join(onnx_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.onnx_dir = onnx_dir
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        self.text_encoder = _session(os.path.join(onnx_dir, 'text_encoder.onnx'), threads)
+        self.decoder = _session(os.path.join(onnx_dir, 'decoder.onnx'), threads)
+        self.decoder_with_past = _session(os.path.join(onnx_dir, 'decoder_with_past.onnx'), threads)
+        self.audio_decoder = _session(os.path.join(onnx_dir, 'audio_decoder.onnx'), threads)
+        self.sampling_rate = self.meta['sampling_rate']
+
+    def encode_text(self, input_text, guidance_scale=None):
+        """文本编码，返回 (encoder_hidden_states, encoder_attention_mask)；CFG 时拼接全零的无条件分支"""
+        enc = self.tokenizer([input_text], padding=True, return_tensors='np')
+        mask = enc['attention_mask'].astype(np.int64)
+        hidden = self.text_encoder.run(None, {
+            'input_ids': enc['input_ids'].astype(np.int64),
+            'attention_mask': mask,
+        })[0]
+        if guidance_scale is not None and guidance_scale > 1:
+            hidden = np.concatenate([hidden, np.zeros_like(hidden)], axis=0)
+            mask = np.concatenate([mask, np.zeros_like(mask)], axis=0)
+        return hidden, mask
+
+    def decode_step(self, input_ids, hidden, mask, past=None):
+        """解码一步，返回 (最后一个位置的 logits [batch*codebooks, vocab], 新的 KV 缓存 dict)"""
+        feeds = {'input_ids': input_ids, 'encoder_hidden_states': hidden, 'encoder_attention_mask': mask}
+        if past is None:
+            outputs = self.decoder.run(None, feeds)
+        else:
+            feeds.update(past)
+            outputs = self.decoder_with_past.run(None, feeds)
+        present = dict(zip(self.meta['past_names'], outputs[1:]))
+        return outputs[0][:, -1, :], present
+
+    def decode_audio(self, codes):
+        """EnCodec 解码：codes [codebooks, frames] -> 单声道 float32 波形（分块解码，见 chunked_decode.py）"""
+        codes = codes.astype(np.int64)
+
+        def decode(start, end):
+            return self.audio_decoder.run(None, {'audio_codes': codes[None, None, :, start:end]})[0][0, 0]
+
+        hop_length = self.sampling_rate // self.meta.get('frame_rate', 50)
+        return decode_in_chunks(decode, codes.shape[-1], hop_length)
+
+    def generate_codes(self, input_text, max_new_tokens, guidance_scale=None, temperature=1.0,
+                       top_k=None, top_p=1.0, do_sample=True, seed=None):
+        """自回归生成 EnCodec codes [codebooks, frames]（按 MusicGen 的码本延迟模式去除错位）"""
+        num_codebooks = self.meta['num_codebooks']
+        pad = self.meta['pad_token_id']
+        if top_k is None:
+            top_k = self.meta.get('top_k', 0)
+        cfg = guidance_scale is not None and guidance_scale > 1
+        hidden, mask = self.encode_text(input_text, guidance_scale)
+        rng = np.random.default_rng(seed)
+
+        # 码本 k 比码本 0 延迟 k 步：第 t 步中 t < k 或 t >= frames + k 的位置固定为 pad
+        frames = max_new_tokens - (num_codebooks - 1)
+        if frames <= 0:
+            raise ValueError(f"max_new_tokens 至少为 {num_codebooks}")
+        codebook = np.arange(num_codebooks)
+        generated = np.empty((num_codebooks, max_new_tokens), dtype=np.int64)
+        step_tokens = np.full(num_codebooks, self.meta['decoder_start_token_id'], dtype=np.int64)
+        past = None
+        for t in range(max_new_tokens):
+            input_ids = np.tile(step_tokens, 2 if cfg else 1)[:, None]
+            logits, past = self.decode_step(input_ids, hidden, mask, past)
+            if cfg:
+                cond, uncond = logits[:num_codebooks], logits[num_codebooks:]
+                logits = uncond + (cond - uncond) * guidance_scale
+            step_tokens = sample_next_tokens(logits, temperature, top_k, top_p, do_sample, rng).astype(np.int64)
+            step_tokens[(t < codebook) | (t >= frames + codebook)] = pad
+            generated[:, t] = step_tokens
+
+        return np.stack([generated[k, k:k + frames] for k in range(num_codebooks)])
+
+    def generate(self, input_text, max_new_tokens, **generation_kwargs):
+        """生成音乐，返回 (单声道 float32 波形, 采样率)"""
+        codes = self.generate_codes(input_text, max_new_tokens, **generation_kwargs)
+        return self.decode_audio(codes), self.sampling_rate
@@ -0,0 +1,211 @@
+"""
+overview.py
+
+生成音频的预计算概览（波形峰值 / RMS / 频段能量），每个片段在生成时计算一次，与 WAV 一起保存为
+`<file_id>.overview`，由 /api/audio/<file_id>/overview 提供。前端不需要下载整个 WAV、也不需要在浏览器里
+做 FFT，就能立即画出波形与随播放位置变化的频谱可视化。
+
+概览是多分辨率的金字塔：第 0 级每 base_hop（默认 1024，32 kHz 下约 32 ms）个采样一帧，之后每级帧长 ×4
+（默认 4 级：约 32 ms / 128 ms / 0.5 s / 2 s）。每帧记录：
+  - min / max   帧内采样的最小 / 最大值（int8，×127）
+  - rms         帧的 RMS（dBFS，量化为 uint8，DB_FLOOR..0 dB 线性映射到 0..255）
+  - bands       n_bands 个对数间隔频段的能量（同样是 dBFS / uint8；Hann 窗 FFT，按 Parseval 归一化，
+                各频段能量之和约等于帧的均方值，满幅正弦波约 -3 dB）
+5 分钟的片段约 140 KB（WAV 约 19 MB）。全部计算是分块的向量化 NumPy / scipy.fft（float32）。
+
+二进制格式（小端）：
+  头部 20 字节    magic 'SMOV' | version u8 | levels u8 | n_bands u8 | pad u8 | sampling_rate u32 |
+                 total_samples u32 | base_hop u16 | pad u16
+  频段边界       (n_bands + 1) × float32（Hz）
+  每一级         hop u32 | frames u32 | frames × (min i8, max i8, rms u8, bands u8 × n_bands)
+
+用法示例：
+    write_overview('generated_audio/<file_id>.wav')       # 生成 <file_id>.overview
+    ov = read_overview('generated_audio/<file_id>.overview')
+    ov.levels[0]['bands']                                 # (frames, n_bands) uint8
+"""
+
+import os
+import struct
+import tempfile
+
+import numpy as np
+import scipy.fft
+
+from audio_buffer import AudioBuffer, as_float32
+from wav_io import OVERVIEW_SUFFIX
+
+MAGIC = b'SMOV'
+VERSION = 1
+BASE_HOP = 1024
+LEVELS = 4
+LEVEL_FACTOR = 4
+N_BANDS = 8
+MIN_BAND_HZ = 40.0
+DB_FLOOR = -96.0
+# 每次处理的帧数（限制临时数组大小：2048 帧 × 1024 采样 ≈ 8 MB float32）
+CHUNK_FRAMES = 2048
+
+_HEADER = struct.Struct('<4sBBBxIIH2x')
+_LEVEL_HEADER = struct.Struct('<II')
+
+
+def _record_dtype(n_bands):
+    return np.dtype([('min', 'i1'), ('max', 'i1'), ('rms', 'u1'), ('bands', 'u1', (n_bands,))])
+
+
+def overview_path(wav_path):
+    """WAV 文件对应的概览文件路径"""
+    root, _ = os.path.splitext(wav_path)
+    return root + OVERVIEW_SUFFIX
+
+
+class Overview:
+    """多分辨率概览。levels[k] 是第 k 级的结构化数组（字段 min / max / rms / bands），帧长为 hops[k]"""
+
+    def __init__(self, sampling_rate, total_samples, base_hop, band_edges, hops, levels):
+        self.sampling_rate = int(sampling_rate)
+        self.total_samples = int(total_samples)
+        self.base_hop = int(base_hop)
+        self.band_edges = np.asarray(band_edges, dtype=np.float32)
+        self.hops = list(hops)
+        self.levels = list(levels)
+
+    @property
+    def n_bands(self):
+        return len(self.band_edges) - 1
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sampling_rate
+
+    def to_bytes(self):
+        parts = [
+            _HEADER.pack(MAGIC, VERSION, len(self.levels), self.n_bands, self.sampling_rate,
+                         self.total_samples, self.base_hop),
+            self.band_edges.astype('<f4').tobytes(),
+        ]
+        for hop, records in zip(self.hops, self.levels):
+            parts.append(_LEVEL_HEADER.pack(hop, len(records)))
+            parts.append(records.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, n_levels, n_bands, sampling_rate, total_samples, base_hop = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"不支持的概览文件（magic={magic!r}, version={version}）")
+        offset = _HEADER.size
+        band_edges = np.frombuffer(data, dtype='<f4', count=n_bands + 1, offset=offset)
+        offset += band_edges.nbytes
+        dtype = _record_dtype(n_bands)
+        hops, levels = [], []
+        for _ in range(n_levels):
+            hop, frames = _LEVEL_HEADER.unpack_from(data, offset)
+            offset += _LEVEL_HEADER.size
+            levels.append(np.frombuffer(data, dtype=dtype, count=frames, offset=offset))
+            offset += frames * dtype.itemsize
+            hops.append(hop)
+        return cls(sampling_rate, total_samples, base_hop, band_edges, hops, levels)
+
+
+def _band_starts(sampling_rate, hop, n_bands):
+    """对数间隔的频段边界（Hz）及每个频段起始的 FFT bin（保证每个频段至少一个 bin）"""
+    nyquist = sampling_rate / 2
+    edges = np.geomspace(MIN_BAND_HZ, nyquist, n_bands + 1).astype(np.float32)
+    starts = np.ceil(edges[:-1] * hop / sampling_rate).astype(np.int64)
+    for i in range(1, n_bands):
+        starts[i] = max(starts[i], starts[i - 1] + 1)
+    return edges, starts
+
+
+def _to_db_u8(mean_square):
+    db = 10 * np.log10(np.maximum(mean_square, np.float32(1e-12)))
+    return np.clip(np.round((db - DB_FLOOR) * (255 / -DB_FLOOR)), 0, 255).astype(np.uint8)
+
+
+def _to_peak_i8(x):
+    return np.clip(np.round(x * 127), -127, 127).astype(np.int8)
+
+
+def _base_frames(buffer, hop, band_starts):
+    """第 0 级：逐块计算每帧的 min / max / 均方值 / 各频段均方值（float32）"""
+    n_frames = max(1, -(-len(buffer) // hop))
+    window = np.hanning(hop).astype(np.float32)
+    # 单边谱按 Parseval 换算为均方值：sum(|X|^2) * 2 / (N * sum(w^2))
+    scale = np.float32(2.0 / (hop * float(np.sum(window * window))))
+    mins = np.empty(n_frames, dtype=np.float32)
+    maxs = np.empty(n_frames, dtype=np.float32)
+    ms = np.empty(n_frames, dtype=np.float32)
+    bands = np.empty((n_frames, len(band_starts)), dtype=np.float32)
+    block = np.empty(min(CHUNK_FRAMES, n_frames) * hop, dtype=np.float32)
+    for first in range(0, n_frames, CHUNK_FRAMES):
+        count = min(CHUNK_FRAMES, n_frames - first)
+        start = first * hop
+        segment = block[:count * hop]
+        samples = buffer.float32(start, min(start + count * hop, len(buffer)), out=segment)
+        segment[len(samples):] = 0  # 最后一帧不足 hop 时补零
+        frames = segment.reshape(count, hop)
+        mins[first:first + count] = frames.min(axis=1)
+        maxs[first:first + count] = frames.max(axis=1)
+        ms[first:first + count] = np.einsum('ij,ij->i', frames, frames) / np.float32(hop)
+        spectrum = scipy.fft.rfft(frames * window, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        bands[first:first + count] = np.add.reduceat(power, band_starts, axis=1) * scale
+    return mins, maxs, ms, bands
+
+
+def _reduce(values, factor, ufunc):
+    return ufunc.reduceat(values, np.arange(0, len(values), factor), axis=0)
+
+
+def compute_overview(audio, sampling_rate=None, base_hop=BASE_HOP, levels=LEVELS, n_bands=N_BANDS):
+    """计算多分辨率概览。audio 可以是 AudioBuffer（例如内存映射的 WAV，此时不需要 sampling_rate）、
+    int16 或 float32 数组"""
+    buffer = audio if isinstance(audio, AudioBuffer) else AudioBuffer(as_float32(audio), sampling_rate)
+    sampling_rate = buffer.sampling_rate
+    band_edges, band_starts = _band_starts(sampling_rate, base_hop, n_bands)
+    mins, maxs, ms, bands = _base_frames(buffer, base_hop, band_starts)
+
+    dtype = _record_dtype(n_bands)
+    hops, records = [], []
+    hop = base_hop
+    for level in range(levels):
+        if level > 0:
+            # 上一级每 LEVEL_FACTOR 帧合并为一帧：峰值取极值，均方值取平均
+            counts = np.diff(np.append(np.arange(0, len(ms), LEVEL_FACTOR), len(ms))).astype(np.float32)
+            mins = _reduce(mins, LEVEL_FACTOR, np.minimum)
+            maxs = _reduce(maxs, LEVEL_FACTOR, np.maximum)
+            ms = _reduce(ms, LEVEL_FACTOR, np.add) / counts
+            bands = _reduce(bands, LEVEL_FACTOR, np.add) / counts[:, None]
+            hop *= LEVEL_FACTOR
+        level_records = np.empty(len(ms), dtype=dtype)
+        level_records['min'] = _to_peak_i8(mins)
+        level_records['max'] = _to_peak_i8(maxs)
+        level_records['rms'] = _to_db_u8(ms)
+        level_records['bands'] = _to_db_u8(bands)
+        hops.append(hop)
+        records.append(level_records)
+    return Overview(sampling_rate, len(buffer), base_hop, band_edges, hops, records)
+
+
+def write_overview(wav_path, out_path=None):
+    """为 WAV 文件计算概览并原子写入 <同名>.overview，返回写入的路径"""
+    out_path = out_path or overview_path(wav_path)
+    ov = compute_overview(AudioBuffer.read_wav(wav_path, mmap=True))
+    # 临时文件名唯一：多个 Web worker 可能同时为同一个旧文件补算
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out_path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(ov.to_bytes())
+        os.chmod(tmp_path, 0o644)  # mkstemp 默认 0600，与音频文件保持一致
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return out_path
+
+
+def read_overview(path):
+    with open(path, 'rb') as f:
+        return Overview.from_bytes(f.read())
@@ -0,0 +1,175 @@
+"""
+profiler.py
+
+按需性能剖析：为单个任务（一次音乐生成、一次 HRV 测量会话）开启低开销的采样剖析或 cProfile 捕获，
+并把结果保存到 `generated_audio/profiles/`，便于下载后用火焰图工具查看。每次写入前清理旧文件：
+最多保留 MAX_PROFILE_FILES 个，超过 MAX_PROFILE_AGE_SECONDS 的直接删除。
+
+两种模式：
+  - sample  : 后台线程定时采样目标线程的 Python 调用栈，输出折叠栈（collapsed stack）文本 `.folded`，
+              可直接交给 flamegraph.pl / speedscope / inferno 渲染。开销很小，适合慢任务。
+  - cprofile: 使用标准库 cProfile 做确定性剖析，输出 `.pstats`（可用 snakeviz / flameprof 查看）。
+
+用法示例：
+    with profile_block(new_profile_id(), 'sample'):
+        do_work()
+"""
+
+import os
+import sys
+import time
+import uuid
+import threading
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_audio', 'profiles')
+
+# 支持的模式及其输出文件扩展名
+PROFILE_MODES = {
+    'sample': '.folded',
+    'cprofile': '.pstats',
+}
+
+# 默认采样间隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+# 保留策略：最多保留的剖析文件数、最长保留时间（秒）
+MAX_PROFILE_FILES = 50
+MAX_PROFILE_AGE_SECONDS = 7 * 24 * 3600
+
+
+def normalize_profile_mode(value):
+    """把请求头 / 查询参数 / 环境变量中的取值归一化为模式名，未开启时返回 None。
+
+    '1' / 'true' / 'yes' / 'on' 视为默认的 sample 模式。
+    """
+    if value is None:
+        return None
+    v = str(value).strip().lower()
+    if v in ('', '0', 'false', 'no', 'off'):
+        return None
+    if v in PROFILE_MODES:
+        return v
+    if v in ('1', 'true', 'yes', 'on'):
+        return 'sample'
+    return None
+
+
+def new_profile_id() -> str:
+    return str(uuid.uuid4())
+
+
+def profile_path(profile_id: str, mode: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}{PROFILE_MODES[mode]}")
+
+
+def find_profile(profile_id: str):
+    """根据 profile_id 查找已保存的剖析文件，返回 (path, mode)，不存在时返回 (None, None)。"""
+    for mode in PROFILE_MODES:
+        path = profile_path(profile_id, mode)
+        if os.path.exists(path):
+            return path, mode
+    return None, None
+
+
+def prune_profiles(keep=MAX_PROFILE_FILES, max_age=MAX_PROFILE_AGE_SECONDS):
+    """删除过期的剖析文件，并按修改时间只保留最新的 keep 个，返回删除的文件数。"""
+    try:
+        entries = [e for e in os.scandir(PROFILE_DIR)
+                   if e.is_file() and os.path.splitext(e.name)[1] in PROFILE_MODES.values()]
+    except FileNotFoundError:
+        return 0
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    cutoff = time.time() - max_age
+    removed = 0
+    for i, entry in enumerate(entries):
+        if i < keep and entry.stat().st_mtime >= cutoff:
+            continue
+        try:
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class SamplingProfiler:
+    """在后台线程中定时采样目标线程的调用栈，并按折叠栈格式累计样本数。"""
+
+    def __init__(self, thread_id=None, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            # 折叠栈格式要求从根到叶，以分号分隔
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_block(profile_id=None, mode=None, interval=DEFAULT_SAMPLE_INTERVAL):
+    """在 with 块内剖析当前线程；profile_id 或 mode 为空时不做任何事。
+
+    无论块内是否抛出异常，都会尽量把已收集的数据写入文件（失败的任务往往最需要剖析）。
+    """
+    if not profile_id or mode not in PROFILE_MODES:
+        yield None
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # 为即将写入的文件留出一个名额
+    prune_profiles(keep=MAX_PROFILE_FILES - 1)
+    path = profile_path(profile_id, mode)
+    started = time.time()
+
+    if mode == 'cprofile':
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield path
+        finally:
+            prof.disable()
+            try:
+                prof.dump_stats(path)
+                print(f"📈 剖析结果已保存: {path} ({time.time() - started:.1f}s)")
+            except Exception as e:
+                print(f"⚠️ 保存剖析结果失败: {e}")
+    else:
+        sampler = SamplingProfiler(interval=interval)
+        sampler.start()
+        try:
+            yield path
+        finally:
+            sampler.stop()
+            try:
+                sampler.write_folded(path)
+                print(f"📈 采样剖析已保存: {path} ({sum(sampler.samples.values())} 个样本, {time.time() - started:.1f}s)")
+            except Exception as e:
+                print(f"⚠️ 保存剖析结果失败: {e}")
@@ -55,10 +55,18 @@ def main():
     print("⏹️  按 Ctrl+C 停止服务器")
     print("=" * 50)
     
-    # 启动Flask应用
+    # 生产模式：gunicorn 多 worker + 专用推理进程
+    if '--production' in sys.argv:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        os.chdir(base_dir)
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'])
+
+    # 启动Flask应用（开发服务器）
     try:
         from app import app
-        app.run(debug=True, host='0.0.0.0', port=5001)
+        # 不启用重载器：重载器的父进程也会执行模块级代码（加载模型、任务工作线程、后台淘汰、与目录对账），
+        # 变成两个进程同时领取任务、淘汰文件并各自加载模型
+        app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5001)
     except KeyboardInterrupt:
         print("\n👋 服务器已停止")
     except Exception as e:
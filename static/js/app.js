@@ -15,6 +15,13 @@ let musicGenerationCheckInterval = null;
 let statusCheckInterval = null; // 统一的HRV和模型状态检查interval
 let loadingBreathingTimer = null; // 加载页面的呼吸定时器
 let musicPollInterval = null; // 轮询音乐生成状态的间隔
+let draftPlaying = false; // 渐进式生成：草稿档是否已开始播放
+let currentJobId = null; // 当前生成任务（轮询 /api/music-status?job_id=）
+let generateRetryTimer = null; // 生成队列已满（429）时按 Retry-After 自动重试
+const UPGRADE_CROSSFADE_MS = 4000; // 草稿切换到完整版的交叉淡化时长
+const OVERVIEW_DB_FLOOR = -96; // 概览中 0..255 对应 -96..0 dBFS（见 overview.py）
+const OVERVIEW_VISUAL_DB = [-60, -6]; // 可视化使用的频段能量范围（dBFS），映射到 0..255
+const OVERVIEW_BIN_HZ = 24000 / 128; // 与 AnalyserNode（fftSize 256，48 kHz）相同的频率分辨率
 
 // 切换到指定页面
 function switchPage(pageName) {
@@ -535,9 +542,21 @@ async function generateMusic() {
       headers: {
         "Content-Type": "application/json",
       },
-      body: JSON.stringify({}),
+      // 渐进式生成：先返回几秒内可播放的草稿，完整质量版本在后台生成后无缝替换
+      body: JSON.stringify({ progressive: true }),
     });
 
+    if (response.status === 429) {
+      // 生成队列已满或提交过于频繁：按服务端给出的 Retry-After 自动重试，保持在加载页面
+      const errData = await response.json();
+      const retryAfter = parseInt(response.headers.get("Retry-After") || errData.retry_after || "10", 10);
+      console.warn(`⏳ ${errData.error}，${retryAfter} 秒后重试`);
+      showToast(`${errData.error}，约 ${retryAfter} 秒后自动重试`);
+      if (generateRetryTimer) clearTimeout(generateRetryTimer);
+      generateRetryTimer = setTimeout(generateMusic, retryAfter * 1000);
+      return;
+    }
+
     if (!response.ok) {
       const errData = await response.json();
       throw new Error(errData.error || "请求失败");
@@ -545,9 +564,15 @@ async function generateMusic() {
 
     const data = await response.json();
 
-    // 如果已经在生成中或者刚启动
-    if (data.status === 'processing') {
-      console.log("✅ 后台任务已启动，开始轮询状态...");
+    // 已加入队列、已经在生成中；片段库中已有相同 prompt 的音乐（或繁忙时的相近片段）时直接为 completed
+    if (data.status === 'queued' || data.status === 'processing' || data.status === 'completed') {
+      console.log(data.status === 'completed' ? "✅ 已复用片段库中的音乐" : "✅ 后台任务已启动，开始轮询状态...");
+      currentJobId = data.job_id || null;
+      if (data.degraded) {
+        showToast(data.status === 'completed' ? "生成队列繁忙，先为您播放相近的音乐" : "生成队列繁忙，将生成快速版本");
+      } else if (data.eta_seconds > 60) {
+        showToast(`预计约 ${Math.ceil(data.eta_seconds / 60)} 分钟后完成`);
+      }
       startMusicPolling();
     } else {
       throw new Error("未知的任务状态: " + data.status);
@@ -560,24 +585,59 @@ async function generateMusic() {
   }
 }
 
+// 服务重启期间状态查询会暂时失败：任务已持久化，重启后继续执行，连续失败这么多次（约 5 分钟）才放弃
+const MAX_POLL_FAILURES = 150;
+
 function startMusicPolling() {
   if (musicPollInterval) clearInterval(musicPollInterval);
+  draftPlaying = false;
+  let pollFailures = 0;
 
   // 每 2 秒轮询一次
   musicPollInterval = setInterval(async () => {
     try {
-      const res = await fetch("/api/music-status");
+      let res;
+      try {
+        res = await fetch(currentJobId ? `/api/music-status?job_id=${encodeURIComponent(currentJobId)}` : "/api/music-status");
+      } catch (e) {
+        res = null;
+      }
+      if (!res || res.status >= 502) {
+        if (++pollFailures < MAX_POLL_FAILURES) {
+          console.warn("⏳ 服务暂时不可用，稍后继续查询任务状态");
+          return;
+        }
+        throw new Error("服务长时间不可用");
+      }
+      pollFailures = 0;
       const statusData = await res.json();
+      if (res.status === 404) {
+        throw new Error(statusData.error || "任务不存在");
+      }
 
       console.log("⏳ 轮询生成状态:", statusData.status);
 
       if (statusData.status === 'completed' && statusData.file_id) {
         clearInterval(musicPollInterval);
         console.log("✅ 音乐生成完成! FileID:", statusData.file_id);
-        playMusic(statusData.file_id);
+        if (draftPlaying) {
+          upgradeToFullQuality(statusData.file_id);
+        } else {
+          playMusic(statusData.file_id);
+        }
       } else if (statusData.status === 'failed') {
         clearInterval(musicPollInterval);
+        if (draftPlaying) {
+          // 完整版生成失败时继续播放草稿
+          console.warn("⚠️ 完整版生成失败，继续播放草稿:", statusData.error);
+          return;
+        }
         throw new Error(statusData.error || "生成失败");
+      } else if (statusData.draft_file_id && !draftPlaying) {
+        // 草稿已就绪：先播放，继续轮询完整版
+        draftPlaying = true;
+        console.log("🎧 草稿已就绪，先行播放:", statusData.draft_file_id);
+        playMusic(statusData.draft_file_id);
       }
       // else: 'processing' or 'idle', 继续等待
 
@@ -612,6 +672,7 @@ function playMusic(fileId) {
   const audioUrl = `/api/audio/${fileId}`;
   console.log("设置音频源:", audioUrl);
   audioPlayer.src = audioUrl;
+  useAudioOverview(fileId);
   audioPlayer.crossOrigin = "anonymous"; // 防止跨域音频分析问题
 
   // 3. 尝试自动播放
@@ -703,6 +764,127 @@ function playMusic(fileId) {
   };
 }
 
+// 渐进式生成：完整版就绪后从草稿交叉淡化切换
+// 用一个临时 <audio> 播放完整版并做等功率交叉淡化，淡化结束后把主播放器切换到完整版的同一位置，
+// 这样可视化、进度条和播放结束回调仍然绑定在主播放器上。
+function upgradeToFullQuality(fileId) {
+  const audioPlayer = document.getElementById("audio-player");
+  const audioUrl = `/api/audio/${fileId}`;
+  // 完整版没有概览时（可视化已经初始化过）改用浏览器端分析
+  useAudioOverview(fileId).then((overview) => {
+    if (!overview) ensureAnalyser(audioPlayer);
+  });
+
+  // 草稿没有在播放（被暂停或自动播放被拦截）：直接替换音源即可
+  if (audioPlayer.paused) {
+    audioPlayer.src = audioUrl;
+    return;
+  }
+
+  const next = new Audio(audioUrl);
+  next.crossOrigin = "anonymous";
+  next.volume = 0;
+  next.play().then(() => {
+    const steps = 40;
+    let step = 0;
+    const fadeTimer = setInterval(() => {
+      step++;
+      const t = Math.min(1, step / steps);
+      audioPlayer.volume = Math.cos(t * Math.PI / 2);
+      next.volume = Math.sin(t * Math.PI / 2);
+      if (step < steps) return;
+      clearInterval(fadeTimer);
+
+      // 交接：主播放器静音加载完整版并跳到同一位置，开始播放后再停掉临时播放器
+      audioPlayer.volume = 0;
+      audioPlayer.src = audioUrl;
+      audioPlayer.addEventListener("loadedmetadata", () => {
+        audioPlayer.currentTime = next.currentTime;
+        audioPlayer.play();
+      }, { once: true });
+      audioPlayer.addEventListener("playing", () => {
+        audioPlayer.volume = 1;
+        next.pause();
+      }, { once: true });
+    }, UPGRADE_CROSSFADE_MS / steps);
+    console.log("✨ 已切换到完整质量版本:", fileId);
+  }).catch((error) => {
+    console.warn("⚠️ 交叉淡化失败，直接切换:", error);
+    audioPlayer.src = audioUrl;
+    audioPlayer.play();
+  });
+}
+
+// 预计算概览（/api/audio/<file_id>/overview，二进制格式见 overview.py）：
+// 可视化按播放位置查表，不需要下载整个 WAV，也不需要在浏览器里做 FFT
+let audioOverview = null;
+let audioOverviewFileId = null;
+// 当前片段概览的获取结果（概览或 null），可视化在它完成后再决定是否需要浏览器端分析
+let audioOverviewReady = Promise.resolve(null);
+
+function useAudioOverview(fileId) {
+  audioOverviewFileId = fileId;
+  // 先清掉上一个片段的概览：新片段没有概览（404 / 旧文件）时不能继续显示上一个片段的波形
+  audioOverview = null;
+  audioOverviewReady = fetch(`/api/audio/${fileId}/overview`)
+    .then((resp) => (resp.ok ? resp.arrayBuffer() : null))
+    .then((buffer) => {
+      // 期间已切换到其他文件时丢弃
+      if (audioOverviewFileId !== fileId) return null;
+      audioOverview = buffer ? parseAudioOverview(buffer) : null;
+      return audioOverview;
+    })
+    .catch((e) => {
+      console.warn("⚠️ 获取音频概览失败，使用浏览器端分析:", e);
+      return null;
+    });
+  return audioOverviewReady;
+}
+
+function parseAudioOverview(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== "SMOV" || view.getUint8(4) !== 1) return null;
+  const nLevels = view.getUint8(5);
+  const nBands = view.getUint8(6);
+  const overview = {
+    samplingRate: view.getUint32(8, true),
+    totalSamples: view.getUint32(12, true),
+    nBands,
+    recordSize: 3 + nBands, // min i8, max i8, rms u8, bands u8 × nBands
+    bandEdges: [],
+    levels: [],
+  };
+  let offset = 20;
+  for (let i = 0; i <= nBands; i++, offset += 4) {
+    overview.bandEdges.push(view.getFloat32(offset, true));
+  }
+  for (let k = 0; k < nLevels; k++) {
+    const hop = view.getUint32(offset, true);
+    const frames = view.getUint32(offset + 4, true);
+    offset += 8;
+    overview.levels.push({ hop, frames, records: new Uint8Array(buffer, offset, frames * overview.recordSize) });
+    offset += frames * overview.recordSize;
+  }
+  return overview;
+}
+
+// 把概览第 0 级在 time 秒处的频段能量展开成与 AnalyserNode.getByteFrequencyData 相同形式的 0..255 数组，
+// 与上一帧做指数平滑（相当于 AnalyserNode 的 smoothingTimeConstant）
+function fillFromOverview(overview, time, out) {
+  const level = overview.levels[0];
+  const frame = Math.min(level.frames - 1, Math.max(0, Math.floor((time * overview.samplingRate) / level.hop)));
+  const base = frame * overview.recordSize + 3;
+  const [lo, hi] = OVERVIEW_VISUAL_DB;
+  let band = 0;
+  for (let i = 0; i < out.length; i++) {
+    while (band < overview.nBands - 1 && i * OVERVIEW_BIN_HZ >= overview.bandEdges[band + 1]) band++;
+    const db = (level.records[base + band] / 255) * -OVERVIEW_DB_FLOOR + OVERVIEW_DB_FLOOR;
+    const value = Math.max(0, Math.min(255, ((db - lo) / (hi - lo)) * 255));
+    out[i] = out[i] * 0.7 + value * 0.3;
+  }
+}
+
 // 初始化音频可视化 (新媒体艺术风格)
 function initAudioVisualizer(audioElement) {
   // 防止重复创建 AudioContext
@@ -715,26 +897,33 @@ function initAudioVisualizer(audioElement) {
     audioContext.resume();
   }
 
-  // 防止重复连接 Source
-  if (!source) {
-    try {
-      source = audioContext.createMediaElementSource(audioElement);
-      analyser = audioContext.createAnalyser();
-      analyser.fftSize = 256; // 频率分辨率
-      source.connect(analyser);
-      analyser.connect(audioContext.destination);
-
-      const bufferLength = analyser.frequencyBinCount;
-      dataArray = new Uint8Array(bufferLength);
-    } catch (err) {
-      console.error("Audio Context setup error:", err);
-    }
-  }
+  // 有预计算概览时不需要在浏览器里做频谱分析：等概览获取完成后再决定
+  audioOverviewReady.then((overview) => {
+    if (!overview) ensureAnalyser(audioElement);
+  });
 
   // 初始化画布
   initVisualCanvas();
 }
 
+// 浏览器端频谱分析（没有预计算概览时使用）
+function ensureAnalyser(audioElement) {
+  // 防止重复连接 Source
+  if (source || !audioContext) return;
+  try {
+    source = audioContext.createMediaElementSource(audioElement);
+    analyser = audioContext.createAnalyser();
+    analyser.fftSize = 256; // 频率分辨率
+    source.connect(analyser);
+    analyser.connect(audioContext.destination);
+
+    const bufferLength = analyser.frequencyBinCount;
+    dataArray = new Uint8Array(bufferLength);
+  } catch (err) {
+    console.error("Audio Context setup error:", err);
+  }
+}
+
 let canvas, ctx;
 let visualAnimationId;
 let centerX, centerY;
@@ -830,7 +1019,11 @@ function drawNewMediaArt() {
 
   visualAnimationId = requestAnimationFrame(drawNewMediaArt);
 
-  if (analyser) {
+  const audioPlayer = document.getElementById("audio-player");
+  if (audioOverview && audioPlayer) {
+    if (!dataArray) dataArray = new Uint8Array(128).fill(0);
+    fillFromOverview(audioOverview, audioPlayer.currentTime, dataArray);
+  } else if (analyser) {
     analyser.getByteFrequencyData(dataArray);
   } else {
     if (!dataArray) dataArray = new Uint8Array(128).fill(0);
@@ -2,8 +2,13 @@
 # 压力水平与音乐关键词对应关系
 import os
 import json
+import math
+import hashlib
+from types import MappingProxyType
 from typing import Optional
 
+import user_profiles
+
 # 基础关键词（不包含用户偏好）
 # 基础的压力-音乐映射表（MusicGen 风格优化版）
 _BASE_STRESS_MUSIC_MAP = {
@@ -17,12 +22,12 @@ _BASE_STRESS_MUSIC_MAP = {
     ]
 }
 
-# 持久化文件路径（会写入用户选择的偏好关键词）
+# 旧版本的偏好持久化文件（整张映射表，只在迁移到 user_profiles.py 的默认档案时读取）
 _MAP_STORAGE_PATH = os.path.join(os.path.dirname(__file__), 'generated_audio', 'stress_music_map.json')
 
 
 def _load_persistent_map():
-    """如果持久化文件存在则加载，否则使用内存中的默认值。"""
+    """如果旧版本的持久化文件存在则加载，否则使用内存中的默认值。"""
     try:
         if os.path.exists(_MAP_STORAGE_PATH):
             with open(_MAP_STORAGE_PATH, 'r', encoding='utf-8') as f:
@@ -37,16 +42,6 @@ def _load_persistent_map():
     return _BASE_STRESS_MUSIC_MAP.copy()
 
 
-def _save_persistent_map(mapping: dict):
-    try:
-        os.makedirs(os.path.dirname(_MAP_STORAGE_PATH), exist_ok=True)
-        with open(_MAP_STORAGE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(mapping, f, ensure_ascii=False, indent=2)
-    except Exception:
-        # 写入失败不应中断主流程
-        pass
-
-
 # 用户音乐偏好选择列表
 VALID_PREFERENCES = [
     'pop', 'rock', 'classical', 'hip hop', 'electronic',
@@ -54,11 +49,6 @@ VALID_PREFERENCES = [
 ]
 
 
-# 用户音乐偏好选择（运行时变量，不修改文件）
-# 可选值: 见 VALID_PREFERENCES, None（未选择）
-USER_MUSIC_PREFERENCE = None
-
-
 def _build_stress_music_map(base_map=None, user_preference=None):
     """根据基础映射和用户偏好构建完整的 STRESS_MUSIC_MAP。
     
@@ -86,27 +76,88 @@ def _build_stress_music_map(base_map=None, user_preference=None):
     return result
 
 
-# 在模块加载时尝试用持久化数据覆盖默认映射
-# 注意：_load_persistent_map() 会尝试从持久化文件中恢复 USER_MUSIC_PREFERENCE
-_persistent_map = _load_persistent_map()
-
-# 构建最终的 STRESS_MUSIC_MAP（包含用户偏好）
-# 如果持久化文件存在，使用持久化数据；否则使用基础映射
-if _persistent_map != _BASE_STRESS_MUSIC_MAP:
-    STRESS_MUSIC_MAP = _persistent_map
-    # 从持久化数据中恢复用户偏好
+def _preference_from_map(mapping: dict) -> Optional[str]:
+    """三个等级的首个关键词是同一个偏好关键词时，返回该偏好，否则返回 None。"""
     first_keywords = []
     for level in ["低", "中", "高"]:
-        if level in _persistent_map and len(_persistent_map[level]) > 0:
-            first_keyword = _persistent_map[level][0]
+        if level in mapping and len(mapping[level]) > 0:
+            first_keyword = mapping[level][0]
             if first_keyword in VALID_PREFERENCES:
                 first_keywords.append(first_keyword)
     if len(first_keywords) == 3 and len(set(first_keywords)) == 1:
-        USER_MUSIC_PREFERENCE = first_keywords[0]
-        print(f"✅ 已从持久化文件恢复用户音乐偏好: {USER_MUSIC_PREFERENCE}")
-else:
-    # 使用基础映射构建（此时 USER_MUSIC_PREFERENCE 为 None）
-    STRESS_MUSIC_MAP = _build_stress_music_map()
+        return first_keywords[0]
+    return None
+
+
+# 默认档案偏好的缓存：(库文件签名, 偏好)。签名包含 profiles.db、WAL 文件和旧版映射文件的
+# (st_mtime_ns, st_size)，WAL 模式下的写入先落在 -wal 文件，只看主库会漏掉其他进程的修改
+_default_preference = None
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_user_music_preference() -> Optional[str]:
+    """读取默认档案的音乐偏好（命令行工具与单用户部署使用）。
+
+    库文件（含 WAL）和旧版映射文件都没有变化时只做几次 stat，不重新连接 SQLite；其他进程修改后
+    下一次调用即可见。库中还没有默认档案时回退到旧版本的 stress_music_map.json。
+    按用户的偏好见 user_profiles.UserProfileStore。
+    """
+    global _default_preference
+    db_path = user_profiles.DEFAULT_DB_PATH
+    key = (_file_signature(db_path), _file_signature(db_path + '-wal'), _file_signature(_MAP_STORAGE_PATH))
+    cached = _default_preference
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    profile = user_profiles.read_profile(user_profiles.DEFAULT_USER_ID)
+    if profile is not None:
+        preference = profile.preference
+    else:
+        preference = _preference_from_map(_load_persistent_map())
+    _default_preference = (key, preference)
+    return preference
+
+
+# 不含用户偏好的压力-音乐映射（只读；偏好按用户保存，不再修改模块全局变量）
+STRESS_MUSIC_MAP = _build_stress_music_map()
+
+# HRV 压力等级阈值（ms）
+HRV_LOW_STRESS_MS = 35.0
+HRV_HIGH_STRESS_MS = 20.0
+
+_LATEST_HRV_PATH = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_hrv.txt')
+_LATEST_BPM_PATH = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_bpm.txt')
+# path -> ((st_mtime_ns, st_size), 数值)：文件没有变化时只做一次 stat，不重新打开、解析
+_latest_values = {}
+
+
+def _read_latest_number(path: str) -> Optional[float]:
+    """读取 latest_hrv.txt / latest_bpm.txt 中的数值；文件不存在、为空或无法解析时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _latest_values.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        value = float(content) if content else None
+        if value is not None and not math.isfinite(value):
+            value = None
+    except (OSError, ValueError):
+        value = None
+    _latest_values[path] = (key, value)
+    return value
+
 
 # 用户输入压力水平
 def hrv_to_stress_level(hrv_ms: float) -> str:
@@ -125,9 +176,9 @@ def hrv_to_stress_level(hrv_ms: float) -> str:
     except Exception:
         return "高"
 
-    if h >= 35.0:
+    if h >= HRV_LOW_STRESS_MS:
         return "低"
-    if 20.0 <= h < 35.0:
+    if HRV_HIGH_STRESS_MS <= h < HRV_LOW_STRESS_MS:
         return "中"
     return "高"
 
@@ -144,79 +195,94 @@ def get_user_stress_level(hrv_ms: Optional[float] = None) -> str:
         return hrv_to_stress_level(hrv_ms)
 
     # 尝试从文件读取最近的 HRV 值
-    latest_path = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_hrv.txt')
-    try:
-        if os.path.exists(latest_path):
-            with open(latest_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    return hrv_to_stress_level(float(content))
-    except Exception:
-        pass
+    hrv = _read_latest_number(_LATEST_HRV_PATH)
+    if hrv is not None:
+        return hrv_to_stress_level(hrv)
 
     # 回退到默认，不再要求手动输入
     return '高'
 
 def get_user_bpm() -> int:
     """读取最近的脉搏 BPM"""
-    path = os.path.join(os.path.dirname(__file__), 'generated_audio', 'latest_bpm.txt')
-    try:
-        if os.path.exists(path):
-            with open(path, 'r') as f:
-                return int(float(f.read().strip()))
-    except:
-        pass
+    bpm = _read_latest_number(_LATEST_BPM_PATH)
+    if bpm is not None:
+        return int(bpm)
     return 75  # 默认值
 
 
+def get_target_bpm(stress_level: str, user_bpm: int) -> int:
+    """根据压力等级和用户当前心率计算生成音乐的目标 BPM"""
+    if stress_level == '高':
+        # 高压力（如 90）：目标提升到 75，避免 60bpm 导致的呆板长音
+        return max(75, user_bpm - 15)
+    elif stress_level == '中':
+        # 中压力：稍微慢一点
+        return max(60, user_bpm - 5)
+    # 低压力：同频共振，保持活力
+    return user_bpm
+
+
+def get_tempo_bucket(target_bpm: int) -> str:
+    """将 BPM 转换为语义描述，这更利于 MusicGen 生成高质量音乐"""
+    if target_bpm < 70:
+        return "slow tempo"
+    elif target_bpm < 110:
+        return "moderate tempo"
+    return "fast tempo"
+
+
 # 根据压力水平和关键词生成音乐模型输入文本
-def get_stress_music_prompt(hrv_ms: Optional[float] = None) -> str:
-    """根据 HRV（可选）返回用于音乐生成的关键词文本。
+def get_stress_music_prompt(hrv_ms: Optional[float] = None, profile=None) -> str:
+    """根据 HRV（可选）和用户档案返回用于音乐生成的关键词文本。
 
     用法：
         - `get_stress_music_prompt(hrv_ms=25.3)` 会基于 HRV 自动选择压力等级并返回关键词。
         - 不传 `hrv_ms` 时尝试读取 `latest_hrv.txt` 来判断等级。
-        - 如果设置了 USER_MUSIC_PREFERENCE，会自动添加到关键词列表的开头。
+        - `profile` 为用户档案（user_profiles.UserProfile），其偏好会添加到关键词列表的开头；
+          不传时使用默认档案的偏好（命令行工具）。
         - 会读取 user BPM 并动态调整生成音乐的速度（BPM）。
     """
+    preference = profile.preference if profile is not None else load_user_music_preference()
     stress_level = get_user_stress_level(hrv_ms)
-    # 获取当前压力等级的关键词（已经包含了 USER_MUSIC_PREFERENCE，如果设置了的话）
-    # 注意：必须 copy，否则会修改全局变量
-    music_keywords = STRESS_MUSIC_MAP.get(stress_level, STRESS_MUSIC_MAP['高']).copy()
-    
     # --- 动态 BPM 策略 ---
-    user_bpm = get_user_bpm()
-    target_bpm = user_bpm
-    
-    if stress_level == '高':
-        # 高压力（如 90）：目标提升到 75，避免 60bpm 导致的呆板长音
-        target_bpm = max(75, user_bpm - 15)
-    elif stress_level == '中':
-        # 中压力：稍微慢一点
-        target_bpm = max(60, user_bpm - 5)
-    else: 
-        # 低压力：同频共振，保持活力
-        target_bpm = user_bpm
+    target_bpm = get_target_bpm(stress_level, get_user_bpm())
+    return build_stress_music_prompt(stress_level, target_bpm, preference)
+
+
+def stress_music_map_for(preference: Optional[str]) -> dict:
+    """返回给定偏好下的压力-音乐映射（预编译配置中的副本，可以随意修改）。"""
+    return PROMPT_CONFIG.stress_map(preference)
+
+
+def build_stress_music_prompt(stress_level: str, target_bpm: int, preference: Optional[str] = None) -> str:
+    """由 (压力等级, 目标 BPM, 用户偏好) 构建 prompt；不读取任何文件，只查预编译的 prompt 表，
+    `get_stress_music_prompt` 与离线预生成（tools/prerender.py）共用。"""
+    return PROMPT_CONFIG.prompt(stress_level, target_bpm, preference)
+
+
+# 提示词构建规则的版本：修改 _prompt_template 的规则（而不只是关键词表）时递增，
+# 使按 PromptConfig.version 建立的下游缓存（文本编码器缓存等）失效
+PROMPT_RULES_VERSION = 1
+TEMPO_BUCKETS = ("slow tempo", "moderate tempo", "fast tempo")
+# prompt 模板中 BPM 数值的占位符（关键词中不会出现）
+_BPM_SLOT = "\x00"
+
+
+def _prompt_template(stress_map: dict, stress_level: str, preference: Optional[str], tempo_desc: str):
+    """按 (压力等级, 偏好, 速度档位) 构建 prompt 模板，返回 BPM 数值前后的两段文本。"""
+    # 获取当前压力等级的关键词（已经包含了用户偏好，如果设置了的话）
+    # 注意：必须 copy，否则会修改配置中的映射
+    music_keywords = list(stress_map.get(stress_level, stress_map['高']))
 
     # 移除原有的硬编码 BPM 范围 (如 "80-100 BPM")
     music_keywords = [k for k in music_keywords if "BPM" not in k]
-    
-    # 将 BPM 转换为语义描述，这更利于 MusicGen 生成高质量音乐
-    if target_bpm < 70:
-        tempo_desc = "slow tempo"
-    elif target_bpm < 110:
-        tempo_desc = "moderate tempo"
-    else:
-        tempo_desc = "fast tempo"
 
-    # 插入动态 BPM 和描述
-    
     # --- 关键修复：恢复丢失的智能偏好适配逻辑 ---
-    if USER_MUSIC_PREFERENCE:
-        pref = USER_MUSIC_PREFERENCE.lower()
+    if preference:
+        pref = preference.lower()
         
         # 1. 高压力修饰：Pop -> Soft Pop Ballad
-        if stress_level == '高' and len(music_keywords) > 0 and music_keywords[0] == USER_MUSIC_PREFERENCE:
+        if stress_level == '高' and len(music_keywords) > 0 and music_keywords[0] == preference:
              music_keywords[0] = f"soft {music_keywords[0]} ballad, acoustic version"
         
         # 2. 低压力修饰：防止特定风格 + Pop Rock 的冲突
@@ -226,7 +292,7 @@ def get_stress_music_prompt(hrv_ms: Optional[float] = None) -> str:
         if stress_level == '低' and any(g in pref for g in protected_genres):
             # 动态替换 STRESS_LEVEL_LOW 的默认 Pop Rock 描述
             # 这里的 trick 是直接重构列表，抛弃默认的 upbeat pop rock
-            music_keywords = [USER_MUSIC_PREFERENCE, "energetic", "virtuoso", "upbeat rhythm", "positive vibes", "bright atmosphere", "major scale"]
+            music_keywords = [preference, "energetic", "virtuoso", "upbeat rhythm", "positive vibes", "bright atmosphere", "major scale"]
         # 2. 低压力修饰... (Existing code)
         
         # 3. 中压力修饰 (新增)：防止 Reggae + Smooth Jazz 的"撞钟"惨剧
@@ -234,14 +300,14 @@ def get_stress_music_prompt(hrv_ms: Optional[float] = None) -> str:
         rhythmic_genres = ['reggae', 'funk', 'latin', 'hip hop', 'disco', 'house', 'soul']
         if stress_level == '中' and any(g in pref for g in rhythmic_genres):
              # 保持原风格，但加上"Chill", "Laid back" 等中性放松词，而不是 Jazz
-             music_keywords = [USER_MUSIC_PREFERENCE, "chill groove", "laid back", "melodic", "soft textures", "moderate tempo", "instrumental"]
+             music_keywords = [preference, "chill groove", "laid back", "melodic", "soft textures", "moderate tempo", "instrumental"]
              
     # ---------------------------------------------
     seen = set()
     deduped_keywords = []
     
-    # 先处理 BPM 字符串
-    bpm_str = f"{tempo_desc}, bpm: {target_bpm}"
+    # 先处理 BPM 字符串（BPM 数值在查表时填入）
+    bpm_str = f"{tempo_desc}, bpm: {_BPM_SLOT}"
     
     # 遍历现有关键词并去重
     for k in music_keywords:
@@ -255,7 +321,7 @@ def get_stress_music_prompt(hrv_ms: Optional[float] = None) -> str:
     # 将 BPM 描述插入到合适位置 (紧跟风格之后)
     # 如果有用户偏好且在第一位，插在第二位；否则插在第一位
     insert_pos = 0
-    if USER_MUSIC_PREFERENCE and len(deduped_keywords) > 0 and USER_MUSIC_PREFERENCE in deduped_keywords[0]:
+    if preference and len(deduped_keywords) > 0 and preference in deduped_keywords[0]:
         insert_pos = 1
         
     deduped_keywords.insert(insert_pos, bpm_str)
@@ -266,11 +332,67 @@ def get_stress_music_prompt(hrv_ms: Optional[float] = None) -> str:
         if e not in seen:
             deduped_keywords.append(e)
     
-    return ", ".join(deduped_keywords)
+    head, tail = ", ".join(deduped_keywords).split(_BPM_SLOT)
+    return head, tail
+
+
+class PromptConfig:
+    """不可变的提示词配置：基础压力-音乐映射 + 可选偏好。
+
+    创建时预编译全部 (压力等级, 偏好, 速度档位) 的 prompt 模板，`prompt()` 只是一次查表加上填入 BPM 数值；
+    `version` 是配置内容（关键词表、偏好列表、规则版本）的哈希，下游缓存以它为键，配置变化时自动失效。
+    修改关键词表时创建新的 PromptConfig，而不是修改已有对象。
+    """
+
+    __slots__ = ('base_map', 'preferences', 'version', '_maps', '_table')
+
+    def __init__(self, base_map: dict, preferences):
+        base = {level: tuple(keywords) for level, keywords in base_map.items()}
+        preferences = tuple(preferences)
+        fingerprint = json.dumps({'rules': PROMPT_RULES_VERSION, 'map': base, 'preferences': preferences},
+                                 ensure_ascii=False, sort_keys=True)
+        maps, table = {}, {}
+        for preference in (None,) + preferences:
+            stress_map = _build_stress_music_map({k: list(v) for k, v in base.items()}, preference)
+            maps[preference] = {level: tuple(keywords) for level, keywords in stress_map.items()}
+            for level in base:
+                for bucket in TEMPO_BUCKETS:
+                    table[(level, preference, bucket)] = _prompt_template(stress_map, level, preference, bucket)
+        set_attr = super().__setattr__
+        set_attr('base_map', MappingProxyType(base))
+        set_attr('preferences', preferences)
+        set_attr('version', hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12])
+        set_attr('_maps', maps)
+        set_attr('_table', table)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PromptConfig 是不可变的，请创建新的配置')
+
+    def prompt(self, stress_level: str, target_bpm: int, preference: Optional[str] = None) -> str:
+        bucket = get_tempo_bucket(target_bpm)
+        template = self._table.get((stress_level, preference, bucket))
+        if template is None:
+            # 表外的压力等级或偏好（例如自定义偏好）：现场构建，不写入表
+            stress_map = _build_stress_music_map({k: list(v) for k, v in self.base_map.items()}, preference)
+            template = _prompt_template(stress_map, stress_level, preference, bucket)
+        head, tail = template
+        return f"{head}{target_bpm}{tail}"
+
+    def stress_map(self, preference: Optional[str] = None) -> dict:
+        stress_map = self._maps.get(preference)
+        if stress_map is None:
+            return _build_stress_music_map({k: list(v) for k, v in self.base_map.items()}, preference)
+        return {level: list(keywords) for level, keywords in stress_map.items()}
+
+    def __len__(self):
+        return len(self._table)
+
+
+PROMPT_CONFIG = PromptConfig(_BASE_STRESS_MUSIC_MAP, VALID_PREFERENCES)
 
 
 def set_user_music_preference(preference_keyword: str) -> bool:
-    """设置用户音乐偏好（运行时变量，不修改文件）。
+    """设置默认档案的音乐偏好（命令行工具使用；Web 请求按用户写入 user_profiles.UserProfileStore）。
     
     参数:
         preference_keyword: 偏好关键词，应为 VALID_PREFERENCES 中的值
@@ -278,13 +400,12 @@ def set_user_music_preference(preference_keyword: str) -> bool:
     返回:
         bool: 设置是否成功
     """
-    global USER_MUSIC_PREFERENCE, STRESS_MUSIC_MAP
     if preference_keyword in VALID_PREFERENCES:
-        USER_MUSIC_PREFERENCE = preference_keyword
-        # 重新构建 STRESS_MUSIC_MAP，包含新的用户偏好
-        STRESS_MUSIC_MAP = _build_stress_music_map(_BASE_STRESS_MUSIC_MAP, USER_MUSIC_PREFERENCE)
-        # 同时更新持久化文件，以便下次启动时也能加载偏好
-        _save_persistent_map(STRESS_MUSIC_MAP)
+        try:
+            user_profiles.write_profile(user_profiles.DEFAULT_USER_ID, preference_keyword)
+        except Exception:
+            # 写入失败不应中断主流程
+            return False
         return True
     return False
 
@@ -295,7 +416,7 @@ def apply_user_music_preference(preference_keyword: str, hrv_ms: Optional[float]
     返回用于生成的 prompt 文本（逗号分隔）。
     如果没有传入 `hrv_ms`，会尝试读取 `latest_hrv.txt` 来判定当前压力等级。
     
-    注意：此函数已更新为使用 USER_MUSIC_PREFERENCE 变量。
+    注意：此函数修改的是默认档案的偏好。
     """
     # 设置用户偏好
     set_user_music_preference(preference_keyword)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+工具：对比推理后端（transformers / onnx）的生成延迟。
+
+每个后端用相同的 prompt 与生成参数（generation.GENERATION_KWARGS）生成 --tokens 个 token，
+重复 --repeat 次取中位数，报告总耗时、tokens/s 以及相对 transformers 的加速比。
+ONNX 后端需要先运行 tools/export_onnx.py。
+
+用法：
+    python tools/bench_backends.py
+    python tools/bench_backends.py --tokens 1250 --repeat 3 --onnx-dir /path/to/model/onnx
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推理后端延迟对比')
+    parser.add_argument('--model-path', default=None, help='模型目录，默认使用 generation.MODEL_PATH')
+    parser.add_argument('--onnx-dir', default=None, help='ONNX 导出目录，默认 generation.ONNX_DIR')
+    parser.add_argument('--tokens', type=int, default=250, help='每次生成的 token 数，默认 250（约 5 秒音频）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个后端重复次数，默认 3')
+    parser.add_argument('--backends', default='transformers,onnx', help='逗号分隔的后端列表')
+    args = parser.parse_args()
+
+    import generation
+    from stress import get_stress_music_prompt
+
+    if args.onnx_dir:
+        generation.ONNX_DIR = args.onnx_dir
+    prompt = get_stress_music_prompt(15.0)
+    results = {}
+    for name in args.backends.split(','):
+        name = name.strip()
+        if not generation.load_model(args.model_path or generation.MODEL_PATH, backend_name=name):
+            print(f"⚠️  {name:<12} 加载失败，跳过")
+            continue
+        if generation.backend.name != name:
+            print(f"⚠️  {name:<12} 加载失败（已回退到 {generation.backend.name}），跳过")
+            continue
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            generation.backend.generate(prompt, args.tokens, **generation.GENERATION_KWARGS)
+            samples.append(time.perf_counter() - started)
+        results[name] = statistics.median(samples)
+
+    baseline = results.get('transformers')
+    for name, seconds in results.items():
+        speedup = f"（{baseline / seconds:.2f}x）" if baseline and name != 'transformers' else ''
+        print(f"{name:<12} {seconds:8.2f} s  {args.tokens / seconds:8.1f} tokens/s{speedup}")
+    return 0 if results else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+工具：对比 eager 解码与加速解码（静态 KV 缓存 + torch.compile，见 generation.enable_accelerated_decoding）
+的解码速度（tokens/s）。
+
+先以 eager 模式生成若干次取中位数，再开启加速解码（首次会编译并写入磁盘缓存，耗时单独报告），
+用同样的 prompt 与 token 数再测一遍。加速解码开启失败时打印原因并以非零状态码退出。
+
+需要本地模型文件，只应在推理环境中运行。
+
+用法：
+    python tools/bench_decode.py
+    python tools/bench_decode.py --tokens 1250 --repeat 3 --model-path /path/to/model
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _tokens_per_second(generation, prompt, tokens, repeat):
+    import torch
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        with generation.model_lock, torch.inference_mode():
+            generation._generate(**generation._text_inputs(prompt), max_new_tokens=tokens,
+                                 **generation.GENERATION_KWARGS)
+        samples.append(time.perf_counter() - started)
+    return tokens / statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MusicGen 解码速度基准（eager vs. compiled）')
+    parser.add_argument('--model-path', default=None, help='模型目录，默认使用 generation.MODEL_PATH')
+    parser.add_argument('--tokens', type=int, default=250, help='每次生成的 token 数，默认 250（约 5 秒音频）')
+    parser.add_argument('--repeat', type=int, default=3, help='每种模式重复次数，默认 3')
+    args = parser.parse_args()
+
+    # 基准自己控制解码模式，加载模型时先保持 eager
+    os.environ['MUSICGEN_DECODE'] = 'eager'
+    import generation
+    from stress import get_stress_music_prompt
+
+    if not generation.load_model(args.model_path or generation.MODEL_PATH):
+        return 1
+    prompt = get_stress_music_prompt(15.0)
+
+    eager = _tokens_per_second(generation, prompt, args.tokens, args.repeat)
+    print(f"eager     {eager:8.1f} tokens/s")
+
+    if not generation.enable_accelerated_decoding('compiled', warmup_tokens=args.tokens):
+        print(f"❌ 加速解码开启失败: {generation.decode_status['error']}")
+        return 1
+    status = generation.decode_status
+    print(f"编译预热 {status['warmup_seconds']}s（静态 KV 缓存: {'是' if status['static_cache'] else '否'}）")
+
+    compiled = _tokens_per_second(generation, prompt, args.tokens, args.repeat)
+    if status['active'] != 'compiled':
+        print(f"❌ 加速解码在运行中回退到 eager: {status['error']}")
+        return 1
+    print(f"compiled  {compiled:8.1f} tokens/s（{compiled / eager:.2f}x）")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+工具：逐级测量后处理管线（dsp.py）的耗时。
+
+对一段音频（默认 5 分钟合成信号，或 --wav 指定的文件）分别单独运行每个处理级，再运行完整的
+母带处理链（Pipeline.profile() 给出链中各级的耗时），报告毫秒数与实时倍数（音频时长 / 处理耗时）。
+同时给出旧的整段处理方式（求均值去直流 + 全局峰值归一化）作为对照。只依赖 numpy / scipy。
+
+用法：
+    python tools/bench_dsp.py
+    python tools/bench_dsp.py --seconds 60 --block-size 4096
+    python tools/bench_dsp.py --wav generated_audio/<file_id>.wav
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import dsp
+
+
+def _load(args):
+    if args.wav:
+        from scipy.io import wavfile
+        sampling_rate, audio = wavfile.read(args.wav)
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        if audio.dtype == np.int16:
+            return audio.astype(np.float32) / 32768, sampling_rate
+        return audio.astype(np.float32), sampling_rate
+    sampling_rate = 32000
+    rng = np.random.default_rng(0)
+    t = np.arange(int(args.seconds * sampling_rate), dtype=np.float32) / sampling_rate
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t)).astype(np.float32) + 0.01
+    return audio.astype(np.float32), sampling_rate
+
+
+def _report(name, seconds, duration):
+    print(f"{name:<22} {seconds * 1000:9.1f} ms  {duration / max(seconds, 1e-9):9.0f}x 实时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后处理管线逐级耗时')
+    parser.add_argument('--wav', default=None, help='使用指定 WAV 文件，默认合成信号')
+    parser.add_argument('--seconds', type=float, default=300.0, help='合成信号时长（秒），默认 300')
+    parser.add_argument('--block-size', type=int, default=dsp.DEFAULT_BLOCK_SIZE, help='块大小（采样）')
+    args = parser.parse_args()
+
+    audio, sampling_rate = _load(args)
+    duration = len(audio) / sampling_rate
+    print(f"🎧 {duration:.1f}s @ {sampling_rate} Hz，块大小 {args.block_size}")
+
+    stages = {
+        'Sanitize': lambda: dsp.Sanitize(),
+        'DCBlocker': lambda: dsp.DCBlocker(sampling_rate),
+        'SOSFilter (lowpass)': lambda: dsp.SOSFilter.lowpass(sampling_rate, 1200),
+        'LoudnessNormalizer': lambda: dsp.LoudnessNormalizer(sampling_rate),
+        'LookaheadLimiter': lambda: dsp.LookaheadLimiter(sampling_rate),
+    }
+    for name, make in stages.items():
+        work = audio.copy()
+        started = time.perf_counter()
+        dsp.Pipeline([make()]).run(work, block_size=args.block_size, out=work)
+        _report(name, time.perf_counter() - started, duration)
+
+    started = time.perf_counter()
+    lufs = dsp.integrated_loudness(audio, sampling_rate)
+    _report('integrated_loudness', time.perf_counter() - started, duration)
+
+    work = audio.copy()
+    chain = dsp.mastering_chain(sampling_rate, initial_lufs=lufs)
+    started = time.perf_counter()
+    chain.run(work, block_size=args.block_size, out=work)
+    _report('mastering_chain', time.perf_counter() - started, duration)
+    for entry in chain.profile():
+        print(f"  └ {entry['stage']:<19} {entry['seconds'] * 1000:9.1f} ms")
+    print(f"  峰值 {20 * np.log10(max(np.abs(work).max(), 1e-9)):.2f} dBFS，"
+          f"响度 {lufs if lufs is None else round(lufs, 1)} -> {dsp.integrated_loudness(work, sampling_rate):.1f} LUFS")
+
+    # 对照：旧的整段处理（求均值去直流 + 全局峰值归一化）
+    work = audio.copy()
+    started = time.perf_counter()
+    work -= work.mean()
+    work *= 1.0 / max(float(work.max()), -float(work.min()), 1e-9)
+    _report('legacy (mean + peak)', time.perf_counter() - started, duration)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
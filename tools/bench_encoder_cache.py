@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+工具：测量文本编码器缓存（encoder_cache.py）对每次生成节省的耗时。
+
+对三个压力等级各取一个 prompt，分别测量：
+  - 未缓存：processor 分词 + T5 编码（含 CFG 无条件分支）的耗时；
+  - 缓存命中：直接取回编码器输出的耗时；
+  - 可选 --tokens N：用 N 个 token 的短生成做端到端对比（缓存 vs. 原始 processor 输入）。
+
+需要本地模型文件，只应在推理环境中运行。
+
+用法：
+    python tools/bench_encoder_cache.py
+    python tools/bench_encoder_cache.py --model-path /path/to/model --repeat 10 --tokens 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 各压力等级的代表 HRV（ms）
+SAMPLE_HRV = {'低': 40.0, '中': 27.0, '高': 15.0}
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='文本编码器缓存基准')
+    parser.add_argument('--model-path', default=None, help='模型目录，默认使用 generation.MODEL_PATH')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测量重复次数，默认 5')
+    parser.add_argument('--tokens', type=int, default=0, help='端到端短生成的 token 数，0 表示跳过（默认）')
+    args = parser.parse_args()
+
+    import torch
+    import generation
+    from encoder_cache import TextEncoderCache
+    from stress import get_stress_music_prompt
+
+    if not generation.load_model(args.model_path or generation.MODEL_PATH):
+        return 1
+    model, processor = generation.model, generation.processor
+    guidance_scale = generation.GENERATION_KWARGS['guidance_scale']
+
+    for level, hrv in SAMPLE_HRV.items():
+        prompt = get_stress_music_prompt(hrv)
+
+        def uncached():
+            # 每次都用新的缓存实例，等价于不使用缓存
+            TextEncoderCache().conditioning(model, processor, prompt, guidance_scale)
+
+        cache = TextEncoderCache()
+        cache.conditioning(model, processor, prompt, guidance_scale)
+        cold = _timed(uncached, args.repeat)
+        warm = _timed(lambda: cache.conditioning(model, processor, prompt, guidance_scale), args.repeat)
+        print(f"[{level}] 文本编码: 未缓存 {cold * 1000:8.1f} ms, 命中 {warm * 1000:6.2f} ms, "
+              f"每次生成节省 {(cold - warm) * 1000:8.1f} ms")
+
+        if args.tokens:
+            gen_kwargs = dict(max_new_tokens=args.tokens, **generation.GENERATION_KWARGS)
+            with torch.inference_mode():
+                base = _timed(lambda: model.generate(
+                    **processor(text=[prompt], padding=True, return_tensors="pt").to(model.device), **gen_kwargs
+                ), args.repeat)
+                cached = _timed(lambda: model.generate(
+                    **cache.conditioning(model, processor, prompt, guidance_scale), **gen_kwargs
+                ), args.repeat)
+            print(f"[{level}] {args.tokens} token 生成: 原始 {base:.2f} s, 缓存 {cached:.2f} s "
+                  f"（节省 {(base - cached) / base * 100:.1f}%）")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
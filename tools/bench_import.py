@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+工具：测量轻量入口（Web 层、HRV 工具脚本）的导入耗时，并检查它们没有顺带导入重依赖。
+
+每个模块在独立的子进程中导入（冷启动），重复多次取中位数；任一模块超过预算或导入了
+torch / transformers / scipy / numpy 时以非零状态码退出，便于在 CI 或提交前检查。
+
+用法：
+    python tools/bench_import.py
+    python tools/bench_import.py --budget 0.5 --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['torch', 'transformers', 'scipy', 'numpy']
+
+# (模块名, 额外环境变量)；app 以 Web 层角色导入（设置 INFERENCE_URL，不加载模型）
+TARGETS = [
+    ('stress', {}),
+    ('hrv_watcher', {}),
+    ('hrv_reader', {}),
+    ('app', {'INFERENCE_URL': 'http://127.0.0.1:9'}),
+    ('wsgi', {'INFERENCE_URL': 'http://127.0.0.1:9'}),
+]
+
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{'seconds': elapsed, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module, extra_env, cwd):
+    env = dict(os.environ)
+    env.update(extra_env)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    proc = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=120
+    )
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f'exit {proc.returncode}'
+    return json.loads(proc.stdout.strip().splitlines()[-1]), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='轻量入口导入耗时基准')
+    parser.add_argument('--budget', type=float, default=1.0, help='每个模块的导入耗时预算（秒），默认 1.0')
+    parser.add_argument('--repeat', type=int, default=3, help='每个模块重复测量次数，默认 3')
+    args = parser.parse_args()
+
+    failed = False
+    # 在临时目录中运行，避免 app 在仓库内创建 generated_audio/ 等文件
+    with tempfile.TemporaryDirectory() as cwd:
+        for module, extra_env in TARGETS:
+            samples = []
+            heavy = set()
+            error = None
+            for _ in range(args.repeat):
+                result, error = measure(module, extra_env, cwd)
+                if result is None:
+                    break
+                samples.append(result['seconds'])
+                heavy.update(result['heavy'])
+            if error:
+                print(f"⚠️  {module:<12} 导入失败: {error}")
+                failed = True
+                continue
+            median = statistics.median(samples)
+            ok = median <= args.budget and not heavy
+            failed = failed or not ok
+            note = f" 重依赖: {', '.join(sorted(heavy))}" if heavy else ''
+            print(f"{'✅' if ok else '❌'} {module:<12} {median * 1000:8.1f} ms{note}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
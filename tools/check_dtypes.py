@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+工具：检查音频热路径全程为 float32（最终输出为 int16），没有悄悄升级成 float64 的整段副本，
+并对比旧的 float64 处理方式（基线版本 generate_music_task 中的 lfilter / linspace / 除法归一化）节省的内存。
+
+1. dtype 检查：dsp.py 的每个处理级、母带处理链、render_loop、AudioBuffer / 混音器交叉淡化的输出
+   必须是 float32（编码结果为 int16），否则以非 0 状态退出；
+2. 峰值内存检查：用 tracemalloc 跟踪 render_loop（默认 25 秒片段 -> 5 分钟），峰值必须低于
+   float32 预算（float32 输出 + int16 输出 + 3 份原始片段 + 余量）。任何一份整段长度的 float64
+   临时数组（输出长度 × 8 字节）都会超出这个预算；
+3. 内存对比：同样的输入分别走 render_loop 与旧的 float64 路径，报告两者的峰值内存。
+
+只依赖 numpy / scipy（不需要 torch 与模型），可以在 CI 或提交前运行：
+    python tools/check_dtypes.py
+    python tools/check_dtypes.py --clip-seconds 30 --target-seconds 300
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import dsp
+import mixer
+from audio_buffer import AudioBuffer, as_float32, check_float32, to_int16
+
+# 预算中除输出与片段副本以外的余量（分块处理的临时数组、滤波器状态等）
+SLACK_BYTES = 4 * 1024 * 1024
+
+
+def _clip(seconds, sampling_rate, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sampling_rate), dtype=np.float32) / sampling_rate
+    audio = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t)).astype(np.float32) + 0.01
+    return check_float32(audio.astype(np.float32, copy=False), '测试信号')
+
+
+def _legacy_render_loop(audio_data, sampling_rate, target_duration=300):
+    """基线版本的后处理（只保留与内存相关的步骤）：numpy 默认行为在多处产生 float64"""
+    import scipy.signal
+    audio_data = audio_data - np.mean(audio_data)
+    b, a = scipy.signal.butter(4, 1200 / (sampling_rate / 2), 'low')
+    audio_data_lowpass = scipy.signal.lfilter(b, a, audio_data)  # float64
+    overlap_len = int(sampling_rate * 3.0)
+    t = np.linspace(0, 1, overlap_len)  # float64
+    fade_in, fade_out = np.sqrt(t), np.sqrt(1 - t)
+    segment_len = len(audio_data)
+    hop_len = segment_len - overlap_len
+    target_samples = int(target_duration * sampling_rate)
+    num_segments = int(np.ceil(target_samples / hop_len)) + 2
+    combined_audio = np.zeros(hop_len * num_segments + segment_len, dtype=np.float32)
+    for i in range(num_segments):
+        this_segment = (audio_data if i % 2 == 0 else audio_data_lowpass).copy()
+        if i > 0:
+            this_segment[:overlap_len] *= fade_in
+        if i < num_segments - 1:
+            this_segment[-overlap_len:] *= fade_out
+        start = i * hop_len
+        write_len = min(segment_len, len(combined_audio) - start)
+        if write_len > 0:
+            combined_audio[start:start + write_len] += this_segment[:write_len]
+    audio_data = combined_audio[:target_samples]
+    if np.isnan(audio_data).any() or np.isinf(audio_data).any():
+        audio_data = np.nan_to_num(audio_data)
+    audio_data = audio_data / np.max(np.abs(audio_data))
+    return (audio_data * 32767).clip(-32768, 32767).astype(np.int16)  # float64 整段副本
+
+
+def _traced(fn, *args):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        result = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def check_stages(sampling_rate, failures):
+    audio = _clip(5, sampling_rate)
+    stages = {
+        'Sanitize': dsp.Sanitize(),
+        'DCBlocker': dsp.DCBlocker(sampling_rate),
+        'SOSFilter': dsp.SOSFilter.lowpass(sampling_rate, 1200),
+        'LoudnessNormalizer': dsp.LoudnessNormalizer(sampling_rate),
+        'LookaheadLimiter': dsp.LookaheadLimiter(sampling_rate),
+        'mastering_chain': dsp.mastering_chain(sampling_rate),
+    }
+    for name, stage in stages.items():
+        pipeline = stage if isinstance(stage, dsp.Pipeline) else dsp.Pipeline([stage])
+        _expect(failures, name, pipeline.run(audio.copy()), np.float32)
+    _expect(failures, 'as_float32(int16)', as_float32(to_int16(audio.copy())), np.float32)
+    _expect(failures, 'as_float32(float64)', as_float32(audio.astype(np.float64)), np.float32)
+    _expect(failures, 'as_float32(stereo int16)', as_float32(np.zeros((2, 100), dtype=np.int16)), np.float32)
+    _expect(failures, 'master_to_int16', dsp.master_to_int16(audio.copy(), sampling_rate), np.int16)
+
+
+def check_mixer(sampling_rate, failures):
+    class _Library:
+        def touch(self, file_id):
+            pass
+
+    clip = AudioBuffer(_clip(3, sampling_rate), sampling_rate)
+    _expect(failures, 'AudioBuffer.samples', clip.samples, np.int16)
+    _expect(failures, 'AudioBuffer.float32', clip.float32(0, 1000), np.float32)
+    m = mixer.AdaptiveMixer(_Library(), '', hrv_fn=lambda: None, crossfade_seconds=0.5)
+    m.sampling_rate = sampling_rate
+    m._clips = {'低': [('a', clip)], '高': [('b', clip)]}
+    m._target, m._target_since = '低', 0.0
+    _expect(failures, 'mixer (playing)', m._render(1600), np.int16)
+    m._target = '高'
+    _expect(failures, 'mixer (crossfade)', m._render(1600), np.int16)
+
+
+def _expect(failures, name, array, dtype):
+    ok = getattr(array, 'dtype', None) == dtype
+    print(f"{'✅' if ok else '❌'} {name:<28} {getattr(array, 'dtype', type(array).__name__)}")
+    if not ok:
+        failures.append(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查音频热路径的 dtype 与峰值内存')
+    parser.add_argument('--sampling-rate', type=int, default=32000, help='采样率，默认 32000')
+    parser.add_argument('--clip-seconds', type=float, default=25.0, help='模型输出片段时长（秒），默认 25')
+    parser.add_argument('--target-seconds', type=float, default=300.0, help='拼接目标时长（秒），默认 300')
+    args = parser.parse_args()
+    sr = args.sampling_rate
+
+    failures = []
+    print("— dtype")
+    check_stages(sr, failures)
+    check_mixer(sr, failures)
+
+    print("— render_loop 峰值内存")
+    clip = _clip(args.clip_seconds, sr)
+    target_samples = int(args.target_seconds * sr)
+    result, peak = _traced(dsp.render_loop, clip.copy(), sr, args.target_seconds)
+    _expect(failures, 'render_loop', result, np.int16)
+    budget = target_samples * (4 + 2) + 3 * clip.nbytes + SLACK_BYTES
+    float64_copy = target_samples * 8
+    mb = 1024 * 1024
+    print(f"   峰值 {peak / mb:.1f} MB，float32 预算 {budget / mb:.1f} MB"
+          f"（一份整段 float64 副本为 {float64_copy / mb:.1f} MB）")
+    if peak > budget:
+        print("❌ render_loop 峰值超出 float32 预算，热路径上可能出现了 float64 副本")
+        failures.append('render_loop peak')
+
+    _, legacy_peak = _traced(_legacy_render_loop, clip.copy(), sr, args.target_seconds)
+    print(f"   旧的 float64 路径峰值 {legacy_peak / mb:.1f} MB，"
+          f"节省 {(legacy_peak - peak) / mb:.1f} MB（{1 - peak / legacy_peak:.0%}）")
+
+    if failures:
+        print(f"❌ {len(failures)} 项检查失败: {', '.join(failures)}")
+        return 1
+    print("🎉 全部通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
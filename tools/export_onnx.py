@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+工具：把本地 MusicGen 模型导出为 ONNX Runtime 后端（onnx_backend.py）使用的四个图。
+
+导出内容：
+  - text_encoder.onnx      T5 编码器 + enc_to_dec_proj 投影 + attention mask（与 MusicGen forward 一致）
+  - decoder.onnx           解码器首步（无 past），输出 logits 与 KV 缓存
+  - decoder_with_past.onnx 解码器增量步（输入 / 输出 KV 缓存）
+  - audio_decoder.onnx     EnCodec 解码器（codes -> 波形）
+  - musicgen_onnx.json     元数据；以及分词器文件
+
+导出后可用 tools/onnx_parity.py 检查数值一致性，用 tools/bench_backends.py 对比延迟。
+启用：MUSICGEN_BACKEND=onnx MUSICGEN_ONNX_DIR=<输出目录>
+
+用法：
+    python tools/export_onnx.py
+    python tools/export_onnx.py --model-path /path/to/model --out-dir /path/to/model/onnx --opset 17
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import torch
+from transformers import AutoProcessor, MusicgenForConditionalGeneration
+
+
+def _to_legacy(past):
+    return past.to_legacy_cache() if hasattr(past, 'to_legacy_cache') else past
+
+
+def _from_legacy(past):
+    """新版 transformers 的解码器只接受 Cache 对象，旧版接受 tuple"""
+    try:
+        from transformers.cache_utils import EncoderDecoderCache
+    except ImportError:
+        return past
+    return EncoderDecoderCache.from_legacy_cache(past)
+
+
+class TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        hidden = self.model.text_encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        if (self.model.text_encoder.config.hidden_size != self.model.decoder.config.hidden_size
+                and self.model.decoder.config.cross_attention_hidden_size is None):
+            hidden = self.model.enc_to_dec_proj(hidden)
+        return hidden * attention_mask[..., None]
+
+
+class Decoder(torch.nn.Module):
+    def __init__(self, model, num_layers):
+        super().__init__()
+        self.decoder = model.decoder
+        self.num_layers = num_layers
+
+    def forward(self, input_ids, encoder_hidden_states, encoder_attention_mask, *past_flat):
+        past = None
+        if past_flat:
+            past = _from_legacy(tuple(tuple(past_flat[4 * i:4 * i + 4]) for i in range(self.num_layers)))
+        out = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True,
+        )
+        present = _to_legacy(out.past_key_values)
+        return (out.logits,) + tuple(t for layer in present for t in layer)
+
+
+class AudioDecoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.audio_encoder = model.audio_encoder
+
+    def forward(self, audio_codes):
+        return self.audio_encoder.decode(audio_codes, [None]).audio_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出 MusicGen 的 ONNX 图')
+    parser.add_argument('--model-path', default=None, help='模型目录，默认使用 generation.MODEL_PATH')
+    parser.add_argument('--out-dir', default=None, help='输出目录，默认 <模型目录>/onnx')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset，默认 17')
+    args = parser.parse_args()
+
+    if args.model_path is None:
+        import generation
+        args.model_path = generation.MODEL_PATH
+    out_dir = args.out_dir or os.path.join(args.model_path, 'onnx')
+    os.makedirs(out_dir, exist_ok=True)
+
+    processor = AutoProcessor.from_pretrained(args.model_path)
+    model = MusicgenForConditionalGeneration.from_pretrained(args.model_path).eval()
+    config = model.config
+    num_codebooks = config.decoder.num_codebooks
+    num_layers = config.decoder.num_hidden_layers
+    heads = config.decoder.num_attention_heads
+    head_dim = config.decoder.hidden_size // heads
+
+    # 示例输入（CFG 批大小为 2）
+    enc = processor(text=['warm piano, slow tempo'], padding=True, return_tensors='pt')
+    input_ids, attention_mask = enc['input_ids'], enc['attention_mask']
+    start = torch.full((2 * num_codebooks, 1), config.decoder.decoder_start_token_id, dtype=torch.long)
+
+    past_names = [f'present.{i}.{j}' for i in range(num_layers) for j in range(4)]
+    past_inputs = [f'past.{i}.{j}' for i in range(num_layers) for j in range(4)]
+    common = dict(opset_version=args.opset, do_constant_folding=True)
+
+    with torch.inference_mode():
+        text_encoder = TextEncoder(model)
+        torch.onnx.export(
+            text_encoder, (input_ids, attention_mask), os.path.join(out_dir, 'text_encoder.onnx'),
+            input_names=['input_ids', 'attention_mask'], output_names=['encoder_hidden_states'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'text_len'}, 'attention_mask': {0: 'batch', 1: 'text_len'},
+                          'encoder_hidden_states': {0: 'batch', 1: 'text_len'}},
+            **common
+        )
+        print("✅ text_encoder.onnx")
+
+        hidden = text_encoder(input_ids, attention_mask)
+        hidden = torch.cat([hidden, torch.zeros_like(hidden)], dim=0)
+        mask = torch.cat([attention_mask, torch.zeros_like(attention_mask)], dim=0)
+
+        decoder = Decoder(model, num_layers)
+        seq_axes = {'input_ids': {0: 'batch_codebooks'},
+                    'encoder_hidden_states': {0: 'batch', 1: 'text_len'},
+                    'encoder_attention_mask': {0: 'batch', 1: 'text_len'},
+                    'logits': {0: 'batch_codebooks'}}
+        # 自注意力缓存随步数增长，交叉注意力缓存长度为文本长度
+        for i in range(num_layers):
+            for j in range(4):
+                length = 'past_len' if j < 2 else 'text_len'
+                seq_axes[f'present.{i}.{j}'] = {0: 'batch', 2: 'present_len' if j < 2 else 'text_len'}
+                seq_axes[f'past.{i}.{j}'] = {0: 'batch', 2: length}
+        torch.onnx.export(
+            decoder, (start, hidden, mask), os.path.join(out_dir, 'decoder.onnx'),
+            input_names=['input_ids', 'encoder_hidden_states', 'encoder_attention_mask'],
+            output_names=['logits'] + past_names,
+            dynamic_axes={k: v for k, v in seq_axes.items() if not k.startswith('past.')},
+            **common
+        )
+        print("✅ decoder.onnx")
+
+        first = decoder(start, hidden, mask)
+        past = first[1:]
+        torch.onnx.export(
+            decoder, (start, hidden, mask) + tuple(past), os.path.join(out_dir, 'decoder_with_past.onnx'),
+            input_names=['input_ids', 'encoder_hidden_states', 'encoder_attention_mask'] + past_inputs,
+            output_names=['logits'] + past_names,
+            dynamic_axes=seq_axes,
+            **common
+        )
+        print("✅ decoder_with_past.onnx")
+
+        codes = torch.zeros((1, 1, num_codebooks, 50), dtype=torch.long)
+        torch.onnx.export(
+            AudioDecoder(model), (codes,), os.path.join(out_dir, 'audio_decoder.onnx'),
+            input_names=['audio_codes'], output_names=['audio_values'],
+            dynamic_axes={'audio_codes': {3: 'frames'}, 'audio_values': {2: 'samples'}},
+            **common
+        )
+        print("✅ audio_decoder.onnx")
+
+    generation_config = model.generation_config
+    meta = {
+        'num_codebooks': num_codebooks,
+        'num_layers': num_layers,
+        'num_heads': heads,
+        'head_dim': head_dim,
+        'pad_token_id': config.decoder.pad_token_id,
+        'decoder_start_token_id': config.decoder.decoder_start_token_id,
+        'sampling_rate': config.audio_encoder.sampling_rate,
+        'frame_rate': getattr(config.audio_encoder, 'frame_rate', 50),
+        'top_k': getattr(generation_config, 'top_k', None) or 0,
+        'past_names': past_inputs,
+        'source_model': os.path.abspath(args.model_path),
+        'opset': args.opset,
+    }
+    with open(os.path.join(out_dir, 'musicgen_onnx.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    processor.tokenizer.save_pretrained(out_dir)
+    print(f"🎉 导出完成: {out_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
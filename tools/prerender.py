@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+工具：离线预生成（pre-render farm）。枚举 `get_stress_music_prompt` 能产生的全部 prompt，
+每个 prompt 生成 K 个变体写入音频库，线上 /api/generate-music 遇到相同 prompt 时直接复用
+（见 app.REUSE_RENDERED_AUDIO），几乎不再需要实时推理。
+
+prompt 空间：压力等级 × 音乐偏好（None + VALID_PREFERENCES）× 目标 BPM（由 --min-bpm..--max-bpm 范围内的
+用户心率经 get_target_bpm 得到，速度档位由目标 BPM 决定），相同的 prompt 只生成一次。
+
+- 用 multiprocessing（spawn）进程池并行生成，每个进程加载一次模型；进程数默认按 CPU 核数 / --threads
+  与物理内存 / --worker-memory-gb 取较小值（GPU / MPS 上建议 --workers 1）；
+- 可断点续跑：每个 (prompt, 变体) 的 file_id 由内容决定（uuid5），已在库中且文件存在的直接跳过；
+  生成先写入 .wav.part 再原子重命名（wav_io.WavWriter），中断后不会留下半个文件；
+- 结果连同压力等级、偏好、目标 BPM、变体序号与生成耗时登记到音频库（generated_audio/library.db）。
+
+注意：完整的 prompt 空间很大（每个片段约 19 MB），请先用 --dry-run 查看数量，并相应调大
+MAX_AUDIO_BYTES / MAX_AUDIO_FILES，否则服务端的后台淘汰会删除预生成的片段。超出预算时脚本拒绝生成，
+除非缩小范围、调大预算或加 --force。
+
+用法：
+    python tools/prerender.py --dry-run
+    python tools/prerender.py --variants 3
+    python tools/prerender.py --levels 高 --preferences none,jazz --min-bpm 60 --max-bpm 100 --workers 2
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stress
+from audio_library import AudioLibrary
+from wav_io import PART_SUFFIX, content_hash
+
+AUDIO_DIR = os.path.join(ROOT, 'generated_audio')
+# 每个 (prompt, 变体) 的 file_id 由内容决定，保证重跑时能识别已完成的任务
+FILE_ID_NAMESPACE = uuid.UUID('5b0a8f0e-3c1d-4f7e-9a52-6d1f0c2b7e41')
+# 5 分钟单声道 16-bit、32 kHz 的片段大小（仅用于 --dry-run 的估算）
+ESTIMATED_CLIP_BYTES = 300 * 32000 * 2
+
+
+def enumerate_prompts(levels, preferences, min_bpm, max_bpm):
+    """枚举 (压力等级, 偏好, 目标 BPM) 组合对应的 prompt，按 prompt 去重"""
+    seen = set()
+    for preference in preferences:
+        for level in levels:
+            target_bpms = sorted({stress.get_target_bpm(level, bpm) for bpm in range(min_bpm, max_bpm + 1)})
+            for target_bpm in target_bpms:
+                prompt = stress.build_stress_music_prompt(level, target_bpm, preference)
+                if prompt in seen:
+                    continue
+                seen.add(prompt)
+                yield {'prompt': prompt, 'stress_level': level, 'preference': preference, 'target_bpm': target_bpm}
+
+
+def default_workers(threads, worker_memory_gb):
+    """按 CPU 核数与物理内存估算进程数（每个进程独占一份模型）"""
+    by_cpu = max(1, (os.cpu_count() or 1) // max(1, threads))
+    try:
+        total_gb = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+        by_memory = max(1, int(total_gb // worker_memory_gb))
+    except (ValueError, OSError, AttributeError):
+        by_memory = by_cpu
+    return min(by_cpu, by_memory)
+
+
+def _init_worker(model_path, threads):
+    import torch
+    import generation
+    torch.set_num_threads(threads)
+    # 加载失败时不在初始化函数中抛出（进程池会不断重建进程），由 _render_job 报告
+    generation.load_model(model_path or generation.MODEL_PATH)
+
+
+def _render_job(job):
+    import generation
+    if generation.backend is None:
+        return dict(job, error='模型加载失败')
+    started = time.time()
+    path = os.path.join(AUDIO_DIR, f"{job['file_id']}.wav")
+    try:
+        # render_music 先写 .wav.part，完成后才原子重命名为 path
+        generation.render_music(job['prompt'], path)
+    except Exception as e:
+        return dict(job, error=str(e))
+    return dict(job, size_bytes=os.path.getsize(path), cost_seconds=time.time() - started,
+                content_hash=content_hash(path))
+
+
+def _register(library, job, size_bytes=None, cost_seconds=None):
+    library.add(job['file_id'], prompt=job['prompt'], stress_level=job['stress_level'], size_bytes=size_bytes,
+                cost_seconds=cost_seconds, preference=job['preference'], target_bpm=job['target_bpm'],
+                variant=job['variant'], content_hash=job.get('content_hash'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线预生成全部 prompt 的音乐片段')
+    parser.add_argument('--variants', type=int, default=2, help='每个 prompt 生成的变体数，默认 2')
+    parser.add_argument('--levels', default='低,中,高', help='逗号分隔的压力等级，默认全部')
+    parser.add_argument('--preferences', default=None,
+                        help='逗号分隔的偏好（none 表示未设置偏好），默认 none + 全部 VALID_PREFERENCES')
+    parser.add_argument('--min-bpm', type=int, default=55, help='用户心率下限，默认 55')
+    parser.add_argument('--max-bpm', type=int, default=110, help='用户心率上限，默认 110')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认按 CPU 与内存自动估算')
+    parser.add_argument('--threads', type=int, default=4, help='每个进程的 torch 线程数，默认 4')
+    parser.add_argument('--worker-memory-gb', type=float, default=4.0, help='每个进程的内存估算（GB），默认 4')
+    parser.add_argument('--model-path', default=None, help='模型目录，默认使用 generation.MODEL_PATH')
+    parser.add_argument('--dry-run', action='store_true', help='只列出数量与存储估算，不生成')
+    parser.add_argument('--force', action='store_true',
+                        help='预生成结果超出音频库预算（MAX_AUDIO_BYTES / MAX_AUDIO_FILES）时仍然生成')
+    args = parser.parse_args()
+
+    levels = [lv.strip() for lv in args.levels.split(',') if lv.strip()]
+    if args.preferences is None:
+        preferences = [None] + list(stress.VALID_PREFERENCES)
+    else:
+        preferences = [None if p.strip().lower() == 'none' else p.strip() for p in args.preferences.split(',')]
+    unknown = [p for p in preferences if p is not None and p not in stress.VALID_PREFERENCES]
+    if unknown:
+        parser.error(f"未知的偏好: {', '.join(unknown)}")
+
+    prompts = list(enumerate_prompts(levels, preferences, args.min_bpm, args.max_bpm))
+    buckets = Counter(stress.get_tempo_bucket(p['target_bpm']) for p in prompts)
+    print(f"🎼 prompt 数: {len(prompts)}（{', '.join(f'{k} {v}' for k, v in sorted(buckets.items()))}），"
+          f"每个 {args.variants} 个变体")
+
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    library = AudioLibrary(os.path.join(AUDIO_DIR, 'library.db'), AUDIO_DIR)
+    pending, done, recovered = [], 0, 0
+    for p in prompts:
+        for variant in range(args.variants):
+            file_id = str(uuid.uuid5(FILE_ID_NAMESPACE, f"{p['prompt']}\n{variant}"))
+            job = dict(p, variant=variant, file_id=file_id)
+            if os.path.exists(library.audio_path(file_id)):
+                if library.get(file_id) is None:
+                    # 文件已写完但登记前被中断
+                    _register(library, job)
+                    recovered += 1
+                done += 1
+            else:
+                # 清理本任务上次中断留下的临时文件（只删除本次要生成的 file_id 的：同一目录中
+                # 还有服务端正在写入、边写边播放的 .wav.part）
+                part_path = library.audio_path(file_id) + PART_SUFFIX
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                pending.append(job)
+
+    total = done + len(pending)
+    print(f"📦 已完成 {done}/{total}（补登 {recovered}），待生成 {len(pending)}，"
+          f"预计新增约 {len(pending) * ESTIMATED_CLIP_BYTES / 1024 ** 3:.1f} GB")
+    budget_bytes = int(os.environ.get('MAX_AUDIO_BYTES', 1024 * 1024 * 1024))
+    budget_files = int(os.environ.get('MAX_AUDIO_FILES', 500))
+    over_budget = total * ESTIMATED_CLIP_BYTES > budget_bytes or total > budget_files
+    if over_budget:
+        print(f"⚠️  预生成结果超出音频库预算（MAX_AUDIO_BYTES={budget_bytes}, MAX_AUDIO_FILES={budget_files}），"
+              f"服务端的后台淘汰会删除部分片段")
+    if args.dry_run or not pending:
+        return 0
+    if over_budget and not args.force:
+        # 超出预算的部分生成后很快会被淘汰，白白耗费数小时 CPU
+        print(f"❌ 已停止：请调大服务端与本脚本的 MAX_AUDIO_BYTES（至少约 "
+              f"{total * ESTIMATED_CLIP_BYTES / 1024 ** 3:.1f} GB）与 MAX_AUDIO_FILES（至少 {total}），"
+              f"或用 --levels / --preferences / --min-bpm / --max-bpm / --variants 缩小范围；"
+              f"确认要继续请加 --force")
+        return 2
+
+    workers = args.workers or default_workers(args.threads, args.worker_memory_gb)
+    workers = max(1, min(workers, len(pending)))
+    print(f"🚀 使用 {workers} 个进程（每个 {args.threads} 线程）开始生成...")
+    started = time.time()
+    failed = 0
+    ctx = multiprocessing.get_context('spawn')
+    pool = ctx.Pool(workers, initializer=_init_worker, initargs=(args.model_path, args.threads))
+    try:
+        for i, result in enumerate(pool.imap_unordered(_render_job, pending), 1):
+            if result.get('error'):
+                failed += 1
+                print(f"❌ [{i}/{len(pending)}] {result['prompt']} #{result['variant']}: {result['error']}")
+                continue
+            _register(library, result, result['size_bytes'], result['cost_seconds'])
+            elapsed = time.time() - started
+            eta = elapsed / i * (len(pending) - i)
+            print(f"✅ [{i}/{len(pending)}] {result['stress_level']} {result['preference'] or '-'} "
+                  f"{result['target_bpm']} bpm #{result['variant']}（{result['cost_seconds']:.0f}s，剩余约 {eta / 60:.0f} 分钟）")
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print("⏹️  已中断，重新运行同一命令即可从断点继续")
+        return 130
+    finally:
+        pool.join()
+
+    print(f"🎉 完成: 新增 {len(pending) - failed}，失败 {failed}，耗时 {(time.time() - started) / 60:.1f} 分钟")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+trigger.py
+
+基于迟滞（hysteresis）与驻留时间（dwell）的音乐重新生成触发引擎。
+
+只有在以下情况才触发一次重新生成：
+  1. 由 `hrv_to_stress_level` 得到的压力等级发生变化，且 HRV 越过阈值的幅度超过迟滞带宽
+     （避免 HRV 在 20 / 35 ms 附近抖动时来回切换）；
+  2. 或者 BPM 的变化足以改变 `get_stress_music_prompt` 使用的速度档位（slow / moderate / fast）。
+并且新的状态需要连续保持 `dwell_seconds` 秒才会被确认。其余的 HRV 更新都会被抑制并计数。
+
+用法示例：
+    trig = RegenerationTrigger(hysteresis_ms=2.0, dwell_seconds=10.0)
+    fire, reason = trig.update(hrv_ms, bpm)
+    if fire:
+        generate()
+"""
+
+import math
+import time
+
+from stress import hrv_to_stress_level, get_target_bpm, get_tempo_bucket
+
+
+# 压力等级从低到高的顺序
+_STRESS_ORDER = {'低': 0, '中': 1, '高': 2}
+
+
+class RegenerationTrigger:
+    def __init__(self, hysteresis_ms=2.0, dwell_seconds=10.0, clock=time.monotonic):
+        self.hysteresis_ms = hysteresis_ms
+        self.dwell_seconds = dwell_seconds
+        self.clock = clock
+        # 已确认（最近一次触发生成时）的状态：(压力等级, 速度档位)
+        self.committed = None
+        # 正在观察中的候选状态及其首次出现时间
+        self._candidate = None
+        self._candidate_since = None
+        self.stats = {'updates': 0, 'triggered': 0, 'suppressed': 0}
+
+    def _stress_level(self, hrv_ms):
+        """带迟滞的压力等级：HRV 需要越过阈值至少 hysteresis_ms 才认为等级改变。
+
+        做法是把 HRV 朝当前等级方向回退 hysteresis_ms 后再判定等级。
+        """
+        raw = hrv_to_stress_level(hrv_ms)
+        if self.committed is None:
+            return raw
+        current = self.committed[0]
+        # 读不到 HRV（文件正在写入等）时保持当前等级
+        if hrv_ms is None or raw == current:
+            return current
+        # HRV 越高压力越低：等级变低说明 HRV 上升，需向下回退，反之向上回退
+        if _STRESS_ORDER[raw] < _STRESS_ORDER[current]:
+            return hrv_to_stress_level(float(hrv_ms) - self.hysteresis_ms)
+        return hrv_to_stress_level(float(hrv_ms) + self.hysteresis_ms)
+
+    def update(self, hrv_ms, bpm=None, now=None):
+        """输入最新的 HRV（ms）与 BPM，返回 (是否触发, 原因)。"""
+        now = self.clock() if now is None else now
+        self.stats['updates'] += 1
+
+        level = self._stress_level(hrv_ms)
+        # 传感器文件中可能出现 nan / inf：当作没有 BPM（int() 会抛出 ValueError / OverflowError）
+        if bpm is not None and not math.isfinite(bpm):
+            bpm = None
+        bucket = get_tempo_bucket(get_target_bpm(level, int(bpm))) if bpm is not None else None
+        state = (level, bucket)
+
+        if self.committed is None:
+            return self._fire(state, 'initial')
+
+        # 速度档位未知（没有 BPM）时沿用已确认的档位
+        if bucket is None:
+            state = (level, self.committed[1])
+        if state == self.committed:
+            self._candidate = None
+            return self._suppress('unchanged')
+
+        if state != self._candidate:
+            self._candidate = state
+            self._candidate_since = now
+        if now - self._candidate_since < self.dwell_seconds:
+            return self._suppress('dwell')
+
+        reason = 'stress_level' if state[0] != self.committed[0] else 'tempo_bucket'
+        return self._fire(state, reason)
+
+    @property
+    def pending(self):
+        """是否有正在等待驻留时间的候选状态"""
+        return self._candidate is not None
+
+    def recheck(self, now=None):
+        """没有新数据时检查候选状态是否已保持足够久（供事件驱动的监听器定时调用），不计入更新 / 抑制次数。"""
+        now = self.clock() if now is None else now
+        if self._candidate is None:
+            return False, 'unchanged'
+        if now - self._candidate_since < self.dwell_seconds:
+            return False, 'dwell'
+        state = self._candidate
+        reason = 'stress_level' if state[0] != self.committed[0] else 'tempo_bucket'
+        return self._fire(state, reason)
+
+    def _fire(self, state, reason):
+        self.committed = state
+        self._candidate = None
+        self._candidate_since = None
+        self.stats['triggered'] += 1
+        return True, reason
+
+    def _suppress(self, reason):
+        self.stats['suppressed'] += 1
+        return False, reason
+
+    def summary(self):
+        s = self.stats
+        return f"更新 {s['updates']} 次，触发生成 {s['triggered']} 次，抑制 {s['suppressed']} 次"
@@ -0,0 +1,222 @@
+"""
+user_profiles.py
+
+按用户保存的音乐偏好档案，代替 stress.py 中所有请求共享的模块全局变量 `USER_MUSIC_PREFERENCE`：
+共享服务器上每个浏览器各自的偏好互不覆盖，生成 prompt 时显式传入档案（stress.get_stress_music_prompt）。
+
+- 每个浏览器由 cookie `sm_user`（脚本也可以用请求头 `X-User-Id`）标识，首次请求时分配随机 user_id；
+- 读：`get()` 返回内存中的只读快照（UserProfile），命中时只是一次 dict 查找，不读盘；
+  不在内存中的用户从 SQLite 加载；内存中最多保留 max_profiles 个最近使用的档案（LRU，
+  未写入的修改保留到写入之后），库中不存在的用户不缓存（匿名访客每人一个新 id，缓存会无限增长）；
+- 写：`set_preference()` 立即替换内存中的快照并标记为脏，由后台线程等待 flush_interval 秒后合并成
+  一次事务写入（同一用户的多次修改只写最后一次），退出前 `flush()` 写入剩余的修改；
+- 没有设置过偏好的用户沿用默认档案（DEFAULT_USER_ID）的偏好：命令行工具（hrv_watcher.py、music.py）
+  和单用户部署使用的就是它，首次启动时从旧版本的 stress_music_map.json 迁移。
+
+SQLite 使用 WAL 模式，命令行进程可以用 `read_profile()` / `write_profile()` 直接读写同一个库
+（Web 进程已加载到内存中的档案以本进程为准，其它进程直接写库的修改在重启后可见）。
+
+用法示例：
+    profiles = UserProfileStore('generated_audio/profiles.db')
+    profiles.start()
+    profiles.set_preference(user_id, 'jazz')
+    prompt = stress.get_stress_music_prompt(profile=profiles.get(user_id))
+"""
+
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 命令行工具与旧版本单用户部署使用的默认档案
+DEFAULT_USER_ID = 'default'
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_audio', 'profiles.db')
+USER_COOKIE = 'sm_user'
+USER_HEADER = 'X-User-Id'
+# 合并写入的等待时间（秒）
+FLUSH_INTERVAL = 2.0
+# 内存中最多保留的档案数
+MAX_PROFILES = 10000
+
+_USER_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_profiles (
+    user_id     TEXT PRIMARY KEY,
+    preference  TEXT,
+    updated_at  REAL NOT NULL
+);
+"""
+
+
+def valid_user_id(user_id):
+    """cookie / 请求头中的 user_id 只接受字母、数字、下划线与连字符"""
+    return isinstance(user_id, str) and _USER_ID_RE.match(user_id) is not None
+
+
+class UserProfile:
+    """一个用户的偏好档案快照。创建后不再修改，修改偏好时整体替换为新的对象，并发读取无需加锁。"""
+
+    __slots__ = ('user_id', 'preference', 'updated_at')
+
+    def __init__(self, user_id, preference=None, updated_at=None):
+        self.user_id = user_id
+        self.preference = preference
+        self.updated_at = updated_at
+
+    def to_dict(self):
+        return {'user_id': self.user_id, 'preference': self.preference, 'updated_at': self.updated_at}
+
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _select(conn, user_id):
+    row = conn.execute(
+        "SELECT user_id, preference, updated_at FROM user_profiles WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return UserProfile(*row) if row is not None else None
+
+
+def read_profile(user_id=DEFAULT_USER_ID, db_path=DEFAULT_DB_PATH):
+    """不经过缓存直接从库中读取一个档案（命令行进程使用），不存在时返回 None"""
+    if not os.path.exists(db_path):
+        return None
+    conn = _connect(db_path)
+    try:
+        return _select(conn, user_id)
+    finally:
+        conn.close()
+
+
+def write_profile(user_id, preference, db_path=DEFAULT_DB_PATH):
+    """直接写入一个档案（命令行进程使用；Web 进程请使用 UserProfileStore.set_preference）"""
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_profiles (user_id, preference, updated_at) VALUES (?, ?, ?)",
+                (user_id, preference, time.time())
+            )
+    finally:
+        conn.close()
+
+
+class UserProfileStore:
+    """按用户的偏好档案：内存快照读，后台批量写。所有方法都是线程安全的。
+
+    default_preference 只在库中还没有默认档案时写入（迁移旧版本的全局偏好）。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, default_preference=None, flush_interval=FLUSH_INTERVAL,
+                 max_profiles=MAX_PROFILES):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()  # user_id -> UserProfile，按最近使用排序
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._conn = _connect(db_path)
+        if default_preference is not None:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO user_profiles (user_id, preference, updated_at) VALUES (?, ?, ?)",
+                    (DEFAULT_USER_ID, default_preference, time.time())
+                )
+        self.stats = {'reads': 0, 'loads': 0, 'writes': 0, 'flushes': 0}
+
+    def start(self):
+        """启动后台写入线程，并在进程退出时写入剩余的修改"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='profile-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _evict(self):
+        """超出上限时淘汰最久未使用的档案，未写入的修改保留到写入之后（调用方持有锁）"""
+        excess = len(self._profiles) - self.max_profiles
+        if excess <= 0:
+            return
+        victims = []
+        for user_id in self._profiles:
+            if len(victims) >= excess:
+                break
+            if user_id not in self._dirty:
+                victims.append(user_id)
+        for user_id in victims:
+            del self._profiles[user_id]
+
+    def _lookup(self, user_id):
+        """内存中的档案，不在内存中时从库中加载；库中没有时返回 None（不缓存）"""
+        with self._lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                self._profiles.move_to_end(user_id)
+                return profile
+            profile = _select(self._conn, user_id)
+            self.stats['loads'] += 1
+            if profile is not None:
+                self._profiles[user_id] = profile
+                self._evict()
+            return profile
+
+    def get(self, user_id):
+        """返回用户的档案快照；用户没有设置过偏好时沿用默认档案的偏好"""
+        self.stats['reads'] += 1
+        profile = self._lookup(user_id)
+        if profile is not None and profile.preference is not None:
+            return profile
+        default = self._lookup(DEFAULT_USER_ID) if user_id != DEFAULT_USER_ID else None
+        return UserProfile(user_id, default.preference if default is not None else None)
+
+    def set_preference(self, user_id, preference):
+        """修改用户偏好：内存中立即生效，磁盘写入由后台线程合并完成。返回新的档案快照"""
+        profile = UserProfile(user_id, preference, time.time())
+        with self._lock:
+            self._profiles[user_id] = profile
+            self._profiles.move_to_end(user_id)
+            self._dirty.add(user_id)
+            self._evict()
+        self._wakeup.set()
+        if self._thread is None:
+            # 没有后台线程（例如命令行中直接使用）时同步写入
+            self.flush()
+        return profile
+
+    def flush(self):
+        """把所有未写入的修改一次事务写入库中，返回写入的档案数"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = [(p.user_id, p.preference, p.updated_at)
+                    for p in (self._profiles[user_id] for user_id in self._dirty)]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO user_profiles (user_id, preference, updated_at) VALUES (?, ?, ?)", rows
+                )
+            self._dirty.clear()
+            self._evict()
+            self.stats['writes'] += len(rows)
+            self.stats['flushes'] += 1
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # 等待一段时间，把这期间的修改合并成一次写入
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"写入用户偏好时出错: {e}")
@@ -0,0 +1,180 @@
+"""
+wav_io.py
+
+16-bit 单声道 WAV 的增量写入、原子发布与边写边读。只依赖标准库，Web 层可以直接导入。
+
+- WavWriter：边处理边把 int16 块追加到 <path>.part，完成后回填文件头并 os.replace 到 <path>，
+  并发的 /api/audio 请求永远看不到写了一半的 <path>；出错时删除临时文件；
+- write_wav(path, samples, sr)：一次性写入的简写（同样经过 .part + 原子重命名）；
+- follow_wav(path)：逐块读出正在写入的 <path>.part（已写入的前缀），写入完成后读完剩余数据即结束，
+  用于生成尚未完成时的边写边播；
+- wav_stream_header()：WAV 文件头，不给长度时是不定长流（连续配乐、混音器的实时流也使用它）；
+- ExclusiveStream：独占的实时流（连续配乐、混音器同一时间只允许一个收听连接），关闭时释放占用；
+- content_hash(path)：已发布文件的内容哈希（BLAKE2b），/api/audio 用作强 ETag。
+
+用法示例：
+    with WavWriter(path, sampling_rate) as writer:
+        for block in blocks:
+            writer.write(block)          # int16
+"""
+
+import hashlib
+import os
+import struct
+import time
+
+
+# 写入中的临时文件后缀（tools/prerender.py 启动时、音频库对账时清理残留的 .wav.part）
+PART_SUFFIX = '.part'
+# 与 <file_id>.wav 一起保存的预计算概览（overview.py），随音频一起淘汰
+OVERVIEW_SUFFIX = '.overview'
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def wav_stream_header(sampling_rate, channels=1, bits_per_sample=16, data_bytes=None):
+    """WAV 头。data_bytes 为 None 时是不定长流：RIFF / data 长度填 0xFFFFFFFF，浏览器会一直读到连接关闭"""
+    byte_rate = sampling_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    riff_size = _UNKNOWN_SIZE if data_bytes is None else 36 + data_bytes
+    data_size = _UNKNOWN_SIZE if data_bytes is None else data_bytes
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sampling_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+class ExclusiveStream:
+    """包装一条已占用 lock 的字节流，close() 时关闭底层生成器并释放 lock。
+
+    WSGI 服务器在响应结束（包括客户端断开、生成器从未开始迭代）时都会调用 close()，
+    所以占用不会因为连接没读到第一个字节就一直不释放。
+    """
+
+    def __init__(self, chunks, lock):
+        self._chunks = chunks
+        self._lock = lock
+        self._closed = False
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._chunks.close()
+        finally:
+            self._lock.release()
+
+
+class WavWriter:
+    """增量写入单声道 16-bit WAV，完成时原子发布。
+
+    数据先写到 <path>.part，文件头的长度字段先填 0xFFFFFFFF（此时 .part 的任意前缀都是一条合法的
+    不定长 WAV 流，可以被 follow_wav 边写边读）；close() 回填真实长度、fsync 后 os.replace 到 <path>。
+    中途出错（或在 with 块中抛出异常）时 abort() 删除临时文件，<path> 不会出现。
+    """
+
+    def __init__(self, path, sampling_rate):
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.sampling_rate = int(sampling_rate)
+        self.frames = 0
+        self._file = open(self.part_path, 'wb')
+        self._file.write(wav_stream_header(self.sampling_rate))
+        self._file.flush()
+
+    def write(self, samples):
+        """追加一块 int16 采样（numpy 数组），并立即 flush 让读取方看到"""
+        dtype = getattr(samples, 'dtype', None)
+        if dtype is None or str(dtype) != 'int16':
+            raise TypeError(f"WavWriter 只接受 int16 采样，实际为 {dtype}（float32 先经过 audio_buffer.to_int16）")
+        self._file.write(samples.tobytes())
+        self._file.flush()
+        self.frames += len(samples)
+
+    def close(self):
+        """回填文件头并原子发布到 path；已关闭时什么都不做"""
+        if self._file is None:
+            return
+        try:
+            self._file.seek(0)
+            self._file.write(wav_stream_header(self.sampling_rate, data_bytes=self.frames * 2))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except BaseException:
+            self.abort()
+            raise
+        self._file.close()
+        self._file = None
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        """放弃写入：关闭并删除临时文件"""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_wav(path, samples, sampling_rate):
+    """一次性写入 int16 WAV（同样经过 .part + 原子重命名）"""
+    with WavWriter(path, sampling_rate) as writer:
+        writer.write(samples)
+
+
+def follow_wav(path, chunk_bytes=64 * 1024, poll_seconds=0.1, idle_timeout=30.0):
+    """返回一个生成器，逐块产出正在由 WavWriter 写入的 <path>.part 的内容（从文件头开始）。
+
+    .part 在调用时立即打开，不存在时抛出 FileNotFoundError（调用方可以改为直接返回已发布的 path）。
+    写入方发布（重命名）后，已打开的文件句柄仍指向同一文件，读完剩余数据即结束；写入方放弃
+    或超过 idle_timeout 秒没有新数据时也结束。
+    """
+    part_path = path + PART_SUFFIX
+    f = open(part_path, 'rb')
+    return _follow(f, part_path, chunk_bytes, poll_seconds, idle_timeout)
+
+
+def _follow(f, part_path, chunk_bytes, poll_seconds, idle_timeout):
+    with f:
+        idle_since = time.monotonic()
+        while True:
+            chunk = f.read(chunk_bytes)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+                continue
+            if not os.path.exists(part_path):
+                # 已发布或已放弃：close() 在重命名之前写完了全部数据，读到 EOF 即可
+                rest = f.read()
+                if rest:
+                    yield rest
+                return
+            if time.monotonic() - idle_since > idle_timeout:
+                return
+            time.sleep(poll_seconds)
+
+
+def content_hash(path, chunk_bytes=1024 * 1024):
+    """文件内容的 BLAKE2b 哈希（128 位，十六进制）。5 分钟的片段约 20 ms"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,10 @@
+"""
+wsgi.py
+
+生产环境 WSGI 入口（Web 层）：
+  gunicorn -c gunicorn.conf.py wsgi:app
+
+Web worker 不加载模型，有状态接口通过 INFERENCE_URL 转发到推理进程（inference_service.py）。
+"""
+
+from app import app  # noqa: F401